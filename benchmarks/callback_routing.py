@@ -0,0 +1,65 @@
+"""
+Сравнение стоимости маршрутизации callback-запроса: цепочка фильтров aiogram
+(lambda c: c.data == ...) против таблицы CallbackRouter.
+Нажимается кнопка последнего зарегистрированного обработчика - худший случай для цепочки.
+
+Запуск из корня репозитория: python benchmarks/callback_routing.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from aiogram import Router, types  # noqa: E402
+from callbacks import CallbackRouter  # noqa: E402
+
+HANDLER_COUNTS = (10, 35, 100, 300)
+ITERATIONS = 2000
+
+
+async def handler(callback_query):
+    return True
+
+
+def make_callback_query(data):
+    return types.CallbackQuery(
+        id='1', chat_instance='1', data=data,
+        from_user=types.User(id=1, is_bot=False, first_name='bench'),
+    )
+
+
+def build_filter_chain(count):
+    router = Router()
+    for i in range(count):
+        router.callback_query.register(handler, lambda c, data=f"button_{i}": c.data == data)
+    return router.callback_query.trigger
+
+
+def build_routing_table(count):
+    callbacks = CallbackRouter()
+    for i in range(count):
+        callbacks.register(f"button_{i}", handler)
+    return callbacks.dispatch
+
+
+async def measure(dispatch, event):
+    assert await dispatch(event) is True
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await dispatch(event)
+    return (time.perf_counter() - started) / ITERATIONS * 1e6
+
+
+async def main():
+    print(f"{'обработчиков':>12} {'цепочка фильтров, мкс':>22} {'таблица, мкс':>13}")
+    for count in HANDLER_COUNTS:
+        event = make_callback_query(f"button_{count - 1}")
+        chain = await measure(build_filter_chain(count), event)
+        table = await measure(build_routing_table(count), event)
+        print(f"{count:>12} {chain:>22.1f} {table:>13.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
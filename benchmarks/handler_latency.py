@@ -0,0 +1,267 @@
+"""
+Нагрузочный замер обработчиков бота: синтетические апдейты прогоняются через настоящий
+Dispatcher (main.create_dispatcher + register_handlers) с пулом БД и middleware бота,
+а вместо Telegram используется Bot, который только запоминает вызовы API.
+
+Сценарии виртуального пользователя (администратора), повторяются --iterations раз:
+    nav     - меню телефонов и листание страниц вперед
+    profit  - отчет по прибыли
+    stats   - статистика (TTL кэша статистики 0: запрос выполняется каждый раз,
+              но одновременные вызовы по-прежнему объединяются в один)
+    sale    - продажа непроданного телефона: кнопка "Продать" и ввод цены
+    wizard  - полный мастер добавления б/у телефона с IMEI и серийным номером
+
+Для каждого шага выводятся p50/p95/p99 времени обработки апдейта и среднее число
+запросов к БД и захватов соединений из пула за апдейт.
+
+Сценарии изменяют данные (продажи, новые телефоны), поэтому запускайте замер на отдельной базе.
+Подключение к БД - по переменным окружения бота (DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_POOL_*).
+
+Запуск из корня репозитория:
+    python benchmarks/handler_latency.py [--seed] [--users 4] [--iterations 20] [--api-latency-ms 0]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+# main.py читает настройки при импорте; токен нужен только для создания Bot
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from aiogram import BaseMiddleware, Bot  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+import main  # noqa: E402
+import seed  # noqa: E402
+from admins import admins  # noqa: E402
+from callbacks import (BrandCallback, ColorCallback, ConditionCallback, FullKitCallback,  # noqa: E402
+                       MarketCallback, ModelCallback, RepairedCallback, SellItemCallback, StorageCallback)
+from handlers import register_handlers, stats_cache  # noqa: E402
+from metrics import percentile  # noqa: E402
+from pool import update_db_stats  # noqa: E402
+from reference_cache import reference_cache  # noqa: E402
+
+FIRST_USER_ID = 900_000_000
+
+
+class BenchmarkBot(Bot):
+    """Bot без обращений к Telegram: считает вызовы API и возвращает правдоподобные ответы"""
+
+    def __init__(self, api_latency):
+        super().__init__(token=main.BOT_TOKEN)
+        self.api_latency = api_latency
+        self.calls = Counter()
+        # chat_id -> клавиатура последнего отправленного или отредактированного сообщения
+        self.last_markup = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def __call__(self, method, request_timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.last_markup[method.chat_id] = method.reply_markup
+            return Message(
+                message_id=next(self._message_ids), date=datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'), text=method.text,
+            )
+        return True
+
+
+class UpdateStatsMiddleware(BaseMiddleware):
+    """
+    Запоминает число запросов к БД и захватов соединений каждого апдейта.
+    Регистрируется после middleware бота, поэтому видит счетчики DatabaseStatsMiddleware.
+    """
+
+    def __init__(self):
+        self.by_update = {}
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            stats = update_db_stats.get()
+            if stats is not None:
+                self.by_update[event.update_id] = (stats['queries'], stats['acquires'])
+
+
+class Benchmark:
+    def __init__(self, bot, dp, update_stats):
+        self.bot = bot
+        self.dp = dp
+        self.update_stats = update_stats
+        self.update_ids = itertools.count(1)
+        # шаг -> [(мс, запросов, захватов соединения), ...]
+        self.results = defaultdict(list)
+
+    async def feed(self, step, user_id, payload):
+        update_id = next(self.update_ids)
+        update = Update.model_validate({'update_id': update_id, **payload}, context={'bot': self.bot})
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        queries, acquires = self.update_stats.by_update.pop(update_id, (0, 0))
+        self.results[step].append((elapsed_ms, queries, acquires))
+
+    async def message(self, step, user_id, text):
+        await self.feed(step, user_id, {'message': {
+            'message_id': next(self.update_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+            'text': text,
+        }})
+
+    async def callback(self, step, user_id, data):
+        await self.feed(step, user_id, {'callback_query': {
+            'id': str(next(self.update_ids)), 'chat_instance': 'bench', 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+            'message': {
+                'message_id': next(self.update_ids), 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': self.bot.id, 'is_bot': True, 'first_name': 'bot'},
+                'text': 'bench',
+            },
+        }})
+
+    def find_button(self, user_id, marker):
+        """callback_data кнопки последнего сообщения пользователю, содержащей marker"""
+        markup = self.bot.last_markup.get(user_id)
+        for row in (markup.inline_keyboard if markup else ()):
+            for button in row:
+                if button.callback_data and marker in button.callback_data:
+                    return button.callback_data
+        return None
+
+
+async def scenario_nav(bench, user_id, pages):
+    await bench.callback('nav: menu_all_phones', user_id, 'menu_all_phones')
+    for _ in range(pages):
+        data = bench.find_button(user_id, ':next:')
+        if data is None:
+            break
+        await bench.callback('nav: next page', user_id, data)
+
+
+async def scenario_sale(bench, user_id, phone_id):
+    await bench.callback('sale: sell_item', user_id, SellItemCallback(item_type='phones', item_id=phone_id).pack())
+    await bench.message('sale: price', user_id, '15000')
+
+
+async def scenario_wizard(bench, user_id, refs):
+    await bench.callback('wizard: start', user_id, 'add_phone_from_menu')
+    await bench.callback('wizard: brand', user_id, BrandCallback(id=refs['brand']).pack())
+    await bench.callback('wizard: model', user_id, ModelCallback(id=refs['model']).pack())
+    await bench.callback('wizard: storage', user_id, StorageCallback(id=refs['storage']).pack())
+    await bench.callback('wizard: market', user_id, MarketCallback(id=refs['market']).pack())
+    await bench.message('wizard: purchase price', user_id, '12000')
+    await bench.callback('wizard: color', user_id, ColorCallback(id=refs['color']).pack())
+    await bench.callback('wizard: condition', user_id, ConditionCallback(id=refs['condition']).pack())
+    await bench.message('wizard: battery', user_id, '85')
+    await bench.callback('wizard: repaired', user_id, RepairedCallback(value=False).pack())
+    await bench.callback('wizard: full kit', user_id, FullKitCallback(value=True).pack())
+    await bench.message('wizard: imei', user_id, uuid.uuid4().hex[:15])
+    await bench.message('wizard: serial (save)', user_id, uuid.uuid4().hex[:12].upper())
+
+
+async def run_user(bench, user_id, iterations, pages, phone_ids, refs):
+    for _ in range(iterations):
+        await scenario_nav(bench, user_id, pages)
+        await bench.callback('profit', user_id, 'menu_profit')
+        await bench.callback('stats', user_id, 'menu_stats')
+        if phone_ids:
+            await scenario_sale(bench, user_id, phone_ids.pop())
+        await scenario_wizard(bench, user_id, refs)
+
+
+def wizard_references():
+    """Справочные id для мастера: бренд с моделями и состояние "Б/У" (полный путь мастера)"""
+    brand = next(b for b in reference_cache.list('brands') if reference_cache.models_for_brand(b['id']))
+    condition = next(c for c in reference_cache.list('conditions') if c['name'].lower() == 'б/у')
+    return {
+        'brand': brand['id'],
+        'model': reference_cache.models_for_brand(brand['id'])[0]['id'],
+        'storage': reference_cache.list('storage_capacities')[0]['id'],
+        'market': reference_cache.list('markets')[0]['id'],
+        'color': reference_cache.list('colors')[0]['id'],
+        'condition': condition['id'],
+    }
+
+
+def print_report(results, elapsed, api_calls):
+    print(f"{'шаг':<26} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'запросов':>9} {'соедин.':>8}")
+    total = 0
+    for step, samples in results.items():
+        latencies = sorted(sample[0] for sample in samples)
+        queries = sum(sample[1] for sample in samples) / len(samples)
+        acquires = sum(sample[2] for sample in samples) / len(samples)
+        total += len(samples)
+        print(
+            f"{step:<26} {len(samples):>6} {percentile(latencies, 50):>9.2f} {percentile(latencies, 95):>9.2f} "
+            f"{percentile(latencies, 99):>9.2f} {queries:>9.2f} {acquires:>8.2f}"
+        )
+    print(f"\nАпдейтов: {total} за {elapsed:.1f} с ({total / elapsed:.0f}/с)")
+    print("Вызовы Bot API: " + ", ".join(f"{name} {count}" for name, count in api_calls.most_common()))
+
+
+async def run(args):
+    # Создание пула применяет миграции, поэтому заполнение - после него
+    await main.create_db_pool()
+    if args.seed:
+        async with main.db_pool.acquire() as connection:
+            await seed.seed(connection, args.phones, args.products, args.transactions, args.sold_share)
+    await reference_cache.load(main.db_pool)
+    stats_cache.ttl = 0
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    admins.configure(user_ids, main.ADMINS_REFRESH_TTL)
+
+    main.create_dispatcher()
+    register_handlers(main.dp)
+    update_stats = UpdateStatsMiddleware()
+    main.dp.update.outer_middleware(update_stats)
+
+    bot = BenchmarkBot(args.api_latency_ms / 1000)
+    bench = Benchmark(bot, main.dp, update_stats)
+    rows = await main.db_pool.fetch(
+        "SELECT id FROM phones WHERE NOT is_sold ORDER BY id DESC LIMIT $1;", args.users * args.iterations
+    )
+    phone_ids = [row['id'] for row in rows]
+    # Каждому пользователю - свои телефоны, чтобы продажи не конкурировали за одну строку
+    shares = [phone_ids[i::args.users] for i in range(args.users)]
+    refs = wizard_references()
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            run_user(bench, user_id, args.iterations, args.pages, share, refs)
+            for user_id, share in zip(user_ids, shares)
+        ))
+    finally:
+        elapsed = time.perf_counter() - started
+        await main.db_pool.close()
+        await bot.session.close()
+    print_report(bench.results, elapsed, bot.calls)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=4, help="одновременных пользователей")
+    parser.add_argument('--iterations', type=int, default=20, help="повторов сценариев на пользователя")
+    parser.add_argument('--pages', type=int, default=10, help="страниц листания в сценарии nav")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="задержка ответа Bot API")
+    parser.add_argument('--seed', action='store_true', help="перед замером заполнить базу (benchmarks/seed.py)")
+    seed.add_seed_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,152 @@
+"""
+Проверка планов запросов бота на заполненной базе: для каждого запроса из реестра
+(постраничный просмотр, список /products по (name, id), COUNT по is_sold, поиск по IMEI,
+проверка перед продажей) и для проверки внешнего ключа transactions.product_id
+EXPLAIN должен использовать ожидаемый индекс, а не последовательное сканирование.
+Планы проверяются и в custom-, и в generic-режиме (plan_cache_mode), так как asyncpg
+выполняет запросы как подготовленные и после нескольких вызовов PostgreSQL может
+перейти на обобщенный план.
+
+База должна содержать схему бота (python bot/migrate.py). Тестовые данные добавляются в транзакции,
+которая в конце откатывается.
+
+Запуск из корня репозитория: python benchmarks/index_plans.py [DSN]
+(по умолчанию подключение по DB_HOST, DB_NAME, DB_USER, DB_PASS).
+Те же проверки выполняет тест tests/test_index_plans.py, если доступна БД.
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+import asyncpg  # noqa: E402
+import handlers  # noqa: E402
+from queries import Query  # noqa: E402
+
+PHONES_COUNT = 50000
+PRODUCTS_COUNT = 20000
+# Доля проданных: в рабочей базе большая часть истории - проданные позиции
+SOLD_SHARE = 0.9
+
+SEED_SQL = f"""
+    INSERT INTO categories (name) SELECT 'bench-category-' || i FROM generate_series(1, 20) i;
+
+    INSERT INTO products (name, purchase_price, quantity, is_sold, category_id)
+    SELECT 'bench-product-' || i, 100 + i % 1000, 1, random() < {SOLD_SHARE},
+           (SELECT min(id) FROM categories WHERE name LIKE 'bench-category-%') + i % 20
+    FROM generate_series(1, {PRODUCTS_COUNT}) i;
+
+    INSERT INTO phones (name, purchase_price, is_sold, imei, serial_number)
+    SELECT 'bench-phone-' || i, 10000 + i % 50000, random() < {SOLD_SHARE},
+           'B' || lpad(i::text, 15, '0'), 'BSN' || i
+    FROM generate_series(1, {PHONES_COUNT}) i;
+
+    INSERT INTO transactions (phone_id, type, amount)
+    SELECT id, 'sale', purchase_price + 1000 FROM phones WHERE is_sold AND name LIKE 'bench-phone-%';
+
+    INSERT INTO transactions (product_id, type, amount)
+    SELECT id, 'sale', purchase_price + 100 FROM products WHERE is_sold AND name LIKE 'bench-product-%';
+
+    ANALYZE categories, products, phones, transactions;
+"""
+
+# Запрос, которым PostgreSQL проверяет ссылки из transactions при удалении товара
+# (RI_FKey_noaction_del); для него в 0002_query_indexes.sql создан idx_transactions_product_id
+TRANSACTIONS_BY_PRODUCT_FK_QUERY = Query('fk_transactions_product_id', """
+    SELECT 1 FROM ONLY transactions x WHERE product_id = $1 FOR KEY SHARE OF x
+""")
+
+
+def build_checks(phone_cursor, product_cursor, product_name_cursor, phone_id, product_id):
+    """Список (запрос, аргументы, индекс, который должен быть в плане)"""
+    checks = []
+    for table, page_queries, count_queries, cursor in (
+        ('phones', handlers.PHONES_PAGE_QUERIES, handlers.PHONES_COUNT_QUERIES, phone_cursor),
+        ('products', handlers.PRODUCTS_PAGE_QUERIES, handlers.PRODUCTS_COUNT_QUERIES, product_cursor),
+    ):
+        for (sold_status, direction), query in page_queries.items():
+            args = () if direction == 'first' else (10 if direction == 'offset' else cursor,)
+            # Проданные - большинство строк, их страницы читаются по первичному ключу
+            index = f'{table}_pkey' if sold_status else f'idx_{table}_available_id'
+            checks.append((query, args, index))
+        checks.append((count_queries[False], (), f'idx_{table}_available_id'))
+    checks += [
+        (handlers.PHONE_BY_IMEI_QUERY, ('B000000000000042',), 'phones_imei_key'),
+        (handlers.PHONE_BY_SERIAL_QUERY, ('BSN42',), 'phones_serial_number_key'),
+        (handlers.PHONE_LOOKUP_QUERY, ('B000000000000042',), 'idx_transactions_phone_id'),
+        (handlers.SELL_PHONE_CHECK_QUERY, (phone_id,), 'phones_pkey'),
+        (handlers.SELL_PRODUCT_CHECK_QUERY, (product_id,), 'products_pkey'),
+        # /products: первая страница и продолжение после курсора по (name, id), миграция 0003
+        (handlers.PRODUCTS_LIST_QUERY, (0,), 'idx_products_name_id'),
+        (handlers.PRODUCTS_LIST_QUERY, (product_name_cursor,), 'idx_products_name_id'),
+        (TRANSACTIONS_BY_PRODUCT_FK_QUERY, (product_id,), 'idx_transactions_product_id'),
+    ]
+    return checks
+
+
+async def explain(connection, query, args):
+    rows = await connection.fetch('EXPLAIN ' + query.sql.strip().rstrip(';'), *args)
+    return '\n'.join(row[0] for row in rows)
+
+
+async def check_plans(connection, verbose=True):
+    """Возвращает список (режим, запрос, индекс, план) для планов без ожидаемого индекса"""
+    phone_cursor = await connection.fetchval("SELECT max(id) - 1000 FROM phones")
+    product_cursor = await connection.fetchval("SELECT max(id) - 1000 FROM products")
+    # Товар из середины списка по имени - курсор следующей страницы /products
+    product_name_cursor = await connection.fetchval(
+        "SELECT id FROM products ORDER BY name, id OFFSET (SELECT count(*) / 2 FROM products) LIMIT 1"
+    )
+    phone_id = await connection.fetchval("SELECT max(id) FROM phones")
+    product_id = await connection.fetchval("SELECT max(id) FROM products")
+    checks = build_checks(phone_cursor, product_cursor, product_name_cursor, phone_id, product_id)
+
+    failures = []
+    for mode in ('force_custom_plan', 'force_generic_plan'):
+        await connection.execute(f"SET LOCAL plan_cache_mode = {mode}")
+        for query, args, index in checks:
+            plan = await explain(connection, query, args)
+            ok = index in plan
+            if verbose:
+                print(f"{'OK  ' if ok else 'FAIL'} {mode:<19} {query.name:<32} {index}")
+            if not ok:
+                failures.append((mode, query.name, index, plan))
+                if verbose:
+                    print('     ' + plan.replace('\n', '\n     '))
+    return failures
+
+
+async def run_checks(connection, verbose=True):
+    """Заполняет базу тестовыми данными, проверяет планы и откатывает данные"""
+    transaction = connection.transaction()
+    await transaction.start()
+    try:
+        await connection.execute(SEED_SQL)
+        return await check_plans(connection, verbose)
+    finally:
+        await transaction.rollback()
+
+
+async def main():
+    dsn = sys.argv[1] if len(sys.argv) > 1 else None
+    if dsn:
+        connection = await asyncpg.connect(dsn)
+    else:
+        connection = await asyncpg.connect(
+            host=os.environ.get('DB_HOST'), database=os.environ.get('DB_NAME'),
+            user=os.environ.get('DB_USER'), password=os.environ.get('DB_PASS'),
+        )
+    try:
+        failures = await run_checks(connection)
+    finally:
+        await connection.close()
+
+    if failures:
+        print(f"Запросов без ожидаемого индекса: {len(failures)}")
+        sys.exit(1)
+    print("Все запросы используют ожидаемые индексы")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
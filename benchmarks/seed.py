@@ -0,0 +1,145 @@
+"""
+Заполнение базы синтетическими данными для нагрузочных замеров.
+Телефоны и товары распределяются по существующим справочникам (бренды, модели, цвета,
+объемы памяти, рынки, состояния, категории); для проданных позиций пишутся транзакции
+продажи, остальной объем транзакций - записи поступления. После заполнения пересчитываются
+сводка shop_summary и продажи по дням daily_sales, собирается статистика планировщика.
+
+Перед заполнением применяются миграции бота (bot/migrations).
+
+Запуск из корня репозитория:
+    python benchmarks/seed.py [--phones 100000] [--products 50000] [--transactions 500000] [DSN]
+(по умолчанию подключение по DB_HOST, DB_NAME, DB_USER, DB_PASS)
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+import asyncpg  # noqa: E402
+from migrate import apply_migrations  # noqa: E402
+from queries import registry  # noqa: E402
+from sales_report import rebuild_daily_sales  # noqa: E402
+from summary import SUMMARY_REBUILD_QUERY  # noqa: E402
+
+# Случайный элемент массива id справочника
+RANDOM_ID = "{0}[1 + floor(random() * array_length({0}, 1))::int]"
+
+SEED_PHONES = f"""
+    WITH ref AS (
+        SELECT (SELECT array_agg(id) FROM models) AS models,
+               (SELECT array_agg(id) FROM colors) AS colors,
+               (SELECT array_agg(id) FROM storage_capacities) AS storages,
+               (SELECT array_agg(id) FROM markets) AS markets,
+               (SELECT array_agg(id) FROM conditions) AS conditions
+    ), rows AS (
+        SELECT i, random() < $2 AS sold, (10000 + floor(random() * 90000))::numeric(10, 2) AS price
+        FROM generate_series(1, $1) i
+    )
+    INSERT INTO phones (name, purchase_price, sale_price, model_id, color_id, storage_capacity_id, market_id,
+                        condition_id, is_sold, battery_health, repaired, full_kit, imei, serial_number)
+    SELECT 'Телефон', price, CASE WHEN sold THEN round(price * (1 + random() * 0.3)::numeric, 2) END,
+           {RANDOM_ID.format('models')}, {RANDOM_ID.format('colors')}, {RANDOM_ID.format('storages')},
+           {RANDOM_ID.format('markets')}, {RANDOM_ID.format('conditions')},
+           sold, 70 + floor(random() * 31)::int, random() < 0.1, random() < 0.7,
+           substr(md5(random()::text || i), 1, 15), upper(substr(md5(random()::text || i), 1, 12))
+    FROM rows, ref;
+"""
+
+SEED_PRODUCTS = f"""
+    WITH ref AS (
+        SELECT (SELECT array_agg(id) FROM categories) AS categories
+    ), rows AS (
+        SELECT i, random() < $2 AS sold, (100 + floor(random() * 5000))::numeric(10, 2) AS price
+        FROM generate_series(1, $1) i
+    )
+    INSERT INTO products (name, purchase_price, sale_price, quantity, is_sold, category_id)
+    SELECT 'Товар ' || i, price, CASE WHEN sold THEN round(price * (1 + random() * 0.5)::numeric, 2) END,
+           1 + floor(random() * 5)::int, sold, {RANDOM_ID.format('categories')}
+    FROM rows, ref;
+"""
+
+# Продажи проданных позиций, не более $1 записей.
+# Как в handlers.process_sale, в amount товара записывается цена за единицу
+SEED_SALES = """
+    INSERT INTO transactions (phone_id, product_id, type, amount, timestamp, description)
+    SELECT phone_id, product_id, 'sale', amount, now() - random() * interval '365 days', description
+    FROM (
+        SELECT id AS phone_id, NULL::integer AS product_id, sale_price AS amount, 'Продажа телефона' AS description
+        FROM phones WHERE is_sold
+        UNION ALL
+        SELECT NULL, id, sale_price, 'Продажа товара: ' || name
+        FROM products WHERE is_sold
+    ) sales
+    LIMIT $1;
+"""
+
+# Записи поступления до общего объема транзакций
+SEED_PURCHASES = """
+    WITH ref AS (
+        SELECT (SELECT array_agg(id) FROM phones) AS phones
+    )
+    INSERT INTO transactions (phone_id, type, amount, timestamp, description)
+    SELECT phones[1 + floor(random() * array_length(phones, 1))::int], 'purchase',
+           (10000 + floor(random() * 90000))::numeric(10, 2), now() - random() * interval '365 days',
+           'Поступление телефона'
+    FROM generate_series(1, $1), ref;
+"""
+
+
+async def seed(connection, phones, products, transactions, sold_share=0.8):
+    """Заполняет базу и возвращает число добавленных строк по таблицам"""
+    async with connection.transaction():
+        await connection.execute(SEED_PHONES, phones, sold_share)
+        await connection.execute(SEED_PRODUCTS, products, sold_share)
+        status = await connection.execute(SEED_SALES, transactions)
+        sales = int(status.split()[-1])
+        if transactions > sales:
+            await connection.execute(SEED_PURCHASES, transactions - sales)
+        await registry.fetchrow(connection, SUMMARY_REBUILD_QUERY)
+        await rebuild_daily_sales(connection)
+    await connection.execute("ANALYZE phones, products, transactions, daily_sales;")
+    return {'phones': phones, 'products': products, 'transactions': transactions}
+
+
+def add_seed_arguments(parser):
+    parser.add_argument('--phones', type=int, default=100_000)
+    parser.add_argument('--products', type=int, default=50_000)
+    parser.add_argument('--transactions', type=int, default=500_000)
+    parser.add_argument('--sold-share', type=float, default=0.8, help="доля проданных телефонов и товаров")
+
+
+async def connect(dsn=None):
+    """Подключение по DSN или по переменным окружения бота"""
+    if dsn:
+        return await asyncpg.connect(dsn)
+    return await asyncpg.connect(
+        host=os.environ.get('DB_HOST'), database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'), password=os.environ.get('DB_PASS'),
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_seed_arguments(parser)
+    parser.add_argument('dsn', nargs='?')
+    args = parser.parse_args()
+
+    connection = await connect(args.dsn)
+    try:
+        await apply_migrations(connection)
+        started = time.perf_counter()
+        counts = await seed(connection, args.phones, args.products, args.transactions, args.sold_share)
+    finally:
+        await connection.close()
+    print(
+        f"Добавлено: телефонов {counts['phones']}, товаров {counts['products']}, "
+        f"транзакций {counts['transactions']} за {time.perf_counter() - started:.1f} с"
+    )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import asyncpg
+from queries import registry
+
+logger = logging.getLogger(__name__)
+
+ADMINS_QUERY = registry.register('admins_list', "SELECT user_id FROM admins;", prepare=False)
+
+
+class AdminRegistry:
+    """
+    Множество ID администраторов: постоянные из ADMIN_IDS и, если включено,
+    дополнительные из таблицы admins, которая периодически перечитывается,
+    так что изменения ролей не требуют перезапуска бота.
+    """
+
+    def __init__(self, static_ids=frozenset(), ttl=60):
+        self.static_ids = frozenset(static_ids)
+        self.ttl = ttl
+        self.ids = self.static_ids
+
+    def configure(self, static_ids, ttl):
+        """Задает постоянных администраторов и период обновления; вызывается до load()"""
+        self.static_ids = frozenset(static_ids)
+        self.ttl = ttl
+        self.ids = self.static_ids
+
+    def is_admin(self, user_id):
+        return user_id in self.ids
+
+    async def load(self, db):
+        """Перечитывает таблицу admins; db - пул или соединение"""
+        try:
+            rows = await registry.fetch(db, ADMINS_QUERY)
+        except asyncpg.UndefinedTableError:
+            logger.warning("Таблица admins не найдена, используются только ADMIN_IDS")
+            return
+        self.ids = self.static_ids | frozenset(row['user_id'] for row in rows)
+
+    async def refresh_periodically(self, db_pool):
+        """Фоновое обновление списка администраторов из БД по TTL"""
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.load(db_pool)
+            except Exception as e:
+                logger.warning("Ошибка обновления списка администраторов: %s", e)
+
+
+# Единственный экземпляр на процесс; настраивается в main.py
+admins = AdminRegistry()
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+
+class TTLCache:
+    """
+    Кэш результатов с коротким временем жизни и защитой от одновременных пересчетов:
+    если значение устарело и уже вычисляется, остальные вызовы ждут тот же результат.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._values = {}
+        self._pending = {}
+
+    async def get_or_compute(self, key, factory):
+        """Возвращает значение по ключу, при необходимости вычисляя его через await factory()"""
+        while True:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # Отменен сам ожидающий вызов
+                    raise
+                # Отменен вызов, начавший вычисление: один из ожидающих начинает его заново
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await factory()
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие вызовы, для самого future оно считается обработанным
+            future.exception()
+            raise
+        except BaseException:
+            # Отмена касается только этого вызова, ожидающие повторят вычисление сами
+            future.cancel()
+            raise
+        else:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
+
+    def invalidate(self, key=None):
+        """Сбрасывает одно значение или весь кэш"""
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
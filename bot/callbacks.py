@@ -0,0 +1,153 @@
+from typing import Optional
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.event.handler import FilterObject, HandlerObject
+from aiogram.filters.callback_data import CallbackData
+
+
+# --- Фабрики callback_data (формат "префикс:поле1:поле2") ---
+class ProductsNavCallback(CallbackData, prefix='nav_products'):
+    """Навигация по товарам: "nav_products:6:next:120" (индекс, направление, id курсора)"""
+    index: int
+    direction: Optional[str] = None
+    cursor: Optional[int] = None
+
+
+class PhonesNavCallback(CallbackData, prefix='nav_phones'):
+    """Навигация по телефонам, формат как у ProductsNavCallback"""
+    index: int
+    direction: Optional[str] = None
+    cursor: Optional[int] = None
+
+
+class EditItemCallback(CallbackData, prefix='edit_item'):
+    item_type: str
+    item_id: int
+
+
+class SellItemCallback(CallbackData, prefix='sell_item'):
+    item_type: str
+    item_id: int
+
+
+class CategoryCallback(CallbackData, prefix='category'):
+    id: int
+
+
+class ConditionCallback(CallbackData, prefix='condition'):
+    id: int
+
+
+class BrandCallback(CallbackData, prefix='brand'):
+    id: int
+
+
+class ModelCallback(CallbackData, prefix='model'):
+    id: int
+
+
+class StorageCallback(CallbackData, prefix='storage'):
+    id: int
+
+
+class MarketCallback(CallbackData, prefix='market'):
+    id: int
+
+
+class ColorCallback(CallbackData, prefix='color'):
+    id: int
+
+
+class RepairedCallback(CallbackData, prefix='repaired'):
+    value: bool
+
+
+class FullKitCallback(CallbackData, prefix='full_kit'):
+    value: bool
+
+
+class ProductsListCallback(CallbackData, prefix='products_list'):
+    """Страница /products: "products_list:120" - строки после товара с id 120 (0 - первая страница)"""
+    after_id: int
+
+
+class CategoriesListCallback(CallbackData, prefix='categories_list'):
+    """Страница /categories, формат как у ProductsListCallback"""
+    after_id: int
+
+
+class SalesReportCallback(CallbackData, prefix='sales_report'):
+    """Отчет о продажах за последние интервалы: "sales_report:week" (day, week или month)"""
+    period: str
+
+
+def get_nav_callback_factory(item_type):
+    """Фабрика callback_data навигации для 'products' или 'phones'"""
+    return PhonesNavCallback if item_type == 'phones' else ProductsNavCallback
+
+
+class CallbackRouter:
+    """
+    Таблица маршрутов для callback-запросов. Регистрируется в диспетчере одним обработчиком:
+    callback_data разбирается один раз на префикс и аргументы, и обработчик ищется в словаре
+    по префиксу, а не перебором фильтров всех зарегистрированных обработчиков.
+    Фильтры маршрута (StateFilter, IsAdminFilter и т.п.) проверяются только у найденных обработчиков.
+    """
+
+    def __init__(self):
+        # префикс -> (фабрика CallbackData или None, [HandlerObject, ...])
+        self.routes = {}
+
+    def register(self, key, handler, *filters):
+        """
+        key: точное значение callback_data (строка) или класс CallbackData -
+        тогда обработчик получит разобранные данные в параметре callback_data.
+        """
+        if isinstance(key, str):
+            prefix, factory = key, None
+        else:
+            prefix, factory = key.__prefix__, key
+        route = self.routes.setdefault(prefix, (factory, []))
+        if route[0] is not factory:
+            raise ValueError(f"Префикс {prefix} уже зарегистрирован с другой фабрикой")
+        route[1].append(HandlerObject(callback=handler, filters=[FilterObject(f) for f in filters]))
+
+    def resolve(self, data):
+        """Находит маршрут по callback_data. Возвращает (обработчики, callback_data) или (None, None)"""
+        route = self.routes.get(data)
+        if route is not None and route[0] is None:
+            return route[1], None
+
+        prefix, separator, _ = data.partition(':')
+        if not separator:
+            # Старые кнопки вида "brand_5" / "full_kit_yes"
+            prefix, separator, value = data.rpartition('_')
+            data = f"{prefix}:{value}"
+        route = self.routes.get(prefix)
+        if route is None or route[0] is None:
+            return None, None
+
+        factory = route[0]
+        # Недостающие необязательные поля старых кнопок ("nav_phones:5") считаются пустыми
+        missing = len(factory.model_fields) - data.count(':')
+        if missing > 0:
+            data += ':' * missing
+        try:
+            return route[1], factory.unpack(data)
+        except (TypeError, ValueError):
+            return None, None
+
+    async def dispatch(self, callback_query, **kwargs):
+        """Единственный обработчик callback-запросов диспетчера"""
+        handlers, callback_data = self.resolve(callback_query.data or '')
+        if handlers is None:
+            return UNHANDLED
+        if callback_data is not None:
+            kwargs['callback_data'] = callback_data
+
+        for handler in handlers:
+            kwargs['handler'] = handler
+            passed, data = await handler.check(callback_query, **kwargs)
+            if passed:
+                kwargs.update(data)
+                return await handler.call(callback_query, **kwargs)
+        return UNHANDLED
@@ -0,0 +1,126 @@
+# Выгрузка телефонов, товаров и транзакций в CSV для администратора (/export).
+# Строки передаются из PostgreSQL через COPY ... TO STDOUT прямо во временный файл,
+# который затем отправляется документом, поэтому расход памяти не зависит от объема данных.
+# Колонки телефонов и товаров совпадают с форматом импорта (importer.py).
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+from queries import registry
+
+EXPORT_DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d')
+# Лимит Bot API на размер отправляемого документа
+EXPORT_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+# COPY оборачивает запрос в скобки, поэтому ';' в конце не ставится.
+# $1, $2 - границы периода [с, по) или NULL
+PHONES_EXPORT_QUERY = registry.register('export_phones', """
+    SELECT p.id, p.name, b.name AS brand, m.name AS model, s.capacity_gb AS storage, c.name AS color,
+           ma.name AS market, cond.name AS condition, p.purchase_price, p.sale_price, p.battery_health,
+           p.repaired, p.full_kit, p.imei, p.serial_number, p.is_sold, p.created_at
+    FROM phones p
+    LEFT JOIN models m ON p.model_id = m.id
+    LEFT JOIN brands b ON m.brand_id = b.id
+    LEFT JOIN colors c ON p.color_id = c.id
+    LEFT JOIN storage_capacities s ON p.storage_capacity_id = s.id
+    LEFT JOIN markets ma ON p.market_id = ma.id
+    LEFT JOIN conditions cond ON p.condition_id = cond.id
+    WHERE ($1::date IS NULL OR p.created_at >= $1) AND ($2::date IS NULL OR p.created_at < $2)
+    ORDER BY p.id
+""", prepare=False)
+
+# У товаров нет даты поступления, период к ним не применяется
+PRODUCTS_EXPORT_QUERY = registry.register('export_products', """
+    SELECT p.id, p.name, c.name AS category, p.purchase_price, p.sale_price, p.quantity, p.is_sold
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    ORDER BY p.id
+""", prepare=False)
+
+TRANSACTIONS_EXPORT_QUERY = registry.register('export_transactions', """
+    SELECT id, timestamp, type, amount, phone_id, product_id, description
+    FROM transactions
+    WHERE ($1::date IS NULL OR timestamp >= $1) AND ($2::date IS NULL OR timestamp < $2)
+    ORDER BY id
+""", prepare=False)
+
+# Вид выгрузки -> (запрос, поддерживает ли период)
+EXPORT_KINDS = {
+    'phones': (PHONES_EXPORT_QUERY, True),
+    'products': (PRODUCTS_EXPORT_QUERY, False),
+    'transactions': (TRANSACTIONS_EXPORT_QUERY, True),
+}
+
+
+def parse_export_date(value):
+    for date_format in EXPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неверная дата '{value}', используйте ДД.ММ.ГГГГ")
+
+
+def parse_export_args(args):
+    """
+    'transactions 01.09.2026 30.09.2026' -> ('transactions', date(2026, 9, 1), date(2026, 10, 1)).
+    Дата "по" включительная, поэтому верхняя граница сдвигается на день.
+    """
+    parts = (args or '').split()
+    if not parts or parts[0].lower() not in EXPORT_KINDS or len(parts) > 3:
+        raise ValueError("Использование: /export phones|products|transactions [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]")
+    date_from = parse_export_date(parts[1]) if len(parts) > 1 else None
+    date_to = parse_export_date(parts[2]) + timedelta(days=1) if len(parts) > 2 else None
+    if date_from and date_to and date_from >= date_to:
+        raise ValueError("Дата начала периода позже даты окончания")
+    return parts[0].lower(), date_from, date_to
+
+
+def export_filename(kind, date_from=None, date_to=None):
+    if date_from or date_to:
+        start = date_from.isoformat() if date_from else 'start'
+        end = (date_to - timedelta(days=1)).isoformat() if date_to else date.today().isoformat()
+        return f"{kind}_{start}_{end}.csv"
+    return f"{kind}_{date.today().isoformat()}.csv"
+
+
+async def export_to_file(db_pool, kind, date_from=None, date_to=None):
+    """
+    Выгружает данные во временный CSV-файл. Возвращает (путь, число строк);
+    файл удаляет вызывающий после отправки.
+    """
+    query, has_period = EXPORT_KINDS[kind]
+    args = (date_from, date_to) if has_period else ()
+    fd, path = tempfile.mkstemp(prefix=f'export_{kind}_', suffix='.csv')
+    os.close(fd)
+    try:
+        async with db_pool.acquire() as connection:
+            rows = await registry.copy_to(connection, query, *args, output=path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows
+
+
+def _gzip_file(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return path + '.gz'
+
+
+async def fit_document_size(path):
+    """
+    Сжимает выгрузку в .gz, если она не помещается в лимит документа Bot API.
+    Возвращает путь к файлу для отправки или None, если и сжатый файл слишком велик.
+    """
+    if os.path.getsize(path) <= EXPORT_MAX_DOCUMENT_SIZE:
+        return path
+    # Сжатие в потоке, чтобы не блокировать цикл событий
+    path = await asyncio.to_thread(_gzip_file, path)
+    if os.path.getsize(path) <= EXPORT_MAX_DOCUMENT_SIZE:
+        return path
+    os.remove(path)
+    return None
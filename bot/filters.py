@@ -2,7 +2,7 @@ from aiogram import types
 from aiogram.filters import BaseFilter
 
 class IsAdminFilter(BaseFilter):
-    admin_ids: list
+    """Пропускает только администраторов; признак is_admin вычисляет AdminMiddleware"""
 
-    async def __call__(self, message: types.Message) -> bool:
-        return message.from_user.id in self.admin_ids
\ No newline at end of file
+    async def __call__(self, event: types.TelegramObject, is_admin: bool = False) -> bool:
+        return is_admin
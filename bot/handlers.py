@@ -1,141 +1,148 @@
-from aiogram import Dispatcher, types
-from aiogram.filters import CommandStart, Command, StateFilter
+import asyncio
+import logging
+from aiogram import Dispatcher, F, types
+from aiogram.types import FSInputFile
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters import CommandStart, Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from states import CategoryCreation, ProductCreation, SaleProcess
 from keyboards import get_main_keyboard, get_admin_keyboard, get_sale_price_keyboard, get_conditions_keyboard, \
     get_categories_keyboard, get_yes_no_keyboard, get_brands_keyboard, get_models_keyboard, \
     get_colors_keyboard_from_db, get_storage_keyboard, get_markets_keyboard, get_skip_keyboard, get_menu_keyboard, \
     get_item_navigation_keyboard, get_back_to_menu_keyboard, get_success_menu_keyboard, \
-    get_products_submenu_keyboard, get_phones_submenu_keyboard
+    get_products_submenu_keyboard, get_phones_submenu_keyboard, get_list_page_keyboard, get_sales_report_keyboard
 from filters import IsAdminFilter
+from callbacks import CallbackRouter, ProductsNavCallback, PhonesNavCallback, EditItemCallback, SellItemCallback, \
+    CategoryCallback, ConditionCallback, BrandCallback, ModelCallback, StorageCallback, MarketCallback, ColorCallback, \
+    RepairedCallback, FullKitCallback, ProductsListCallback, CategoriesListCallback, SalesReportCallback
+from reference_cache import reference_cache
+from cache import TTLCache
+from metrics import metrics
+from summary import add_stock, get_summary, rebuild_summary
+from search import SEARCH_MIN_QUERY_LENGTH, search_phones, search_products, format_phone_title, \
+    format_phone_details, format_product_details
+from queries import registry
+from importer import IMPORT_EXTENSIONS, IMPORT_MAX_FILE_SIZE, ImportFileError, import_file
+from exporter import EXPORT_KINDS, export_filename, export_to_file, fit_document_size, parse_export_args
+from sales_report import format_sales_report, get_sales_report, parse_sales_args, default_range, rebuild_daily_sales, \
+    SALES_PERIODS
+import os
 from functools import partial
 import asyncpg
 from decimal import Decimal
 
+logger = logging.getLogger(__name__)
+
 
 # --- Функции регистрации обработчиков ---
-def register_handlers(dp: Dispatcher, admin_ids: list, db_pool):
-    IsAdminFilter.admin_ids = admin_ids
+def register_handlers(dp: Dispatcher):
+    # Соединение с БД передается обработчикам в параметре db_pool через DatabaseSessionMiddleware,
+    # признак администратора - в параметре is_admin через AdminMiddleware
 
     # Основные обработчики
     dp.message.register(handle_start, CommandStart())
     dp.message.register(handle_help, Command("help"))
     dp.message.register(handle_menu, Command("menu"))
-    dp.message.register(partial(list_categories, db_pool=db_pool), Command("categories"))
-    dp.message.register(partial(list_products, db_pool=db_pool), Command("products"))
-    
+    dp.message.register(list_categories, Command("categories"))
+    dp.message.register(list_products, Command("products"))
+    dp.message.register(handle_sales_report, Command("sales"))
+    # Поиск показывает IMEI, закупочные цены и продажи - только для администраторов
+    dp.message.register(handle_find, Command("find"), IsAdminFilter())
+    dp.message.register(handle_imei_lookup, Command("imei"), IsAdminFilter())
+    dp.inline_query.register(handle_inline_search)
+    dp.message.register(handle_rebuild_summary, Command("rebuild_summary"), IsAdminFilter())
+    dp.message.register(handle_metrics, Command("metrics"), IsAdminFilter())
+    dp.message.register(handle_import_help, Command("import"), IsAdminFilter())
+    dp.message.register(handle_export, Command("export"), IsAdminFilter())
+    # Регистрируется раньше обработчиков состояний: файл импорта принимается на любом шаге
+    dp.message.register(handle_import_document, F.document, IsAdminFilter())
+    
+    # Callback-запросы маршрутизируются по префиксу callback_data через таблицу CallbackRouter
+    callbacks = CallbackRouter()
+    dp.callback_query.register(callbacks.dispatch)
+
     # Обработчики меню
-    dp.callback_query.register(partial(handle_menu_all_products, db_pool=db_pool),
-                               lambda c: c.data == "menu_all_products")
-    dp.callback_query.register(partial(handle_menu_all_phones, db_pool=db_pool),
-                               lambda c: c.data == "menu_all_phones")
-    dp.callback_query.register(partial(handle_menu_profit, db_pool=db_pool),
-                               lambda c: c.data == "menu_profit")
-    dp.callback_query.register(partial(handle_menu_stats, db_pool=db_pool),
-                               lambda c: c.data == "menu_stats")
-    
+    callbacks.register("menu_all_products", handle_menu_all_products)
+    callbacks.register("menu_all_phones", handle_menu_all_phones)
+    callbacks.register("menu_profit", handle_menu_profit)
+    callbacks.register(SalesReportCallback, handle_sales_report_callback)
+    callbacks.register("menu_stats", handle_menu_stats)
+
     # Обработчики подменю
-    dp.callback_query.register(partial(handle_products_submenu, db_pool=db_pool),
-                               lambda c: c.data == "products_submenu")
-    dp.callback_query.register(partial(handle_phones_submenu, db_pool=db_pool),
-                               lambda c: c.data == "phones_submenu")
-    dp.callback_query.register(partial(handle_products_available, db_pool=db_pool),
-                               lambda c: c.data == "products_available")
-    dp.callback_query.register(partial(handle_products_sold, db_pool=db_pool),
-                               lambda c: c.data == "products_sold")
-    dp.callback_query.register(partial(handle_phones_available, db_pool=db_pool),
-                               lambda c: c.data == "phones_available")
-    dp.callback_query.register(partial(handle_phones_sold, db_pool=db_pool),
-                               lambda c: c.data == "phones_sold")
-    
+    callbacks.register("products_submenu", handle_products_submenu)
+    callbacks.register("phones_submenu", handle_phones_submenu)
+    callbacks.register("products_available", handle_products_available)
+    callbacks.register("products_sold", handle_products_sold)
+    callbacks.register("phones_available", handle_phones_available)
+    callbacks.register("phones_sold", handle_phones_sold)
+
     # Обработчики навигации
-    dp.callback_query.register(partial(handle_back_to_menu, db_pool=db_pool),
-                               lambda c: c.data == "back_to_menu")
-    dp.callback_query.register(partial(handle_nav_products, db_pool=db_pool),
-                               lambda c: c.data.startswith("nav_products:"))
-    dp.callback_query.register(partial(handle_nav_phones, db_pool=db_pool),
-                               lambda c: c.data.startswith("nav_phones:"))
-    dp.callback_query.register(partial(handle_edit_item, db_pool=db_pool),
-                               lambda c: c.data.startswith("edit_item:"))
-    dp.callback_query.register(partial(handle_sell_item, db_pool=db_pool),
-                               lambda c: c.data.startswith("sell_item:"))
-    
+    callbacks.register("back_to_menu", handle_back_to_menu)
+    callbacks.register(ProductsNavCallback, handle_nav_products)
+    callbacks.register(PhonesNavCallback, handle_nav_phones)
+    callbacks.register(EditItemCallback, handle_edit_item)
+    callbacks.register(SellItemCallback, handle_sell_item)
+    callbacks.register(CategoriesListCallback, handle_categories_page)
+    callbacks.register(ProductsListCallback, handle_products_page)
+
     # Обработчики добавления товаров из меню навигации
-    dp.callback_query.register(partial(handle_add_product_from_menu, db_pool=db_pool),
-                               lambda c: c.data == "add_product_from_menu", IsAdminFilter())
-    dp.callback_query.register(partial(handle_add_phone_from_menu, db_pool=db_pool),
-                               lambda c: c.data == "add_phone_from_menu", IsAdminFilter())
-    
+    callbacks.register("add_product_from_menu", handle_add_product_from_menu, IsAdminFilter())
+    callbacks.register("add_phone_from_menu", handle_add_phone_from_menu, IsAdminFilter())
+
     # Обработчики "Добавить еще" товары
-    dp.callback_query.register(partial(handle_add_another_product, db_pool=db_pool),
-                               lambda c: c.data == "add_another_product", IsAdminFilter())
-    dp.callback_query.register(partial(handle_add_another_phone, db_pool=db_pool),
-                               lambda c: c.data == "add_another_phone", IsAdminFilter())
-    
+    callbacks.register("add_another_product", handle_add_another_product, IsAdminFilter())
+    callbacks.register("add_another_phone", handle_add_another_phone, IsAdminFilter())
+
     # Обработчик для процесса продажи
-    dp.message.register(partial(handle_sale_price_input, db_pool=db_pool),
+    dp.message.register(handle_sale_price_input,
                         StateFilter(SaleProcess.waiting_for_sale_price), IsAdminFilter())
 
     # Обработчики для создания категории
-    dp.callback_query.register(partial(handle_create_category_callback, db_pool=db_pool),
-                               lambda c: c.data == "create_category_btn", IsAdminFilter())
-    dp.message.register(partial(handle_category_name, db_pool=db_pool), StateFilter(CategoryCreation.waiting_for_name),
+    callbacks.register("create_category_btn", handle_create_category_callback, IsAdminFilter())
+    dp.message.register(handle_category_name, StateFilter(CategoryCreation.waiting_for_name),
                         IsAdminFilter())
 
     # Обработчики для создания продукта
-    dp.callback_query.register(partial(handle_create_product_callback, db_pool=db_pool),
-                               lambda c: c.data == "create_product_btn", IsAdminFilter())
-    dp.message.register(partial(handle_product_name, db_pool=db_pool), StateFilter(ProductCreation.waiting_for_name),
+    callbacks.register("create_product_btn", handle_create_product_callback, IsAdminFilter())
+    dp.message.register(handle_product_name, StateFilter(ProductCreation.waiting_for_name),
                         IsAdminFilter())
-    dp.callback_query.register(partial(handle_product_category, db_pool=db_pool),
-                               lambda c: c.data.startswith('category_'),
-                               StateFilter(ProductCreation.waiting_for_category), IsAdminFilter())
-    dp.message.register(partial(handle_product_purchase_price, db_pool=db_pool),
+    callbacks.register(CategoryCallback, handle_product_category,
+                       StateFilter(ProductCreation.waiting_for_category), IsAdminFilter())
+    dp.message.register(handle_product_purchase_price,
                         StateFilter(ProductCreation.waiting_for_purchase_price), IsAdminFilter())
-    dp.callback_query.register(partial(handle_skip_sale_price, db_pool=db_pool), lambda c: c.data == 'skip_sale_price',
-                               StateFilter(ProductCreation.waiting_for_quantity))
-    dp.message.register(partial(handle_product_quantity, db_pool=db_pool),
+    callbacks.register("skip_sale_price", handle_skip_sale_price, StateFilter(ProductCreation.waiting_for_quantity))
+    dp.message.register(handle_product_quantity,
                         StateFilter(ProductCreation.waiting_for_quantity), IsAdminFilter())
-    dp.callback_query.register(partial(handle_product_condition, db_pool=db_pool),
-                               lambda c: c.data.startswith('condition_'),
-                               StateFilter(ProductCreation.waiting_for_condition), IsAdminFilter())
-    
+    callbacks.register(ConditionCallback, handle_product_condition,
+                       StateFilter(ProductCreation.waiting_for_condition), IsAdminFilter())
+
     # Специальные обработчики для телефонов (расширенный flow)
-    dp.callback_query.register(partial(handle_brand_selection, db_pool=db_pool),
-                               lambda c: c.data.startswith('brand_'),
-                               StateFilter(ProductCreation.waiting_for_brand), IsAdminFilter())
-    dp.callback_query.register(partial(handle_model_selection, db_pool=db_pool),
-                               lambda c: c.data.startswith('model_'),
-                               StateFilter(ProductCreation.waiting_for_model), IsAdminFilter())
-    dp.callback_query.register(partial(handle_storage_selection, db_pool=db_pool),
-                               lambda c: c.data.startswith('storage_'),
-                               StateFilter(ProductCreation.waiting_for_storage_capacity), IsAdminFilter())
-    dp.callback_query.register(partial(handle_market_selection, db_pool=db_pool),
-                               lambda c: c.data.startswith('market_'),
-                               StateFilter(ProductCreation.waiting_for_market), IsAdminFilter())
-    dp.callback_query.register(partial(handle_color_selection, db_pool=db_pool),
-                               lambda c: c.data.startswith('color_'),
-                               StateFilter(ProductCreation.waiting_for_color), IsAdminFilter())
-    dp.message.register(partial(handle_battery_health, db_pool=db_pool),
+    callbacks.register(BrandCallback, handle_brand_selection,
+                       StateFilter(ProductCreation.waiting_for_brand), IsAdminFilter())
+    callbacks.register(ModelCallback, handle_model_selection,
+                       StateFilter(ProductCreation.waiting_for_model), IsAdminFilter())
+    callbacks.register(StorageCallback, handle_storage_selection,
+                       StateFilter(ProductCreation.waiting_for_storage_capacity), IsAdminFilter())
+    callbacks.register(MarketCallback, handle_market_selection,
+                       StateFilter(ProductCreation.waiting_for_market), IsAdminFilter())
+    callbacks.register(ColorCallback, handle_color_selection,
+                       StateFilter(ProductCreation.waiting_for_color), IsAdminFilter())
+    dp.message.register(handle_battery_health,
                         StateFilter(ProductCreation.waiting_for_battery_health), IsAdminFilter())
-    dp.callback_query.register(partial(handle_repaired, db_pool=db_pool),
-                               lambda c: c.data.startswith('repaired_'),
-                               StateFilter(ProductCreation.waiting_for_repaired), IsAdminFilter())
-    dp.callback_query.register(partial(handle_full_kit, db_pool=db_pool),
-                               lambda c: c.data.startswith('full_kit_'),
-                               StateFilter(ProductCreation.waiting_for_full_kit), IsAdminFilter())
-    
+    callbacks.register(RepairedCallback, handle_repaired,
+                       StateFilter(ProductCreation.waiting_for_repaired), IsAdminFilter())
+    callbacks.register(FullKitCallback, handle_full_kit,
+                       StateFilter(ProductCreation.waiting_for_full_kit), IsAdminFilter())
+
     # Обработчики для IMEI и серийного номера
-    dp.message.register(partial(handle_imei_input, db_pool=db_pool),
+    dp.message.register(handle_imei_input,
                         StateFilter(ProductCreation.waiting_for_imei), IsAdminFilter())
-    dp.callback_query.register(partial(handle_imei_skip, db_pool=db_pool),
-                               lambda c: c.data == 'skip_imei',
-                               StateFilter(ProductCreation.waiting_for_imei), IsAdminFilter())
-    dp.message.register(partial(handle_serial_input, db_pool=db_pool),
+    callbacks.register("skip_imei", handle_imei_skip,
+                       StateFilter(ProductCreation.waiting_for_imei), IsAdminFilter())
+    dp.message.register(handle_serial_input,
                         StateFilter(ProductCreation.waiting_for_serial_number), IsAdminFilter())
-    dp.callback_query.register(partial(handle_serial_skip, db_pool=db_pool),
-                               lambda c: c.data == 'skip_serial',
-                               StateFilter(ProductCreation.waiting_for_serial_number), IsAdminFilter())
+    callbacks.register("skip_serial", handle_serial_skip,
+                       StateFilter(ProductCreation.waiting_for_serial_number), IsAdminFilter())
 
 
 # --- Основные обработчики ---
@@ -144,7 +151,7 @@ async def handle_start(message: types.Message):
                         reply_markup=get_main_keyboard())
 
 
-async def handle_help(message: types.Message):
+async def handle_help(message: types.Message, is_admin: bool = False):
     help_text = (
         "Список доступных команд:\n\n"
         "*Общие команды:*\n"
@@ -152,17 +159,24 @@ async def handle_help(message: types.Message):
         "/help \\- Показать это сообщение\\.\n"
         "/menu \\- Показать главное меню с быстрым доступом\\.\n"
         "/categories \\- Показать список всех категорий\\.\n"
-        "/products \\- Показать список всех товаров\\.\n\n"
+        "/products \\- Показать список всех товаров\\.\n"
+        "/sales day\\|week\\|month \\[с\\] \\[по\\] \\- Выручка и маржа по дням, неделям или месяцам\\.\n\n"
+    )
+    admin_help_text = (
         "*Команды для администраторов:*\n"
+        "/find <запрос\\> \\- Найти телефон или товар по бренду, модели, цвету, IMEI или серийному номеру\\.\n"
+        "/imei <номер\\> \\- Найти телефон по IMEI или серийному номеру и показать его продажу\\.\n"
+        "Поиск работает и в inline\\-режиме: наберите @имя\\_бота и запрос в любом чате\\.\n"
+        "/rebuild\\_summary \\- Пересчитать сводку прибыли и сверить её с текущей\\.\n"
+        "/metrics \\- Показать метрики производительности бота\\.\n"
+        "/import \\- Формат файла для массового добавления телефонов и товаров \\(CSV или XLSX\\)\\.\n"
+        "/export phones\\|products\\|transactions \\[с\\] \\[по\\] \\- Выгрузить данные в CSV, даты ДД\\.ММ\\.ГГГГ\\.\n"
         "Чтобы добавить категорию или продукт, нажмите соответствующие кнопки в меню\\."
     )
 
-    if message.from_user.id in IsAdminFilter.admin_ids:
-        await message.reply(help_text, reply_markup=get_admin_keyboard(), parse_mode='MarkdownV2')
+    if is_admin:
+        await message.reply(help_text + admin_help_text, reply_markup=get_admin_keyboard(), parse_mode='MarkdownV2')
     else:
-        help_text = help_text.replace(
-            "*Команды для администраторов:*\nЧтобы добавить категорию или продукт, нажмите соответствующие кнопки в меню\\.",
-            "")
         await message.reply(help_text, parse_mode='MarkdownV2')
 
 async def handle_menu(message: types.Message):
@@ -177,43 +191,46 @@ async def handle_create_category_callback(callback_query: types.CallbackQuery, s
     await state.set_state(CategoryCreation.waiting_for_name)
 
 
+CATEGORY_INSERT_QUERY = registry.register(
+    'category_insert',
+    "INSERT INTO categories (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id;",
+    prepare=False
+)
+
+
 async def handle_category_name(message: types.Message, state: FSMContext, db_pool):
     category_name = message.text.strip()
     if not category_name:
         await message.reply("Название не может быть пустым. Попробуйте еще раз.")
         return
 
-    async with db_pool.acquire() as connection:
-        async with connection.transaction():
-            try:
-                result = await connection.fetchrow(
-                    "INSERT INTO categories (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id;",
-                    category_name
-                )
+    try:
+        async with db_pool.acquire() as connection:
+            async with connection.transaction():
+                result = await registry.fetchrow(connection, CATEGORY_INSERT_QUERY, category_name)
                 if result:
-                    await message.reply(f"Категория '{category_name}' (ID: {result['id']}) успешно добавлена.")
-                else:
-                    await message.reply(f"Категория '{category_name}' уже существует.")
-            except Exception as e:
-                await message.reply(f"Произошла ошибка при добавлении категории: {e}")
-            finally:
-                await state.clear()
+                    await reference_cache.reload(connection, 'categories')
+        if result:
+            await message.reply(f"Категория '{category_name}' (ID: {result['id']}) успешно добавлена.")
+        else:
+            await message.reply(f"Категория '{category_name}' уже существует.")
+    except Exception as e:
+        await message.reply(f"Произошла ошибка при добавлении категории: {e}")
+    finally:
+        await state.clear()
 
 
 # --- Обработчики для создания продукта ---
 async def handle_create_product_callback(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    
-    async with db_pool.acquire() as connection:
-        categories = await connection.fetch("SELECT id, name FROM categories;")
 
-    if not categories:
+    if not reference_cache.list('categories'):
         await callback_query.message.reply("В базе нет ни одной категории. Добавьте их, прежде чем создавать продукт.")
         await state.clear()
         return
 
     await callback_query.message.reply("Отлично, давайте добавим новый продукт. Выберите категорию товара:", 
-                                       reply_markup=get_categories_keyboard(categories))
+                                       reply_markup=get_categories_keyboard())
     await state.set_state(ProductCreation.waiting_for_category)
 
 
@@ -228,23 +245,19 @@ async def handle_product_name(message: types.Message, state: FSMContext, db_pool
 async def handle_product_purchase_price(message: types.Message, state: FSMContext, db_pool):
     try:
         price = float(message.text.replace(',', '.'))
-        await state.update_data(purchase_price=price)
-        
-        user_data = await state.get_data()
+        user_data = await state.update_data(purchase_price=price)
         is_phone = user_data.get('is_phone', False)
         
         if is_phone:
             # Для телефонов пропускаем цену продажи и переходим к выбору цвета из БД
             await state.update_data(sale_price=None)
-            async with db_pool.acquire() as connection:
-                colors = await connection.fetch("SELECT id, name FROM colors ORDER BY name;")
 
-            if not colors:
+            if not reference_cache.list('colors'):
                 await message.reply("В базе нет цветов для выбора.")
                 await state.clear()
                 return
 
-            await message.reply("Выберите цвет:", reply_markup=get_colors_keyboard_from_db(colors))
+            await message.reply("Выберите цвет:", reply_markup=get_colors_keyboard_from_db())
             await state.set_state(ProductCreation.waiting_for_color)
         else:
             # Для обычных товаров запрашиваем цену продажи
@@ -285,23 +298,19 @@ async def handle_product_quantity(message: types.Message, state: FSMContext, db_
 
     try:
         quantity = int(message.text)
-        await state.update_data(quantity=quantity)
         
         # Проверяем, это телефон или обычный товар
-        user_data = await state.get_data()
+        user_data = await state.update_data(quantity=quantity)
         is_phone = user_data.get('is_phone', False)
         
         if is_phone:
             # Для телефонов переходим к выбору состояния (у телефонов остались поля color и condition)
-            async with db_pool.acquire() as connection:
-                conditions = await connection.fetch("SELECT id, name FROM conditions;")
-
-            if not conditions:
+            if not reference_cache.list('conditions'):
                 await message.reply("В базе нет ни одного состояния. Добавьте их, прежде чем создавать продукт.")
                 await state.clear()
                 return
 
-            await message.reply("Выберите состояние товара:", reply_markup=get_conditions_keyboard(conditions))
+            await message.reply("Выберите состояние товара:", reply_markup=get_conditions_keyboard())
             await state.set_state(ProductCreation.waiting_for_condition)
         else:
             # Для обычных товаров сразу сохраняем в базу (без цвета и состояния)
@@ -313,13 +322,13 @@ async def handle_product_quantity(message: types.Message, state: FSMContext, db_
 
 
 
-async def handle_product_condition(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_product_condition(callback_query: types.CallbackQuery, callback_data: ConditionCallback,
+                                   state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    condition_id = int(callback_query.data.split('_')[1])
+    condition_id = callback_data.id
     
     # Получаем название состояния
-    async with db_pool.acquire() as connection:
-        condition_result = await connection.fetchrow("SELECT name FROM conditions WHERE id = $1", condition_id)
+    condition_result = reference_cache.get('conditions', condition_id)
     
     if not condition_result:
         await callback_query.message.reply("Ошибка: состояние не найдено.")
@@ -327,9 +336,7 @@ async def handle_product_condition(callback_query: types.CallbackQuery, state: F
         return
         
     condition_name = condition_result['name']
-    await state.update_data(condition_id=condition_id, condition_name=condition_name)
-    
-    user_data = await state.get_data()
+    user_data = await state.update_data(condition_id=condition_id, condition_name=condition_name)
     is_phone = user_data.get('is_phone', False)
     is_used = condition_name.lower() == "б/у"
     
@@ -354,13 +361,13 @@ async def handle_product_condition(callback_query: types.CallbackQuery, state: F
         await save_phone_to_db(callback_query.message, state, db_pool)
 
 
-async def handle_product_category(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_product_category(callback_query: types.CallbackQuery, callback_data: CategoryCallback,
+                                  state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    category_id = int(callback_query.data.split('_')[1])
+    category_id = callback_data.id
     
     # Получаем название категории для определения типа продукта
-    async with db_pool.acquire() as connection:
-        category_result = await connection.fetchrow("SELECT name FROM categories WHERE id = $1", category_id)
+    category_result = reference_cache.get('categories', category_id)
         
     if not category_result:
         error_msg = await send_new_message(callback_query.bot, callback_query.message.chat.id, "Ошибка: категория не найдена.")
@@ -381,17 +388,14 @@ async def handle_product_category(callback_query: types.CallbackQuery, state: FS
     if is_phone:
         # Для телефонов сразу устанавливаем название как "Телефон" и переходим к выбору бренда
         await state.update_data(name="Телефон")
-        
-        async with db_pool.acquire() as connection:
-            brands = await connection.fetch("SELECT id, name FROM brands ORDER BY name;")
             
-        if not brands:
+        if not reference_cache.list('brands'):
             error_msg = await send_new_message(callback_query.bot, callback_query.message.chat.id, "В базе нет брендов. Добавьте их прежде чем создавать телефон.")
             await track_message_id(state, error_msg.message_id)
             await state.clear()
             return
             
-        new_msg = await send_new_message(callback_query.bot, callback_query.message.chat.id, "Выберите бренд телефона:", reply_markup=get_brands_keyboard(brands))
+        new_msg = await send_new_message(callback_query.bot, callback_query.message.chat.id, "Выберите бренд телефона:", reply_markup=get_brands_keyboard())
         await track_message_id(state, new_msg.message_id)
         await state.set_state(ProductCreation.waiting_for_brand)
     else:
@@ -402,13 +406,13 @@ async def handle_product_category(callback_query: types.CallbackQuery, state: FS
 
 
 # --- Специальные обработчики для телефонов (новый расширенный flow) ---
-async def handle_brand_selection(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_brand_selection(callback_query: types.CallbackQuery, callback_data: BrandCallback,
+                                 state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    brand_id = int(callback_query.data.split('_')[1])
+    brand_id = callback_data.id
     
     # Получаем название бренда
-    async with db_pool.acquire() as connection:
-        brand_result = await connection.fetchrow("SELECT name FROM brands WHERE id = $1", brand_id)
+    brand_result = reference_cache.get('brands', brand_id)
         
     if not brand_result:
         await callback_query.message.reply("Ошибка: бренд не найден.")
@@ -418,8 +422,7 @@ async def handle_brand_selection(callback_query: types.CallbackQuery, state: FSM
     await state.update_data(brand_id=brand_id, brand_name=brand_result['name'])
     
     # Получаем модели для выбранного бренда
-    async with db_pool.acquire() as connection:
-        models = await connection.fetch("SELECT id, name FROM models WHERE brand_id = $1 ORDER BY name;", brand_id)
+    models = reference_cache.models_for_brand(brand_id)
         
     if not models:
         await callback_query.message.reply(f"Для бренда {brand_result['name']} нет моделей в базе данных.")
@@ -429,13 +432,13 @@ async def handle_brand_selection(callback_query: types.CallbackQuery, state: FSM
     await callback_query.message.reply("Выберите модель:", reply_markup=get_models_keyboard(models))
     await state.set_state(ProductCreation.waiting_for_model)
 
-async def handle_model_selection(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_model_selection(callback_query: types.CallbackQuery, callback_data: ModelCallback,
+                                 state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    model_id = int(callback_query.data.split('_')[1])
+    model_id = callback_data.id
     
     # Получаем название модели
-    async with db_pool.acquire() as connection:
-        model_result = await connection.fetchrow("SELECT name FROM models WHERE id = $1", model_id)
+    model_result = reference_cache.get('models', model_id)
         
     if not model_result:
         await callback_query.message.reply("Ошибка: модель не найдена.")
@@ -445,24 +448,21 @@ async def handle_model_selection(callback_query: types.CallbackQuery, state: FSM
     await state.update_data(model_id=model_id, model_name=model_result['name'])
     
     # Получаем объемы памяти
-    async with db_pool.acquire() as connection:
-        storage_capacities = await connection.fetch("SELECT id, capacity_gb FROM storage_capacities ORDER BY capacity_gb;")
-        
-    if not storage_capacities:
+    if not reference_cache.list('storage_capacities'):
         await callback_query.message.reply("В базе нет объемов памяти.")
         await state.clear()
         return
         
-    await callback_query.message.reply("Выберите объем памяти:", reply_markup=get_storage_keyboard(storage_capacities))
+    await callback_query.message.reply("Выберите объем памяти:", reply_markup=get_storage_keyboard())
     await state.set_state(ProductCreation.waiting_for_storage_capacity)
 
-async def handle_storage_selection(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_storage_selection(callback_query: types.CallbackQuery, callback_data: StorageCallback,
+                                   state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    storage_id = int(callback_query.data.split('_')[1])
+    storage_id = callback_data.id
     
     # Получаем объем памяти
-    async with db_pool.acquire() as connection:
-        storage_result = await connection.fetchrow("SELECT capacity_gb FROM storage_capacities WHERE id = $1", storage_id)
+    storage_result = reference_cache.get('storage_capacities', storage_id)
         
     if not storage_result:
         await callback_query.message.reply("Ошибка: объем памяти не найден.")
@@ -472,24 +472,21 @@ async def handle_storage_selection(callback_query: types.CallbackQuery, state: F
     await state.update_data(storage_capacity_id=storage_id, storage_gb=storage_result['capacity_gb'])
     
     # Получаем рынки
-    async with db_pool.acquire() as connection:
-        markets = await connection.fetch("SELECT id, name FROM markets ORDER BY name;")
-        
-    if not markets:
+    if not reference_cache.list('markets'):
         await callback_query.message.reply("В базе нет рынков.")
         await state.clear()
         return
         
-    await callback_query.message.reply("Выберите рынок:", reply_markup=get_markets_keyboard(markets))
+    await callback_query.message.reply("Выберите рынок:", reply_markup=get_markets_keyboard())
     await state.set_state(ProductCreation.waiting_for_market)
 
-async def handle_market_selection(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_market_selection(callback_query: types.CallbackQuery, callback_data: MarketCallback,
+                                  state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    market_id = int(callback_query.data.split('_')[1])
+    market_id = callback_data.id
     
     # Получаем название рынка
-    async with db_pool.acquire() as connection:
-        market_result = await connection.fetchrow("SELECT name FROM markets WHERE id = $1", market_id)
+    market_result = reference_cache.get('markets', market_id)
         
     if not market_result:
         await callback_query.message.reply("Ошибка: рынок не найден.")
@@ -500,13 +497,13 @@ async def handle_market_selection(callback_query: types.CallbackQuery, state: FS
     await callback_query.message.reply("Введите закупочную цену (например, 150.50):")
     await state.set_state(ProductCreation.waiting_for_purchase_price)
 
-async def handle_color_selection(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_color_selection(callback_query: types.CallbackQuery, callback_data: ColorCallback,
+                                 state: FSMContext, db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    color_id = int(callback_query.data.split('_')[1])
+    color_id = callback_data.id
     
     # Получаем название цвета
-    async with db_pool.acquire() as connection:
-        color_result = await connection.fetchrow("SELECT name FROM colors WHERE id = $1", color_id)
+    color_result = reference_cache.get('colors', color_id)
         
     if not color_result:
         await callback_query.message.reply("Ошибка: цвет не найден.")
@@ -516,15 +513,12 @@ async def handle_color_selection(callback_query: types.CallbackQuery, state: FSM
     await state.update_data(color_id=color_id, color_name=color_result['name'])
     
     # Получаем состояния
-    async with db_pool.acquire() as connection:
-        conditions = await connection.fetch("SELECT id, name FROM conditions;")
-
-    if not conditions:
+    if not reference_cache.list('conditions'):
         await callback_query.message.reply("В базе нет ни одного состояния. Добавьте их, прежде чем создавать продукт.")
         await state.clear()
         return
 
-    await callback_query.message.reply("Выберите состояние товара:", reply_markup=get_conditions_keyboard(conditions))
+    await callback_query.message.reply("Выберите состояние товара:", reply_markup=get_conditions_keyboard())
     await state.set_state(ProductCreation.waiting_for_condition)
 
 async def handle_battery_health(message: types.Message, state: FSMContext, db_pool):
@@ -534,21 +528,23 @@ async def handle_battery_health(message: types.Message, state: FSMContext, db_po
             await message.reply("Здоровье батареи должно быть от 0 до 100%.")
             return
         await state.update_data(battery_health=battery_health)
-        await message.reply("Телефон восстанавливался?", reply_markup=get_yes_no_keyboard("repaired"))
+        await message.reply("Телефон восстанавливался?", reply_markup=get_yes_no_keyboard(RepairedCallback))
         await state.set_state(ProductCreation.waiting_for_repaired)
     except ValueError:
         await message.reply("Неверный формат. Пожалуйста, введите целое число от 0 до 100.")
 
-async def handle_repaired(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_repaired(callback_query: types.CallbackQuery, callback_data: RepairedCallback, state: FSMContext,
+                          db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    repaired = callback_query.data.split('_')[1] == 'yes'
+    repaired = callback_data.value
     await state.update_data(repaired=repaired)
-    await callback_query.message.reply("Полная комплектация?", reply_markup=get_yes_no_keyboard("full_kit"))
+    await callback_query.message.reply("Полная комплектация?", reply_markup=get_yes_no_keyboard(FullKitCallback))
     await state.set_state(ProductCreation.waiting_for_full_kit)
 
-async def handle_full_kit(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_full_kit(callback_query: types.CallbackQuery, callback_data: FullKitCallback, state: FSMContext,
+                          db_pool):
     await callback_query.bot.answer_callback_query(callback_query.id)
-    full_kit = callback_query.data.split('_')[2] == 'yes'  # "full_kit_yes" -> index 2
+    full_kit = callback_data.value
     await state.update_data(full_kit=full_kit, quantity=1)  # У телефонов всегда количество = 1
     
     # Переходим к опциональному вводу IMEI
@@ -556,12 +552,38 @@ async def handle_full_kit(callback_query: types.CallbackQuery, state: FSMContext
                                       reply_markup=get_skip_keyboard("skip_imei"))
     await state.set_state(ProductCreation.waiting_for_imei)
 
+PHONE_BY_IMEI_QUERY = registry.register('phone_by_imei', "SELECT id, is_sold FROM phones WHERE imei = $1;")
+
+PHONE_BY_SERIAL_QUERY = registry.register(
+    'phone_by_serial', "SELECT id, is_sold FROM phones WHERE serial_number = $1;"
+)
+
+
+async def reply_if_duplicate_phone(message, db_pool, query, value, label):
+    """
+    Проверяет по уникальному индексу, не принят ли уже телефон с таким IMEI/серийным номером.
+    Если принят - сообщает об этом и возвращает True.
+    """
+    async with db_pool.acquire() as connection:
+        duplicate = await registry.fetchrow(connection, query, value)
+    if not duplicate:
+        return False
+    status = "продан" if duplicate['is_sold'] else "в наличии"
+    await message.reply(
+        f"Телефон с таким {label} уже есть в базе (ID {duplicate['id']}, {status}).\n"
+        "Проверьте ввод или нажмите 'Пропустить'."
+    )
+    return True
+
+
 async def handle_imei_input(message: types.Message, state: FSMContext, db_pool):
     imei = message.text.strip()
     if len(imei) > 17:
         await message.reply("IMEI слишком длинный. Максимум 17 символов.")
         return
-        
+    if await reply_if_duplicate_phone(message, db_pool, PHONE_BY_IMEI_QUERY, imei, "IMEI"):
+        return
+
     await state.update_data(imei=imei)
     await message.reply("Введите серийный номер телефона (или нажмите 'Пропустить'):", 
                        reply_markup=get_skip_keyboard("skip_serial"))
@@ -579,7 +601,9 @@ async def handle_serial_input(message: types.Message, state: FSMContext, db_pool
     if len(serial_number) > 50:
         await message.reply("Серийный номер слишком длинный. Максимум 50 символов.")
         return
-        
+    if await reply_if_duplicate_phone(message, db_pool, PHONE_BY_SERIAL_QUERY, serial_number, "серийным номером"):
+        return
+
     await state.update_data(serial_number=serial_number)
     await save_phone_to_db(message, state, db_pool)
 
@@ -589,14 +613,47 @@ async def handle_serial_skip(callback_query: types.CallbackQuery, state: FSMCont
     await save_phone_to_db(callback_query.message, state, db_pool)
 
 # --- Вспомогательные функции для управления сообщениями ---
+# Максимум сообщений в одном вызове deleteMessages (ограничение Telegram)
+DELETE_MESSAGES_CHUNK_SIZE = 100
+# Сколько пачек удаляется одновременно
+DELETE_MESSAGES_CONCURRENCY = 3
+# Сколько раз повторять пачку после ответа 429 Too Many Requests
+DELETE_MESSAGES_MAX_RETRIES = 3
+
+# Ссылки на фоновые задачи, чтобы их не удалил сборщик мусора до завершения
+_background_tasks = set()
+
+
+def run_in_background(coro):
+    """Запускает корутину фоновой задачей, не дожидаясь её завершения"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
 async def delete_chat_messages(bot, chat_id: int, message_ids: list):
-    """Удаляет сообщения из чата по их ID"""
-    for message_id in message_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        except Exception:
-            # Игнорируем ошибки - сообщение могло быть уже удалено
-            pass
+    """Удаляет сообщения из чата пачками до 100 ID через deleteMessages"""
+    semaphore = asyncio.Semaphore(DELETE_MESSAGES_CONCURRENCY)
+
+    async def delete_chunk(chunk):
+        async with semaphore:
+            for _ in range(DELETE_MESSAGES_MAX_RETRIES + 1):
+                try:
+                    await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                    return
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except TelegramBadRequest:
+                    # Сообщения могли быть уже удалены или стать слишком старыми для удаления
+                    return
+                except Exception as e:
+                    logger.warning("Ошибка при удалении сообщений в чате %s: %s", chat_id, e)
+                    return
+
+    chunks = [message_ids[i:i + DELETE_MESSAGES_CHUNK_SIZE]
+              for i in range(0, len(message_ids), DELETE_MESSAGES_CHUNK_SIZE)]
+    await asyncio.gather(*(delete_chunk(chunk) for chunk in chunks))
 
 async def send_new_message(bot, chat_id: int, text: str, reply_markup=None, parse_mode=None):
     """Отправляет новое сообщение вместо ответа на предыдущее"""
@@ -609,18 +666,22 @@ async def send_new_message(bot, chat_id: int, text: str, reply_markup=None, pars
 
 async def track_message_id(state: FSMContext, message_id: int):
     """Добавляет message_id в историю для последующего удаления"""
-    user_data = await state.get_data()
-    message_history = user_data.get('message_history', [])
+    message_history = await state.get_value('message_history', [])
     message_history.append(message_id)
     await state.update_data(message_history=message_history)
 
-async def clear_message_history(bot, chat_id: int, state: FSMContext):
-    """Удаляет все сообщения из истории и очищает список"""
-    user_data = await state.get_data()
-    message_history = user_data.get('message_history', [])
+async def clear_message_history(bot, chat_id: int, state: FSMContext, background=False):
+    """
+    Удаляет все сообщения из истории и очищает список.
+    background=True - удаление идет фоновой задачей, не задерживая ответ пользователю.
+    """
+    message_history = await state.get_value('message_history', [])
     
     if message_history:
-        await delete_chat_messages(bot, chat_id, message_history)
+        if background:
+            run_in_background(delete_chat_messages(bot, chat_id, message_history))
+        else:
+            await delete_chat_messages(bot, chat_id, message_history)
         await state.update_data(message_history=[])
 
 # --- Вспомогательные функции для форматирования ---
@@ -639,7 +700,12 @@ def format_product_info(product, current_index, total_count):
 def format_phone_info(phone, current_index, total_count):
     """Форматирует информацию о телефоне для отображения"""
     text = f"📱 **Телефон {current_index + 1} из {total_count}**\n\n"
-    text += f"🆔 **ID**: {phone['id']}\n"
+    return text + format_phone_card(phone)
+
+
+def format_phone_card(phone):
+    """Карточка телефона без заголовка навигации"""
+    text = f"🆔 **ID**: {phone['id']}\n"
     text += f"📱 **Модель**: {phone['brand_name']} {phone['model_name']}\n"
     text += f"💾 **Память**: {phone['capacity_gb']} ГБ\n"
     text += f"🎨 **Цвет**: {phone['color_name']}\n"
@@ -661,47 +727,120 @@ def format_phone_info(phone, current_index, total_count):
     
     return text
 
-async def get_products_list(db_pool, sold_status=False):
-    """Получает список товаров с фильтрацией по статусу продажи"""
-    async with db_pool.acquire() as connection:
-        return await connection.fetch("""
-            SELECT p.id, p.name, p.purchase_price, p.sale_price, p.quantity,
-                   c.name AS category_name
-            FROM products p
-            LEFT JOIN categories c ON p.category_id = c.id
-            WHERE p.is_sold = $1
-            ORDER BY p.id DESC;
-        """, sold_status)
-
-async def get_phones_list(db_pool, sold_status=False):
-    """Получает список телефонов с фильтрацией по статусу продажи"""
+# Постраничная выборка по курсору (keyset): вместо всего списка загружаем
+# только текущую запись и её соседа, а общее количество берём отдельным COUNT.
+# Условие по is_sold подставляется в текст запроса, а не параметром: так планировщик
+# и в обобщенном плане использует частичные индексы WHERE NOT is_sold (migrations/0002_query_indexes.sql).
+PRODUCTS_PAGE_SELECT = """
+    SELECT p.id, p.name, p.purchase_price, p.sale_price, p.quantity,
+           c.name AS category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+"""
+
+PHONES_PAGE_SELECT = """
+    SELECT p.id, p.name, p.purchase_price, p.sale_price, p.battery_health,
+           p.repaired, p.full_kit, p.imei, p.serial_number,
+           b.name AS brand_name, m.name AS model_name,
+           c.name AS color_name, s.capacity_gb,
+           ma.name AS market_name, cond.name AS condition_name
+    FROM phones p
+    LEFT JOIN models m ON p.model_id = m.id
+    LEFT JOIN brands b ON m.brand_id = b.id
+    LEFT JOIN colors c ON p.color_id = c.id
+    LEFT JOIN storage_capacities s ON p.storage_capacity_id = s.id
+    LEFT JOIN markets ma ON p.market_id = ma.id
+    LEFT JOIN conditions cond ON p.condition_id = cond.id
+"""
+
+# Продолжение запроса для каждого направления; $1 - id курсора или смещение
+PAGE_QUERY_TAILS = {
+    'first': "ORDER BY p.id DESC LIMIT 2;",
+    'next': "AND p.id < $1 ORDER BY p.id DESC LIMIT 2;",
+    'prev': "AND p.id > $1 ORDER BY p.id ASC LIMIT 2;",
+    'offset': "ORDER BY p.id DESC OFFSET $1 LIMIT 2;",
+}
+
+
+def register_page_queries(table, select):
+    """
+    Регистрирует страничные запросы и COUNT для проданных и непроданных позиций.
+    Возвращает (запросы по (sold_status, направление), COUNT по sold_status).
+    """
+    page_queries, count_queries = {}, {}
+    for sold_status, condition in ((False, 'NOT p.is_sold'), (True, 'p.is_sold')):
+        status = 'sold' if sold_status else 'available'
+        for direction, tail in PAGE_QUERY_TAILS.items():
+            page_queries[sold_status, direction] = registry.register(
+                f'{table}_{status}_{direction}_page', f"{select}    WHERE {condition} {tail}"
+            )
+        count_queries[sold_status] = registry.register(
+            f'{table}_{status}_count', f"SELECT COUNT(*) FROM {table} p WHERE {condition};"
+        )
+    return page_queries, count_queries
+
+
+PRODUCTS_PAGE_QUERIES, PRODUCTS_COUNT_QUERIES = register_page_queries('products', PRODUCTS_PAGE_SELECT)
+PHONES_PAGE_QUERIES, PHONES_COUNT_QUERIES = register_page_queries('phones', PHONES_PAGE_SELECT)
+
+
+async def _fetch_page(db_pool, page_queries, count_queries, sold_status, direction, cursor):
+    """Выполняет страничный запрос по курсору и подсчет общего количества"""
+    if direction in ('next', 'prev', 'offset'):
+        query, args = page_queries[sold_status, direction], (cursor,)
+    else:
+        query, args = page_queries[sold_status, 'first'], ()
+
     async with db_pool.acquire() as connection:
-        return await connection.fetch("""
-            SELECT p.id, p.name, p.purchase_price, p.sale_price, p.battery_health,
-                   p.repaired, p.full_kit, p.imei, p.serial_number,
-                   b.name AS brand_name, m.name AS model_name, 
-                   c.name AS color_name, s.capacity_gb,
-                   ma.name AS market_name, cond.name AS condition_name
-            FROM phones p
-            LEFT JOIN models m ON p.model_id = m.id
-            LEFT JOIN brands b ON m.brand_id = b.id
-            LEFT JOIN colors c ON p.color_id = c.id
-            LEFT JOIN storage_capacities s ON p.storage_capacity_id = s.id
-            LEFT JOIN markets ma ON p.market_id = ma.id
-            LEFT JOIN conditions cond ON p.condition_id = cond.id
-            WHERE p.is_sold = $1
-            ORDER BY p.id DESC;
-        """, sold_status)
+        rows = await registry.fetch(connection, query, *args)
+        total_count = await registry.fetchval(connection, count_queries[sold_status])
+    return rows, total_count
+
+
+async def get_products_page(db_pool, sold_status=False, direction=None, cursor=None):
+    """
+    Получает страницу товаров по курсору.
+    direction: None (первая страница), 'next' (id < cursor), 'prev' (id > cursor)
+               или 'offset' (cursor - смещение, для старых кнопок)
+    Возвращает (rows, total_count): rows[0] - текущий товар, rows[1] - сосед в направлении движения.
+    """
+    return await _fetch_page(db_pool, PRODUCTS_PAGE_QUERIES, PRODUCTS_COUNT_QUERIES, sold_status, direction, cursor)
+
+
+async def get_phones_page(db_pool, sold_status=False, direction=None, cursor=None):
+    """
+    Получает страницу телефонов по курсору.
+    Параметры и результат аналогичны get_products_page.
+    """
+    return await _fetch_page(db_pool, PHONES_PAGE_QUERIES, PHONES_COUNT_QUERIES, sold_status, direction, cursor)
+
+
+def parse_nav_callback(callback_data):
+    """
+    Разбирает callback_data навигации (ProductsNavCallback/PhonesNavCallback).
+    "nav_phones:5:next:120" - индекс, направление и id курсора.
+    "nav_phones:5" (старые кнопки) - только индекс, страница ищется по смещению.
+    Возвращает (current_index, direction, cursor).
+    """
+    if callback_data.cursor is None:
+        return callback_data.index, 'offset', callback_data.index
+    return callback_data.index, callback_data.direction, callback_data.cursor
+
+
+def get_page_neighbours(rows, current_index, direction):
+    """Определяет наличие предыдущей/следующей записи по результату страничного запроса"""
+    has_more = len(rows) > 1
+    if direction == 'prev':
+        return has_more, True
+    return current_index > 0, has_more
+
 
 # --- Обработчики меню ---
-async def handle_menu_all_products(callback_query: types.CallbackQuery, db_pool):
+async def handle_menu_all_products(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать первый товар из списка с навигацией"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    products = await get_products_list(db_pool, sold_status=False)
+    products, total_count = await get_products_page(db_pool, sold_status=False)
     
     if not products:
         text = "📦 **Товары не найдены**\n\nВ базе данных пока нет товаров."
@@ -736,22 +875,20 @@ async def handle_menu_all_products(callback_query: types.CallbackQuery, db_pool)
     # Показываем первый товар
     current_index = 0
     product = products[current_index]
-    text = format_product_info(product, current_index, len(products))
+    text = format_product_info(product, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode='Markdown',
-        reply_markup=get_item_navigation_keyboard('products', current_index, len(products), product['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('products', current_index, total_count, product['id'], is_admin,
+                                                  has_next=len(products) > 1)
     )
 
-async def handle_menu_all_phones(callback_query: types.CallbackQuery, db_pool):
+async def handle_menu_all_phones(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать первый телефон из списка с навигацией"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    phones = await get_phones_list(db_pool, sold_status=False)
+    phones, total_count = await get_phones_page(db_pool, sold_status=False)
     
     if not phones:
         text = "📱 **Телефоны не найдены**\n\nВ базе данных пока нет телефонов."
@@ -786,63 +923,35 @@ async def handle_menu_all_phones(callback_query: types.CallbackQuery, db_pool):
     # Показываем первый телефон
     current_index = 0
     phone = phones[current_index]
-    text = format_phone_info(phone, current_index, len(phones))
+    text = format_phone_info(phone, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode='Markdown',
-        reply_markup=get_item_navigation_keyboard('phones', current_index, len(phones), phone['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('phones', current_index, total_count, phone['id'], is_admin,
+                                                  has_next=len(phones) > 1)
     )
 
 async def handle_menu_profit(callback_query: types.CallbackQuery, db_pool):
     """Рассчитать и показать прибыль"""
     await callback_query.bot.answer_callback_query(callback_query.id)
 
+    # Все показатели поддерживаются инкрементально в shop_summary - одно чтение по ключу
     async with db_pool.acquire() as connection:
-        # Прибыль от проданных товаров
-        products_profit = await connection.fetchrow("""
-            SELECT 
-                COALESCE(SUM((sale_price - purchase_price) * quantity), 0) AS profit,
-                COUNT(*) AS count,
-                COALESCE(SUM(purchase_price * quantity), 0) AS total_investment,
-                COALESCE(SUM(sale_price * quantity), 0) AS total_revenue
-            FROM products 
-            WHERE is_sold = TRUE AND sale_price IS NOT NULL;
-        """)
-
-        # Прибыль от проданных телефонов
-        phones_profit = await connection.fetchrow("""
-            SELECT 
-                COALESCE(SUM(sale_price - purchase_price), 0) AS profit,
-                COUNT(*) AS count,
-                COALESCE(SUM(purchase_price), 0) AS total_investment,
-                COALESCE(SUM(sale_price), 0) AS total_revenue
-            FROM phones 
-            WHERE is_sold = TRUE AND sale_price IS NOT NULL;
-        """)
-
-        # Текущие инвестиции (непроданные товары)
-        current_investments = await connection.fetchrow("""
-                                                        SELECT COALESCE(SUM(p.purchase_price * p.quantity), 0) +
-                                                               COALESCE(
-                                                                       (SELECT SUM(purchase_price) FROM phones WHERE is_sold = FALSE),
-                                                                       0) AS total_investment
-                                                        FROM products AS p
-                                                        WHERE p.is_sold = FALSE;
-                                                        """)
-
-    total_profit = products_profit['profit'] + phones_profit['profit']
-    total_revenue = products_profit['total_revenue'] + phones_profit['total_revenue']
-    total_investment = products_profit['total_investment'] + phones_profit['total_investment']
-    current_investment = current_investments['total_investment'] if current_investments else 0
+        summary = await get_summary(connection)
+
+    total_profit = summary['products_profit'] + summary['phones_profit']
+    total_revenue = summary['products_revenue'] + summary['phones_revenue']
+    total_investment = summary['products_investment'] + summary['phones_investment']
+    current_investment = summary['stock_investment']
 
     profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
 
     text = "💰 **Отчет по прибыли**\n\n"
 
     text += "📊 **Проданные товары:**\n"
-    text += f"   • Товаров: {products_profit['count']} шт.\n"
-    text += f"   • Телефонов: {phones_profit['count']} шт.\n"
+    text += f"   • Товаров: {summary['products_sold_count']} шт.\n"
+    text += f"   • Телефонов: {summary['phones_sold_count']} шт.\n"
     text += f"   • Прибыль: {total_profit:.2f} руб.\n\n"
 
     text += "💵 **Финансовые показатели:**\n"
@@ -863,64 +972,112 @@ async def handle_menu_profit(callback_query: types.CallbackQuery, db_pool):
     await callback_query.message.edit_text(
         text,
         parse_mode='Markdown',
-        reply_markup=get_back_to_menu_keyboard()
+        reply_markup=get_sales_report_keyboard()
     )
 
-async def handle_menu_stats(callback_query: types.CallbackQuery, db_pool):
-    """Показать общую статистику"""
+
+async def handle_sales_report(message: types.Message, command: CommandObject, db_pool):
+    """Отчет о продажах: /sales month 01.01.2026 31.12.2026"""
+    try:
+        period, date_from, date_to = parse_sales_args(command.args)
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+
+    async with db_pool.acquire() as connection:
+        rows = await get_sales_report(connection, period, date_from, date_to)
+    await message.reply(format_sales_report(rows, period, date_from, date_to), parse_mode='Markdown')
+
+
+async def handle_sales_report_callback(callback_query: types.CallbackQuery, callback_data: SalesReportCallback,
+                                       db_pool):
+    """Отчет о продажах за последние интервалы из кнопок под отчетом по прибыли"""
+    period = callback_data.period
+    # callback_data приходит от клиента и может быть подделана
+    if period not in SALES_PERIODS:
+        await callback_query.answer("Неизвестный период отчета", show_alert=True)
+        return
     await callback_query.bot.answer_callback_query(callback_query.id)
-    
+    date_from, date_to = default_range(period)
+
     async with db_pool.acquire() as connection:
-        # Статистика товаров
-        products_stats = await connection.fetchrow("""
-            SELECT 
-                COUNT(*) as total,
-                COUNT(CASE WHEN is_sold = TRUE THEN 1 END) as sold,
-                COUNT(CASE WHEN is_sold = FALSE THEN 1 END) as available
-            FROM products;
-        """)
-        
-        # Статистика телефонов
-        phones_stats = await connection.fetchrow("""
-            SELECT 
-                COUNT(*) as total,
-                COUNT(CASE WHEN is_sold = TRUE THEN 1 END) as sold,
-                COUNT(CASE WHEN is_sold = FALSE THEN 1 END) as available
-            FROM phones;
-        """)
-        
-        # Популярные бренды
-        popular_brands = await connection.fetch("""
-            SELECT b.name, COUNT(p.id) as count
-            FROM phones p
-            JOIN models m ON p.model_id = m.id
-            JOIN brands b ON m.brand_id = b.id
-            GROUP BY b.name
-            ORDER BY count DESC
-            LIMIT 5;
-        """)
+        rows = await get_sales_report(connection, period, date_from, date_to)
+    try:
+        await callback_query.message.edit_text(
+            format_sales_report(rows, period, date_from, date_to),
+            parse_mode='Markdown',
+            reply_markup=get_sales_report_keyboard()
+        )
+    except TelegramBadRequest as e:
+        # Повторное нажатие той же кнопки: отчет не изменился
+        if 'message is not modified' not in str(e):
+            raise
+
+STATS_QUERY = registry.register('stats', """
+    WITH product_stats AS (
+        SELECT COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE is_sold) AS sold,
+               COUNT(*) FILTER (WHERE NOT is_sold) AS available
+        FROM products
+    ), phone_stats AS (
+        SELECT COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE is_sold) AS sold,
+               COUNT(*) FILTER (WHERE NOT is_sold) AS available
+        FROM phones
+    ), popular_brands AS (
+        SELECT b.name, COUNT(p.id) AS count
+        FROM phones p
+        JOIN models m ON p.model_id = m.id
+        JOIN brands b ON m.brand_id = b.id
+        GROUP BY b.name
+        ORDER BY count DESC
+        LIMIT 5
+    )
+    SELECT pr.total AS products_total, pr.sold AS products_sold, pr.available AS products_available,
+           ph.total AS phones_total, ph.sold AS phones_sold, ph.available AS phones_available,
+           (SELECT array_agg(name ORDER BY count DESC, name) FROM popular_brands) AS brand_names,
+           (SELECT array_agg(count ORDER BY count DESC, name) FROM popular_brands) AS brand_counts
+    FROM product_stats pr, phone_stats ph;
+""")
+
+# Кэш готового текста статистики: одновременные запросы разделяют одно обращение к БД
+stats_cache = TTLCache(ttl=5)
+
+
+async def build_stats_text(db_pool):
+    """Собирает текст статистики магазина одним запросом к БД"""
+    async with db_pool.acquire() as connection:
+        stats = await registry.fetchrow(connection, STATS_QUERY)
     
     text = "📊 **Статистика магазина**\n\n"
     
     text += "📦 **Обычные товары:**\n"
-    text += f"   • Всего: {products_stats['total']}\n"
-    text += f"   • В наличии: {products_stats['available']}\n"
-    text += f"   • Продано: {products_stats['sold']}\n\n"
+    text += f"   • Всего: {stats['products_total']}\n"
+    text += f"   • В наличии: {stats['products_available']}\n"
+    text += f"   • Продано: {stats['products_sold']}\n\n"
     
     text += "📱 **Телефоны:**\n"
-    text += f"   • Всего: {phones_stats['total']}\n"
-    text += f"   • В наличии: {phones_stats['available']}\n"
-    text += f"   • Продано: {phones_stats['sold']}\n\n"
+    text += f"   • Всего: {stats['phones_total']}\n"
+    text += f"   • В наличии: {stats['phones_available']}\n"
+    text += f"   • Продано: {stats['phones_sold']}\n\n"
     
-    if popular_brands:
+    if stats['brand_names']:
         text += "🏆 **Популярные бренды:**\n"
-        for brand in popular_brands:
-            text += f"   • {brand['name']}: {brand['count']} шт.\n"
+        for name, count in zip(stats['brand_names'], stats['brand_counts']):
+            text += f"   • {name}: {count} шт.\n"
     
-    total_items = products_stats['total'] + phones_stats['total']
-    total_sold = products_stats['sold'] + phones_stats['sold']
+    total_items = stats['products_total'] + stats['phones_total']
+    total_sold = stats['products_sold'] + stats['phones_sold']
     
     text += f"\n🎯 **Общий оборот**: {total_sold}/{total_items} товаров"
+    return text
+
+
+async def handle_menu_stats(callback_query: types.CallbackQuery, db_pool):
+    """Показать общую статистику"""
+    await callback_query.bot.answer_callback_query(callback_query.id)
+    
+    text = await stats_cache.get_or_compute('stats', partial(build_stats_text, db_pool))
     
     await callback_query.message.edit_text(
         text, 
@@ -929,147 +1086,469 @@ async def handle_menu_stats(callback_query: types.CallbackQuery, db_pool):
     )
 
 # --- Функции сохранения ---
+PHONE_INSERT_QUERY = registry.register('phone_insert', """
+    INSERT INTO phones (name, purchase_price, sale_price, model_id, color_id,
+                        storage_capacity_id, market_id, condition_id, battery_health,
+                        repaired, full_kit, imei, serial_number)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13) RETURNING id;
+""")
+
+PRODUCT_INSERT_QUERY = registry.register('product_insert', """
+    INSERT INTO products (name, purchase_price, sale_price, quantity, category_id)
+    VALUES ($1, $2, $3, $4, $5) RETURNING id;
+""")
+
+
 async def save_phone_to_db(message, state: FSMContext, db_pool):
     user_data = await state.get_data()
     bot = message.bot
     chat_id = message.chat.id
     
-    async with db_pool.acquire() as connection:
-        try:
-            # Новый SQL запрос с foreign keys
-            query = """
-                    INSERT INTO phones (name, purchase_price, sale_price, model_id, color_id, 
-                                      storage_capacity_id, market_id, condition_id, battery_health, 
-                                      repaired, full_kit, imei, serial_number)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13) RETURNING id;
-                    """
-            result = await connection.fetchrow(
-                query,
-                user_data['name'],
-                user_data['purchase_price'],
-                user_data.get('sale_price'),
-                user_data['model_id'],
-                user_data['color_id'],
-                user_data['storage_capacity_id'],
-                user_data['market_id'],
-                user_data['condition_id'],
-                user_data.get('battery_health'),
-                user_data.get('repaired', False),
-                user_data.get('full_kit', True),
-                user_data.get('imei'),
-                user_data.get('serial_number')
-            )
-            phone_id = result['id']
-            
-            # Удаляем все промежуточные сообщения
-            await clear_message_history(bot, chat_id, state)
-            
-            # Создаем красивое сообщение с деталями телефона
-            summary = f"📱 Телефон успешно добавлен!\n\n"
-            summary += f"🆔 ID: {phone_id}\n"
-            summary += f"📱 Модель: {user_data['brand_name']} {user_data['model_name']}\n"
-            summary += f"💾 Память: {user_data['storage_gb']} ГБ\n"
-            summary += f"🎨 Цвет: {user_data['color_name']}\n"
-            summary += f"🌍 Рынок: {user_data['market_name']}\n"
-            summary += f"💰 Закупочная цена: {user_data['purchase_price']} руб.\n"
-            summary += f"🔋 Состояние: {user_data['condition_name']}"
+    try:
+        async with db_pool.acquire() as connection:
+            async with connection.transaction():
+                result = await registry.fetchrow(
+                    connection,
+                    PHONE_INSERT_QUERY,
+                    user_data['name'],
+                    user_data['purchase_price'],
+                    user_data.get('sale_price'),
+                    user_data['model_id'],
+                    user_data['color_id'],
+                    user_data['storage_capacity_id'],
+                    user_data['market_id'],
+                    user_data['condition_id'],
+                    user_data.get('battery_health'),
+                    user_data.get('repaired', False),
+                    user_data.get('full_kit', True),
+                    user_data.get('imei'),
+                    user_data.get('serial_number')
+                )
+                # Обновляем сводку в той же транзакции
+                await add_stock(connection, user_data['purchase_price'])
+        phone_id = result['id']
+        
+        # Удаляем все промежуточные сообщения в фоне, не задерживая итоговое сообщение
+        await clear_message_history(bot, chat_id, state, background=True)
+        
+        # Создаем красивое сообщение с деталями телефона
+        summary = f"📱 Телефон успешно добавлен!\n\n"
+        summary += f"🆔 ID: {phone_id}\n"
+        summary += f"📱 Модель: {user_data['brand_name']} {user_data['model_name']}\n"
+        summary += f"💾 Память: {user_data['storage_gb']} ГБ\n"
+        summary += f"🎨 Цвет: {user_data['color_name']}\n"
+        summary += f"🌍 Рынок: {user_data['market_name']}\n"
+        summary += f"💰 Закупочная цена: {user_data['purchase_price']} руб.\n"
+        summary += f"🔋 Состояние: {user_data['condition_name']}"
+        
+        if user_data.get('battery_health'):
+            summary += f"\n🔋 Батарея: {user_data['battery_health']}%"
+        if user_data.get('imei'):
+            summary += f"\n📟 IMEI: {user_data['imei']}"
+        if user_data.get('serial_number'):
+            summary += f"\n🔢 Серийный номер: {user_data['serial_number']}"
             
-            if user_data.get('battery_health'):
-                summary += f"\n🔋 Батарея: {user_data['battery_health']}%"
-            if user_data.get('imei'):
-                summary += f"\n📟 IMEI: {user_data['imei']}"
-            if user_data.get('serial_number'):
-                summary += f"\n🔢 Серийный номер: {user_data['serial_number']}"
-                
-            # Отправляем новое сообщение с кнопками навигации
-            await send_new_message(
-                bot, chat_id, summary, 
-                reply_markup=get_success_menu_keyboard('phone'),
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            error_msg = f"Произошла ошибка при добавлении телефона: {e}"
-            await send_new_message(bot, chat_id, error_msg)
-        finally:
-            await state.clear()
+        # Отправляем новое сообщение с кнопками навигации
+        await send_new_message(
+            bot, chat_id, summary, 
+            reply_markup=get_success_menu_keyboard('phone'),
+            parse_mode='Markdown'
+        )
+    except asyncpg.UniqueViolationError:
+        # Телефон с тем же IMEI/серийным номером успели принять после проверки в мастере
+        await send_new_message(bot, chat_id, "Телефон с таким IMEI или серийным номером уже есть в базе.")
+    except Exception as e:
+        error_msg = f"Произошла ошибка при добавлении телефона: {e}"
+        await send_new_message(bot, chat_id, error_msg)
+    finally:
+        await state.clear()
 
 async def save_product_to_db(message, state: FSMContext, db_pool):
     user_data = await state.get_data()
     bot = message.bot
     chat_id = message.chat.id
     
-    async with db_pool.acquire() as connection:
-        try:
-            query = """
-                    INSERT INTO products (name, purchase_price, sale_price, quantity, category_id)
-                    VALUES ($1, $2, $3, $4, $5) RETURNING id;
-                    """
-            result = await connection.fetchrow(
-                query,
-                user_data['name'],
-                user_data['purchase_price'],
-                user_data.get('sale_price'),
-                user_data['quantity'],
-                user_data['category_id']
-            )
-            product_id = result['id']
-            
-            # Удаляем все промежуточные сообщения (для товаров удаляем меньше истории)
-            await clear_message_history(bot, chat_id, state)
-            
-            # Создаем подробное сообщение о товаре
-            summary = f"📦 **Товар успешно добавлен!**\n\n"
-            summary += f"🆔 **ID**: {product_id}\n"
-            summary += f"📝 **Название**: {user_data['name']}\n"
-            summary += f"💰 **Закупочная цена**: {user_data['purchase_price']} руб.\n"
-            if user_data.get('sale_price'):
-                summary += f"💵 **Цена продажи**: {user_data['sale_price']} руб.\n"
-            summary += f"📊 **Количество**: {user_data['quantity']} шт.\n"
-            summary += f"📂 **Категория**: {user_data.get('category_name', 'Не указана')}"
-            
-            # Отправляем новое сообщение с кнопками навигации
-            await send_new_message(
-                bot, chat_id, summary, 
-                reply_markup=get_success_menu_keyboard('product'),
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            error_msg = f"Произошла ошибка при добавлении продукта: {e}"
-            await send_new_message(bot, chat_id, error_msg)
-        finally:
-            await state.clear()
+    try:
+        async with db_pool.acquire() as connection:
+            async with connection.transaction():
+                result = await registry.fetchrow(
+                    connection,
+                    PRODUCT_INSERT_QUERY,
+                    user_data['name'],
+                    user_data['purchase_price'],
+                    user_data.get('sale_price'),
+                    user_data['quantity'],
+                    user_data['category_id']
+                )
+                # Обновляем сводку в той же транзакции
+                await add_stock(connection, user_data['purchase_price'], user_data['quantity'])
+        product_id = result['id']
+        
+        # Удаляем все промежуточные сообщения (для товаров удаляем меньше истории) в фоне
+        await clear_message_history(bot, chat_id, state, background=True)
+        
+        # Создаем подробное сообщение о товаре
+        summary = f"📦 **Товар успешно добавлен!**\n\n"
+        summary += f"🆔 **ID**: {product_id}\n"
+        summary += f"📝 **Название**: {user_data['name']}\n"
+        summary += f"💰 **Закупочная цена**: {user_data['purchase_price']} руб.\n"
+        if user_data.get('sale_price'):
+            summary += f"💵 **Цена продажи**: {user_data['sale_price']} руб.\n"
+        summary += f"📊 **Количество**: {user_data['quantity']} шт.\n"
+        summary += f"📂 **Категория**: {user_data.get('category_name', 'Не указана')}"
+        
+        # Отправляем новое сообщение с кнопками навигации
+        await send_new_message(
+            bot, chat_id, summary, 
+            reply_markup=get_success_menu_keyboard('product'),
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        error_msg = f"Произошла ошибка при добавлении продукта: {e}"
+        await send_new_message(bot, chat_id, error_msg)
+    finally:
+        await state.clear()
 
 
 # --- Остальные обработчики ---
-async def list_categories(message: types.Message, db_pool):
+# /categories и /products выводятся страницами: строки читаются курсором по ключу (name, id)
+# только до заполнения страницы, так что ни память бота, ни размер сообщения не зависят от размера таблицы.
+# Запас до лимита Telegram в 4096 символов на заголовок и разметку
+LIST_PAGE_TEXT_LIMIT = 3500
+LIST_PAGE_ROWS = 30
+
+# $1 - id последней строки предыдущей страницы, 0 - с начала списка.
+# LIMIT - не больше строк, чем может понадобиться странице (+1 - признак следующей страницы):
+# без него планировщик рассчитывает на чтение всей таблицы и выбирает Seq Scan с сортировкой
+# вместо индексов по (name, id)
+CATEGORIES_LIST_QUERY = registry.register('categories_list', f"""
+    SELECT id, name
+    FROM categories
+    WHERE (name, id) > (COALESCE((SELECT name FROM categories WHERE id = $1), ''), $1)
+    ORDER BY name, id
+    LIMIT {LIST_PAGE_ROWS + 1};
+""")
+
+PRODUCTS_LIST_QUERY = registry.register('products_list', f"""
+    SELECT p.id, p.name, p.purchase_price, c.name AS category_name
+    FROM products p
+    JOIN categories c ON p.category_id = c.id
+    WHERE (p.name, p.id) > (COALESCE((SELECT name FROM products WHERE id = $1), ''), $1)
+    ORDER BY p.name, p.id
+    LIMIT {LIST_PAGE_ROWS + 1};
+""")
+
+
+async def read_list_page(db_pool, query, after_id, format_row):
+    """
+    Читает строки курсором, пока они помещаются на страницу.
+    Возвращает (строки страницы, id последней строки, если есть следующая страница, иначе None).
+    """
+    lines, length, last_id = [], 0, None
     async with db_pool.acquire() as connection:
-        categories = await connection.fetch("SELECT id, name FROM categories ORDER BY name;")
+        async with connection.transaction():
+            # +1 строка, чтобы узнать, есть ли следующая страница
+            async for row in registry.cursor(connection, query, after_id, prefetch=LIST_PAGE_ROWS + 1):
+                line = format_row(row)
+                if len(lines) == LIST_PAGE_ROWS or length + len(line) > LIST_PAGE_TEXT_LIMIT:
+                    return lines, last_id
+                lines.append(line)
+                length += len(line)
+                last_id = row['id']
+    return lines, None
+
+
+def format_category_line(category):
+    return f"▪️ {category['name']} (ID: {category['id']})\n"
+
 
-    if not categories:
+def format_product_line(product):
+    return (f"▪️ **{product['name']}**\n   Цена: ${product['purchase_price']}\n"
+            f"   Категория: {product['category_name']}\n\n")
+
+
+async def get_categories_page(db_pool, after_id=0):
+    """Текст и клавиатура страницы /categories или (None, None), если список пуст"""
+    lines, next_after_id = await read_list_page(db_pool, CATEGORIES_LIST_QUERY, after_id, format_category_line)
+    if not lines:
+        return None, None
+    text = "Доступные категории:\n\n" + "".join(lines)
+    return text, get_list_page_keyboard(CategoriesListCallback, after_id == 0, next_after_id)
+
+
+async def get_products_list_page(db_pool, after_id=0):
+    """Текст и клавиатура страницы /products или (None, None), если список пуст"""
+    lines, next_after_id = await read_list_page(db_pool, PRODUCTS_LIST_QUERY, after_id, format_product_line)
+    if not lines:
+        return None, None
+    text = "Доступные товары:\n\n" + "".join(lines)
+    return text, get_list_page_keyboard(ProductsListCallback, after_id == 0, next_after_id)
+
+
+async def list_categories(message: types.Message, db_pool):
+    text, keyboard = await get_categories_page(db_pool)
+    if text is None:
         await message.reply("Список категорий пуст.")
     else:
-        categories_text = "Доступные категории:\n\n"
-        for category in categories:
-            categories_text += f"▪️ {category['name']} (ID: {category['id']})\n"
-        await message.reply(categories_text)
+        await message.reply(text, reply_markup=keyboard)
 
 
 async def list_products(message: types.Message, db_pool):
-    async with db_pool.acquire() as connection:
-        products = await connection.fetch("""
-                                          SELECT p.name, p.purchase_price, c.name AS category_name
-                                          FROM products p
-                                                   JOIN categories c ON p.category_id = c.id
-                                          ORDER BY p.name;
-                                          """)
-
-    if not products:
+    text, keyboard = await get_products_list_page(db_pool)
+    if text is None:
         await message.reply("Список товаров пуст.")
     else:
-        product_list_text = "Доступные товары:\n\n"
+        await message.reply(text, parse_mode='Markdown', reply_markup=keyboard)
+
+
+async def handle_categories_page(callback_query: types.CallbackQuery, callback_data: CategoriesListCallback, db_pool):
+    await callback_query.bot.answer_callback_query(callback_query.id)
+    text, keyboard = await get_categories_page(db_pool, callback_data.after_id)
+    if text is None:
+        await callback_query.message.edit_text("Список категорий пуст.")
+    else:
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+
+
+async def handle_products_page(callback_query: types.CallbackQuery, callback_data: ProductsListCallback, db_pool):
+    await callback_query.bot.answer_callback_query(callback_query.id)
+    text, keyboard = await get_products_list_page(db_pool, callback_data.after_id)
+    if text is None:
+        await callback_query.message.edit_text("Список товаров пуст.")
+    else:
+        await callback_query.message.edit_text(text, parse_mode='Markdown', reply_markup=keyboard)
+
+
+# Количество результатов поиска в ответе на /find и в inline-режиме (Telegram допускает до 50)
+FIND_RESULTS_LIMIT = 10
+INLINE_RESULTS_LIMIT = 20
+
+
+async def handle_find(message: types.Message, command: CommandObject, db_pool):
+    """Поиск телефонов и товаров: /find iphone 13 black, /find 3569..., /find чехол"""
+    query = (command.args or '').strip()
+    if len(query) < SEARCH_MIN_QUERY_LENGTH:
+        await message.reply("Укажите запрос: /find <бренд, модель, цвет, IMEI или серийный номер>")
+        return
+
+    async with db_pool.acquire() as connection:
+        phones = await search_phones(connection, query, FIND_RESULTS_LIMIT)
+        products = await search_products(connection, query, FIND_RESULTS_LIMIT)
+
+    if not phones and not products:
+        await message.reply(f"По запросу «{query}» ничего не найдено.")
+        return
+
+    text = f"🔍 Результаты поиска «{query}»:\n"
+    if phones:
+        text += "\n📱 Телефоны:\n"
+        for phone in phones:
+            text += f"▪️ {format_phone_title(phone)}\n   {format_phone_details(phone)}\n"
+    if products:
+        text += "\n📦 Товары:\n"
         for product in products:
-            product_list_text += f"▪️ **{product['name']}**\n   Цена: ${product['purchase_price']}\n   Категория: {product['category_name']}\n\n"
-        await message.reply(product_list_text, parse_mode='Markdown')
+            text += f"▪️ {product['name']}\n   {format_product_details(product)}\n"
+    await message.reply(text)
+
+
+async def handle_inline_search(inline_query: types.InlineQuery, db_pool, is_admin: bool = False):
+    """Inline-поиск: @бот запрос - список найденных телефонов и товаров"""
+    # Inline-запрос без ответа висит у пользователя до таймаута, поэтому остальным - пустой список
+    if not is_admin:
+        await inline_query.answer([], cache_time=60, is_personal=True)
+        return
+    query = inline_query.query.strip()
+    if len(query) < SEARCH_MIN_QUERY_LENGTH:
+        await inline_query.answer([], cache_time=5, is_personal=True)
+        return
+
+    async with db_pool.acquire() as connection:
+        phones = await search_phones(connection, query, INLINE_RESULTS_LIMIT)
+        products = await search_products(connection, query, INLINE_RESULTS_LIMIT - len(phones))
+
+    results = []
+    for phone in phones:
+        title, details = format_phone_title(phone), format_phone_details(phone)
+        results.append(types.InlineQueryResultArticle(
+            id=f"phone:{phone['id']}",
+            title=f"📱 {title}",
+            description=details,
+            input_message_content=types.InputTextMessageContent(message_text=f"📱 {title}\n{details}")
+        ))
+    for product in products:
+        details = format_product_details(product)
+        results.append(types.InlineQueryResultArticle(
+            id=f"product:{product['id']}",
+            title=f"📦 {product['name']}",
+            description=details,
+            input_message_content=types.InputTextMessageContent(message_text=f"📦 {product['name']}\n{details}")
+        ))
+    # Результаты содержат IMEI и закупочные цены: Telegram не должен отдавать их из кэша другим пользователям
+    await inline_query.answer(results, cache_time=5, is_personal=True)
+
+
+# Телефон по IMEI или серийному номеру вместе с транзакцией продажи - одним запросом
+# по уникальным индексам phones_imei_key/phones_serial_number_key и idx_transactions_phone_id
+PHONE_LOOKUP_QUERY = registry.register('phone_lookup', """
+    SELECT p.id, p.name, p.purchase_price, p.sale_price, p.is_sold, p.battery_health,
+           p.repaired, p.full_kit, p.imei, p.serial_number,
+           b.name AS brand_name, m.name AS model_name,
+           c.name AS color_name, s.capacity_gb,
+           ma.name AS market_name, cond.name AS condition_name,
+           sale.amount AS sale_amount, sale.timestamp AS sale_timestamp
+    FROM phones p
+    LEFT JOIN models m ON p.model_id = m.id
+    LEFT JOIN brands b ON m.brand_id = b.id
+    LEFT JOIN colors c ON p.color_id = c.id
+    LEFT JOIN storage_capacities s ON p.storage_capacity_id = s.id
+    LEFT JOIN markets ma ON p.market_id = ma.id
+    LEFT JOIN conditions cond ON p.condition_id = cond.id
+    LEFT JOIN LATERAL (
+        SELECT t.amount, t.timestamp
+        FROM transactions t
+        WHERE t.phone_id = p.id AND t.type = 'sale'
+        ORDER BY t.timestamp DESC
+        LIMIT 1
+    ) sale ON TRUE
+    WHERE p.imei = $1 OR p.serial_number = $1;
+""")
+
+
+async def handle_imei_lookup(message: types.Message, command: CommandObject, db_pool):
+    """Поиск телефона по IMEI или серийному номеру: /imei 356789012345678"""
+    number = (command.args or '').strip()
+    if not number:
+        await message.reply("Укажите IMEI или серийный номер: /imei <номер>")
+        return
+
+    async with db_pool.acquire() as connection:
+        phones = await registry.fetch(connection, PHONE_LOOKUP_QUERY, number)
+
+    if not phones:
+        await message.reply(f"Телефон с IMEI или серийным номером {number} не найден.")
+        return
+
+    for phone in phones:
+        text = format_phone_card(phone)
+        if phone['sale_timestamp']:
+            text += f"\n✅ **Продан** {phone['sale_timestamp']:%d.%m.%Y} за {phone['sale_amount']} руб."
+        elif phone['is_sold']:
+            text += "\n✅ **Продан**"
+        else:
+            text += "\n📦 **В наличии**"
+        await message.reply(text, parse_mode='Markdown')
+
+
+async def handle_rebuild_summary(message: types.Message, db_pool):
+    """Пересчитывает сводку прибыли и продажи по дням с нуля, показывает расхождения сводки с инкрементальной"""
+    async with db_pool.acquire() as connection:
+        before, after, mismatched = await rebuild_summary(connection)
+        days = await rebuild_daily_sales(connection)
+    daily_text = f"\n📅 Продажи по дням пересчитаны по транзакциям: {days} дн."
+
+    if not mismatched:
+        await message.reply("✅ Сводка пересчитана, расхождений не найдено." + daily_text)
+        return
+
+    text = "⚠️ Сводка пересчитана, исправлены расхождения:\n\n"
+    for field in mismatched:
+        old_value = before[field] if before else "нет данных"
+        text += f"▪️ {field}: {old_value} → {after[field]}\n"
+    await message.reply(text + daily_text)
+
+
+async def handle_metrics(message: types.Message):
+    """Показывает метрики производительности бота"""
+    await message.reply(metrics.format_text())
+
+
+# Сколько ошибок по строкам показывать в отчете об импорте
+IMPORT_REPORT_ERRORS = 20
+
+IMPORT_HELP_TEXT = (
+    "Отправьте боту файл .csv или .xlsx - первая строка с названиями колонок.\n\n"
+    "Телефоны: brand, model, storage, color, market, condition, purchase_price - обязательно; "
+    "sale_price, battery_health, repaired, full_kit, imei, serial_number, name - по желанию.\n"
+    "Товары: name, category, purchase_price - обязательно; sale_price, quantity - по желанию.\n\n"
+    "Значения справочников (бренд, модель, цвет, рынок, состояние, категория) указываются названиями, "
+    "как в боте; регистр не важен. Можно использовать русские заголовки: бренд, модель, память, "
+    "цвет, рынок, состояние, закупочная цена, цена продажи, батарея, восстанавливался, комплект, "
+    "серийный номер, название, категория, количество.\n"
+    "Строки с ошибками пропускаются, остальные добавляются."
+)
+
+
+async def handle_import_help(message: types.Message):
+    await message.reply(IMPORT_HELP_TEXT)
+
+
+def format_import_report(result):
+    kind = "телефонов" if result.kind == 'phones' else "товаров"
+    text = (
+        f"📥 Импорт {kind}: добавлено {result.imported} из {result.total} строк "
+        f"за {result.seconds:.2f} с ({result.rows_per_second:.0f} строк/с)."
+    )
+    if result.errors:
+        text += f"\n\n⚠️ Пропущено строк с ошибками: {len(result.errors)}\n"
+        text += "\n".join(f"Строка {row_number}: {error}" for row_number, error in result.errors[:IMPORT_REPORT_ERRORS])
+        if len(result.errors) > IMPORT_REPORT_ERRORS:
+            text += f"\n... и еще {len(result.errors) - IMPORT_REPORT_ERRORS}"
+    return text
+
+
+async def handle_import_document(message: types.Message, db_pool):
+    """Массовое добавление телефонов или товаров из CSV/XLSX-файла"""
+    document = message.document
+    if not (document.file_name or '').lower().endswith(IMPORT_EXTENSIONS):
+        await message.reply("Для импорта отправьте файл .csv или .xlsx. Формат: /import")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.reply("Файл больше 20 МБ, разделите его на части.")
+        return
+
+    content = await message.bot.download(document)
+    try:
+        result = await import_file(db_pool, document.file_name, content.read())
+    except ImportFileError as e:
+        await message.reply(f"❌ {e}")
+        return
+    except UnicodeDecodeError:
+        await message.reply("❌ CSV-файл должен быть в кодировке UTF-8.")
+        return
+    except asyncpg.UniqueViolationError:
+        # Телефон с тем же IMEI добавили одновременно с импортом
+        await message.reply("❌ Во время импорта в базу добавлен телефон с тем же IMEI или серийным номером, "
+                            "отправьте файл еще раз.")
+        return
+    await message.reply(format_import_report(result))
+
+
+async def handle_export(message: types.Message, command: CommandObject, db_pool):
+    """Выгрузка в CSV: /export transactions 01.09.2026 30.09.2026"""
+    try:
+        kind, date_from, date_to = parse_export_args(command.args)
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+
+    path, rows = await export_to_file(db_pool, kind, date_from, date_to)
+    try:
+        document_path = await fit_document_size(path)
+        if document_path is None:
+            await message.reply("Выгрузка больше 50 МБ даже в сжатом виде, укажите период короче.")
+            return
+        path = document_path
+        caption = f"Строк: {rows}"
+        if (date_from or date_to) and not EXPORT_KINDS[kind][1]:
+            caption += " (у товаров нет даты, выгружены все)"
+            date_from = date_to = None
+        filename = export_filename(kind, date_from, date_to)
+        if path.endswith('.gz'):
+            filename += '.gz'
+        await message.reply_document(FSInputFile(path, filename=filename), caption=caption)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
 
 
 # --- Новые обработчики для навигации ---
@@ -1083,99 +1562,109 @@ async def handle_back_to_menu(callback_query: types.CallbackQuery, db_pool):
         parse_mode='Markdown'
     )
 
-async def handle_nav_products(callback_query: types.CallbackQuery, db_pool):
+async def handle_nav_products(callback_query: types.CallbackQuery, callback_data: ProductsNavCallback, db_pool,
+                              is_admin: bool = False):
     """Навигация по товарам"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Извлекаем индекс из callback_data: "nav_products:5"
-    current_index = int(callback_query.data.split(':')[1])
-    
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
+    # Извлекаем индекс и курсор из callback_data: "nav_products:5:next:120"
+    current_index, direction, cursor = parse_nav_callback(callback_data)
     
-    products = await get_products_list(db_pool, sold_status=False)
+    products, total_count = await get_products_page(db_pool, sold_status=False, direction=direction, cursor=cursor)
     
-    if not products or current_index >= len(products) or current_index < 0:
+    if not products or current_index < 0:
         await callback_query.answer("Товар не найден", show_alert=True)
         return
     
-    product = products[current_index]
-    text = format_product_info(product, current_index, len(products))
+    # Количество могло измениться с момента отрисовки кнопок
+    current_index = min(current_index, total_count - 1)
+    has_prev, has_next = get_page_neighbours(products, current_index, direction)
+    
+    product = products[0]
+    text = format_product_info(product, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode='Markdown',
-        reply_markup=get_item_navigation_keyboard('products', current_index, len(products), product['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('products', current_index, total_count, product['id'], is_admin,
+                                                  has_prev=has_prev, has_next=has_next)
     )
 
-async def handle_nav_phones(callback_query: types.CallbackQuery, db_pool):
+async def handle_nav_phones(callback_query: types.CallbackQuery, callback_data: PhonesNavCallback, db_pool,
+                            is_admin: bool = False):
     """Навигация по телефонам"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Извлекаем индекс из callback_data: "nav_phones:5"
-    current_index = int(callback_query.data.split(':')[1])
-    
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
+    # Извлекаем индекс и курсор из callback_data: "nav_phones:5:next:120"
+    current_index, direction, cursor = parse_nav_callback(callback_data)
     
-    phones = await get_phones_list(db_pool, sold_status=False)
+    phones, total_count = await get_phones_page(db_pool, sold_status=False, direction=direction, cursor=cursor)
     
-    if not phones or current_index >= len(phones) or current_index < 0:
+    if not phones or current_index < 0:
         await callback_query.answer("Телефон не найден", show_alert=True)
         return
     
-    phone = phones[current_index]
-    text = format_phone_info(phone, current_index, len(phones))
+    # Количество могло измениться с момента отрисовки кнопок
+    current_index = min(current_index, total_count - 1)
+    has_prev, has_next = get_page_neighbours(phones, current_index, direction)
+    
+    phone = phones[0]
+    text = format_phone_info(phone, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode='Markdown',
-        reply_markup=get_item_navigation_keyboard('phones', current_index, len(phones), phone['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('phones', current_index, total_count, phone['id'], is_admin,
+                                                  has_prev=has_prev, has_next=has_next)
     )
 
-async def handle_edit_item(callback_query: types.CallbackQuery, db_pool):
+async def handle_edit_item(callback_query: types.CallbackQuery, callback_data: EditItemCallback, db_pool):
     """Обработчик для редактирования товара/телефона"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Разбираем callback_data: "edit_item:products:5" или "edit_item:phones:3"
-    parts = callback_query.data.split(':')
-    item_type = parts[1]
-    item_id = int(parts[2])
+    # callback_data: "edit_item:products:5" или "edit_item:phones:3"
+    item_type = callback_data.item_type
+    item_id = callback_data.item_id
     
     # Пока что просто показываем сообщение
     await callback_query.answer(f"Редактирование {item_type} с ID {item_id} будет добавлено в следующей версии", show_alert=True)
 
-async def handle_sell_item(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+SELL_PRODUCT_CHECK_QUERY = registry.register('sell_product_check', """
+    SELECT name, is_sold, purchase_price
+    FROM products
+    WHERE id = $1;
+""")
+
+SELL_PHONE_CHECK_QUERY = registry.register('sell_phone_check', """
+    SELECT p.name, p.is_sold, p.purchase_price,
+           b.name AS brand_name, m.name AS model_name
+    FROM phones p
+    LEFT JOIN models m ON p.model_id = m.id
+    LEFT JOIN brands b ON m.brand_id = b.id
+    WHERE p.id = $1;
+""")
+
+
+async def handle_sell_item(callback_query: types.CallbackQuery, callback_data: SellItemCallback, state: FSMContext,
+                           db_pool, is_admin: bool = False):
     """Обработчик для продажи товара/телефона"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Разбираем callback_data: "sell_item:products:5" или "sell_item:phones:3"
-    parts = callback_query.data.split(':')
-    item_type = parts[1]
-    item_id = int(parts[2])
+    # callback_data: "sell_item:products:5" или "sell_item:phones:3"
+    item_type = callback_data.item_type
+    item_id = callback_data.item_id
     
     # Проверяем права администратора
-    if callback_query.from_user.id not in IsAdminFilter.admin_ids:
+    if not is_admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
     # Проверяем, что товар/телефон существует и не продан
     async with db_pool.acquire() as connection:
         if item_type == "products":
-            item = await connection.fetchrow("""
-                SELECT name, is_sold, purchase_price 
-                FROM products 
-                WHERE id = $1
-            """, item_id)
+            item = await registry.fetchrow(connection, SELL_PRODUCT_CHECK_QUERY, item_id)
         else:  # phones
-            item = await connection.fetchrow("""
-                SELECT p.name, p.is_sold, p.purchase_price,
-                       b.name AS brand_name, m.name AS model_name
-                FROM phones p
-                LEFT JOIN models m ON p.model_id = m.id
-                LEFT JOIN brands b ON m.brand_id = b.id
-                WHERE p.id = $1
-            """, item_id)
+            item = await registry.fetchrow(connection, SELL_PHONE_CHECK_QUERY, item_id)
     
     if not item:
         await callback_query.answer("Товар/телефон не найден", show_alert=True)
@@ -1210,20 +1699,18 @@ async def handle_sell_item(callback_query: types.CallbackQuery, state: FSMContex
     await track_message_id(state, message.message_id)
     await state.set_state(SaleProcess.waiting_for_sale_price)
 
-async def handle_add_product_from_menu(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_add_product_from_menu(callback_query: types.CallbackQuery, state: FSMContext, db_pool,
+                                       is_admin: bool = False):
     """Обработчик для добавления товара из меню навигации"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
     # Проверяем права администратора
-    if callback_query.from_user.id not in IsAdminFilter.admin_ids:
+    if not is_admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
     # Проверяем наличие категорий
-    async with db_pool.acquire() as connection:
-        categories = await connection.fetch("SELECT id, name FROM categories;")
-
-    if not categories:
+    if not reference_cache.list('categories'):
         await callback_query.message.edit_text(
             "В базе нет ни одной категории. Добавьте их, прежде чем создавать продукт.",
             reply_markup=get_back_to_menu_keyboard()
@@ -1234,22 +1721,22 @@ async def handle_add_product_from_menu(callback_query: types.CallbackQuery, stat
     # Запускаем процесс создания товара
     await callback_query.message.edit_text(
         "Отлично, давайте добавим новый продукт. Выберите категорию товара:", 
-        reply_markup=get_categories_keyboard(categories)
+        reply_markup=get_categories_keyboard()
     )
     await state.set_state(ProductCreation.waiting_for_category)
 
-async def handle_add_phone_from_menu(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_add_phone_from_menu(callback_query: types.CallbackQuery, state: FSMContext, db_pool,
+                                     is_admin: bool = False):
     """Обработчик для добавления телефона из меню навигации"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
     # Проверяем права администратора
-    if callback_query.from_user.id not in IsAdminFilter.admin_ids:
+    if not is_admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
     # Проверяем наличие категорий и находим категорию "Телефоны"
-    async with db_pool.acquire() as connection:
-        phone_category = await connection.fetchrow("SELECT id, name FROM categories WHERE LOWER(name) = 'телефоны';")
+    phone_category = reference_cache.find_category('телефоны')
         
     if not phone_category:
         await callback_query.message.edit_text(
@@ -1260,10 +1747,7 @@ async def handle_add_phone_from_menu(callback_query: types.CallbackQuery, state:
         return
         
     # Проверяем наличие брендов
-    async with db_pool.acquire() as connection:
-        brands = await connection.fetch("SELECT id, name FROM brands ORDER BY name;")
-        
-    if not brands:
+    if not reference_cache.list('brands'):
         await callback_query.message.edit_text(
             "В базе нет брендов. Добавьте их прежде чем создавать телефон.",
             reply_markup=get_back_to_menu_keyboard()
@@ -1281,24 +1765,22 @@ async def handle_add_phone_from_menu(callback_query: types.CallbackQuery, state:
     
     await callback_query.message.edit_text(
         "Выберите бренд телефона:", 
-        reply_markup=get_brands_keyboard(brands)
+        reply_markup=get_brands_keyboard()
     )
     await state.set_state(ProductCreation.waiting_for_brand)
 
-async def handle_add_another_product(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_add_another_product(callback_query: types.CallbackQuery, state: FSMContext, db_pool,
+                                     is_admin: bool = False):
     """Обработчик для кнопки 'Добавить еще товар'"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
     # Проверяем права администратора
-    if callback_query.from_user.id not in IsAdminFilter.admin_ids:
+    if not is_admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
     # Проверяем наличие категорий
-    async with db_pool.acquire() as connection:
-        categories = await connection.fetch("SELECT id, name FROM categories;")
-
-    if not categories:
+    if not reference_cache.list('categories'):
         await callback_query.message.edit_text(
             "В базе нет ни одной категории. Добавьте их, прежде чем создавать продукт.",
             reply_markup=get_back_to_menu_keyboard()
@@ -1309,22 +1791,22 @@ async def handle_add_another_product(callback_query: types.CallbackQuery, state:
     # Запускаем процесс создания товара
     await callback_query.message.edit_text(
         "Отлично, давайте добавим еще один продукт. Выберите категорию товара:", 
-        reply_markup=get_categories_keyboard(categories)
+        reply_markup=get_categories_keyboard()
     )
     await state.set_state(ProductCreation.waiting_for_category)
 
-async def handle_add_another_phone(callback_query: types.CallbackQuery, state: FSMContext, db_pool):
+async def handle_add_another_phone(callback_query: types.CallbackQuery, state: FSMContext, db_pool,
+                                   is_admin: bool = False):
     """Обработчик для кнопки 'Добавить еще телефон'"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
     # Проверяем права администратора
-    if callback_query.from_user.id not in IsAdminFilter.admin_ids:
+    if not is_admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
     # Проверяем наличие категорий и находим категорию "Телефоны"
-    async with db_pool.acquire() as connection:
-        phone_category = await connection.fetchrow("SELECT id, name FROM categories WHERE LOWER(name) = 'телефоны';")
+    phone_category = reference_cache.find_category('телефоны')
         
     if not phone_category:
         await callback_query.message.edit_text(
@@ -1335,10 +1817,7 @@ async def handle_add_another_phone(callback_query: types.CallbackQuery, state: F
         return
         
     # Проверяем наличие брендов
-    async with db_pool.acquire() as connection:
-        brands = await connection.fetch("SELECT id, name FROM brands ORDER BY name;")
-        
-    if not brands:
+    if not reference_cache.list('brands'):
         await callback_query.message.edit_text(
             "В базе нет брендов. Добавьте их прежде чем создавать телефон.",
             reply_markup=get_back_to_menu_keyboard()
@@ -1356,45 +1835,36 @@ async def handle_add_another_phone(callback_query: types.CallbackQuery, state: F
     
     await callback_query.message.edit_text(
         "Выберите бренд телефона:", 
-        reply_markup=get_brands_keyboard(brands)
+        reply_markup=get_brands_keyboard()
     )
     await state.set_state(ProductCreation.waiting_for_brand)
 # --- Обработчики подменю ---
 
-async def handle_products_submenu(callback_query: types.CallbackQuery, db_pool):
+async def handle_products_submenu(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Обработчик подменю товаров"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
     await callback_query.message.edit_text(
         "📦 **Меню товаров**\n\nВыберите действие:",
         reply_markup=get_products_submenu_keyboard(is_admin),
         parse_mode="Markdown"
     )
 
-async def handle_phones_submenu(callback_query: types.CallbackQuery, db_pool):
+async def handle_phones_submenu(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Обработчик подменю телефонов"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
     await callback_query.message.edit_text(
         "📱 **Меню телефонов**\n\nВыберите действие:",
         reply_markup=get_phones_submenu_keyboard(is_admin),
         parse_mode="Markdown"
     )
 
-async def handle_products_available(callback_query: types.CallbackQuery, db_pool):
+async def handle_products_available(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать товары в наличии"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    products = await get_products_list(db_pool, sold_status=False)
+    products, total_count = await get_products_page(db_pool, sold_status=False)
     
     if not products:
         text = "📦 **Товары в наличии**\n\nВ базе данных нет товаров в наличии."
@@ -1408,22 +1878,20 @@ async def handle_products_available(callback_query: types.CallbackQuery, db_pool
     # Показываем первый товар
     current_index = 0
     product = products[current_index]
-    text = format_product_info(product, current_index, len(products))
+    text = format_product_info(product, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode="Markdown",
-        reply_markup=get_item_navigation_keyboard('products', current_index, len(products), product['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('products', current_index, total_count, product['id'], is_admin,
+                                                  has_next=len(products) > 1)
     )
 
-async def handle_products_sold(callback_query: types.CallbackQuery, db_pool):
+async def handle_products_sold(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать проданные товары"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    products = await get_products_list(db_pool, sold_status=True)
+    products, total_count = await get_products_page(db_pool, sold_status=True)
     
     if not products:
         text = "💰 **Проданные товары**\n\nПока нет проданных товаров."
@@ -1437,22 +1905,20 @@ async def handle_products_sold(callback_query: types.CallbackQuery, db_pool):
     # Показываем первый товар
     current_index = 0
     product = products[current_index]
-    text = format_product_info(product, current_index, len(products))
+    text = format_product_info(product, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode="Markdown",
-        reply_markup=get_item_navigation_keyboard('products', current_index, len(products), product['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('products', current_index, total_count, product['id'], is_admin,
+                                                  has_next=len(products) > 1)
     )
 
-async def handle_phones_available(callback_query: types.CallbackQuery, db_pool):
+async def handle_phones_available(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать телефоны в наличии"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    phones = await get_phones_list(db_pool, sold_status=False)
+    phones, total_count = await get_phones_page(db_pool, sold_status=False)
     
     if not phones:
         text = "📱 **Телефоны в наличии**\n\nВ базе данных нет телефонов в наличии."
@@ -1466,22 +1932,20 @@ async def handle_phones_available(callback_query: types.CallbackQuery, db_pool):
     # Показываем первый телефон
     current_index = 0
     phone = phones[current_index]
-    text = format_phone_info(phone, current_index, len(phones))
+    text = format_phone_info(phone, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode="Markdown",
-        reply_markup=get_item_navigation_keyboard('phones', current_index, len(phones), phone['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('phones', current_index, total_count, phone['id'], is_admin,
+                                                  has_next=len(phones) > 1)
     )
 
-async def handle_phones_sold(callback_query: types.CallbackQuery, db_pool):
+async def handle_phones_sold(callback_query: types.CallbackQuery, db_pool, is_admin: bool = False):
     """Показать проданные телефоны"""
     await callback_query.bot.answer_callback_query(callback_query.id)
     
-    # Проверяем, является ли пользователь админом
-    is_admin = callback_query.from_user.id in IsAdminFilter.admin_ids
-    
-    phones = await get_phones_list(db_pool, sold_status=True)
+    phones, total_count = await get_phones_page(db_pool, sold_status=True)
     
     if not phones:
         text = "💰 **Проданные телефоны**\n\nПока нет проданных телефонов."
@@ -1495,12 +1959,13 @@ async def handle_phones_sold(callback_query: types.CallbackQuery, db_pool):
     # Показываем первый телефон
     current_index = 0
     phone = phones[current_index]
-    text = format_phone_info(phone, current_index, len(phones))
+    text = format_phone_info(phone, current_index, total_count)
     
     await callback_query.message.edit_text(
         text,
         parse_mode="Markdown",
-        reply_markup=get_item_navigation_keyboard('phones', current_index, len(phones), phone['id'], is_admin)
+        reply_markup=get_item_navigation_keyboard('phones', current_index, total_count, phone['id'], is_admin,
+                                                  has_next=len(phones) > 1)
     )
 # Дополнительные обработчики для продажи - временный файл
 
@@ -1556,104 +2021,109 @@ async def handle_sale_price_input(message: types.Message, state: FSMContext, db_
         await message.reply("❌ Неверный формат цены. Введите числовое значение (например: 15000 или 15000.50).")
 
 
+# Продажа одним атомарным запросом: UPDATE с условием NOT is_sold блокирует строку,
+# поэтому при одновременной продаже одного товара второй запрос не найдет непроданную строку.
+# В том же запросе записывается транзакция и обновляются сводка shop_summary и продажи дня daily_sales.
+SALE_PRODUCT_QUERY = registry.register('sale_product', """
+    WITH sold AS (
+        UPDATE products
+        SET is_sold = TRUE,
+            sale_price = $2
+        WHERE id = $1 AND NOT is_sold
+        RETURNING id, name, purchase_price, quantity
+    ), sale_transaction AS (
+        INSERT INTO transactions (product_id, phone_id, type, amount, description)
+        SELECT id, NULL, 'sale', $2, 'Продажа товара: ' || name
+        FROM sold
+    ), summary AS (
+        UPDATE shop_summary
+        SET products_sold_count = products_sold_count + 1,
+            products_profit = products_profit + ($2 - sold.purchase_price) * sold.quantity,
+            products_investment = products_investment + sold.purchase_price * sold.quantity,
+            products_revenue = products_revenue + $2 * sold.quantity,
+            stock_investment = stock_investment - sold.purchase_price * sold.quantity,
+            updated_at = CURRENT_TIMESTAMP
+        FROM sold
+        WHERE shop_summary.id = 1
+    ), daily AS (
+        INSERT INTO daily_sales (day, products_sold_count, products_revenue, products_cost)
+        SELECT CURRENT_DATE, 1, $2 * quantity, purchase_price * quantity
+        FROM sold
+        ON CONFLICT (day) DO UPDATE
+        SET products_sold_count = daily_sales.products_sold_count + EXCLUDED.products_sold_count,
+            products_revenue = daily_sales.products_revenue + EXCLUDED.products_revenue,
+            products_cost = daily_sales.products_cost + EXCLUDED.products_cost
+    )
+    SELECT name, purchase_price FROM sold;
+""")
+
+SALE_PHONE_QUERY = registry.register('sale_phone', """
+    WITH sold AS (
+        UPDATE phones
+        SET is_sold = TRUE,
+            sale_price = $2
+        WHERE id = $1 AND NOT is_sold
+        RETURNING id, name, model_id, purchase_price
+    ), named AS (
+        SELECT sold.id, sold.purchase_price,
+               COALESCE(b.name || ' ' || m.name, sold.name) AS name
+        FROM sold
+        LEFT JOIN models m ON sold.model_id = m.id
+        LEFT JOIN brands b ON m.brand_id = b.id
+    ), sale_transaction AS (
+        INSERT INTO transactions (product_id, phone_id, type, amount, description)
+        SELECT NULL, id, 'sale', $2, 'Продажа телефона: ' || name
+        FROM named
+    ), summary AS (
+        UPDATE shop_summary
+        SET phones_sold_count = phones_sold_count + 1,
+            phones_profit = phones_profit + ($2 - sold.purchase_price),
+            phones_investment = phones_investment + sold.purchase_price,
+            phones_revenue = phones_revenue + $2,
+            stock_investment = stock_investment - sold.purchase_price,
+            updated_at = CURRENT_TIMESTAMP
+        FROM sold
+        WHERE shop_summary.id = 1
+    ), daily AS (
+        INSERT INTO daily_sales (day, phones_sold_count, phones_revenue, phones_cost)
+        SELECT CURRENT_DATE, 1, $2, purchase_price
+        FROM sold
+        ON CONFLICT (day) DO UPDATE
+        SET phones_sold_count = daily_sales.phones_sold_count + EXCLUDED.phones_sold_count,
+            phones_revenue = daily_sales.phones_revenue + EXCLUDED.phones_revenue,
+            phones_cost = daily_sales.phones_cost + EXCLUDED.phones_cost
+    )
+    SELECT name, purchase_price FROM named;
+""")
+
+
 async def process_sale(db_pool, item_type, item_id, sale_price):
     """
-    Обрабатывает продажу товара/телефона.
-    Добавлено подробное логирование для отладки.
+    Обрабатывает продажу товара/телефона одним запросом.
+    Возвращает (успех, прибыль).
     """
-    print(f"[LOG] Начало обработки продажи. Тип: '{item_type}', ID: {item_id}, Цена продажи: {sale_price}")
+    logger.debug("Продажа: тип=%s id=%s цена=%s", item_type, item_id, sale_price)
+
+    if item_type == "products":
+        query = SALE_PRODUCT_QUERY
+    elif item_type == "phones":
+        query = SALE_PHONE_QUERY
+    else:
+        logger.error("Продажа: неизвестный тип товара %r", item_type)
+        return False, 0
 
     try:
         async with db_pool.acquire() as connection:
-            async with connection.transaction():
-                if item_type == "products":
-                    print(f"[LOG] Тип товара - 'products'. Получение информации о товаре ID: {item_id}...")
-
-                    # Получаем информацию о товаре
-                    product = await connection.fetchrow("""
-                                                        SELECT name, purchase_price, is_sold
-                                                        FROM products
-                                                        WHERE id = $1
-                                                        """, item_id)
-                    print(f"[LOG] Полученная информация: {product}")
-
-                    if not product or product['is_sold']:
-                        print(f"[ERROR] Товар ID: {item_id} не найден или уже продан. Возвращаю False.")
-                        return False, 0
-
-                    print(f"[LOG] Товар '{product['name']}' найден и доступен. Обновление статуса...")
-
-                    # Обновляем статус товара
-                    await connection.execute("""
-                                             UPDATE products
-                                             SET is_sold    = TRUE,
-                                                 sale_price = $2
-                                             WHERE id = $1
-                                             """, item_id, sale_price)
-
-                    # Создаем запись в транзакциях
-                    # Конвертируем sale_price в Decimal для корректного вычисления прибыли
-                    profit = Decimal(str(sale_price)) - product['purchase_price']
-                    print(f"[LOG] Создаю запись о транзакции. Прибыль: {profit}")
-                    await connection.execute("""
-                                             INSERT INTO transactions (product_id, phone_id, type, amount, description)
-                                             VALUES ($1, NULL, 'sale', $2, $3)
-                                             """, item_id, sale_price, f"Продажа товара: {product['name']}")
-
-                    print(f"[SUCCESS] Продажа товара ID: {item_id} успешно завершена. Прибыль: {profit}")
-                    return True, profit
-
-                elif item_type == "phones":
-                    print(f"[LOG] Тип товара - 'phones'. Получение информации о телефоне ID: {item_id}...")
-
-                    # Получаем информацию о телефоне
-                    phone = await connection.fetchrow("""
-                                                      SELECT p.name,
-                                                             p.purchase_price,
-                                                             p.is_sold,
-                                                             b.name AS brand_name,
-                                                             m.name AS model_name
-                                                      FROM phones p
-                                                               LEFT JOIN models m ON p.model_id = m.id
-                                                               LEFT JOIN brands b ON m.brand_id = b.id
-                                                      WHERE p.id = $1
-                                                      """, item_id)
-                    print(f"[LOG] Полученная информация: {phone}")
-
-                    if not phone or phone['is_sold']:
-                        print(f"[ERROR] Телефон ID: {item_id} не найден или уже продан. Возвращаю False.")
-                        return False, 0
-
-                    print(f"[LOG] Телефон найден и доступен. Обновление статуса...")
-
-                    # Обновляем статус телефона
-                    await connection.execute("""
-                                             UPDATE phones
-                                             SET is_sold    = TRUE,
-                                                 sale_price = $2
-                                             WHERE id = $1
-                                             """, item_id, sale_price)
-
-                    # Создаем запись в транзакциях
-                    # Конвертируем sale_price в Decimal для корректного вычисления прибыли
-                    profit = Decimal(str(sale_price)) - phone['purchase_price']
-                    phone_name = f"{phone['brand_name']} {phone['model_name']}" if phone['brand_name'] and phone[
-                        'model_name'] else phone['name']
-                    print(f"[LOG] Создаю запись о транзакции. Прибыль: {profit}")
-                    await connection.execute("""
-                                             INSERT INTO transactions (product_id, phone_id, type, amount, description)
-                                             VALUES (NULL, $1, 'sale', $2, $3)
-                                             """, item_id, sale_price, f"Продажа телефона: {phone_name}")
-
-                    print(f"[SUCCESS] Продажа телефона ID: {item_id} успешно завершена. Прибыль: {profit}")
-                    return True, profit
-
-                else:
-                    print(f"[ERROR] Неизвестный тип товара: '{item_type}'. Возвращаю False.")
-                    return False, 0
-
+            sold = await registry.fetchrow(connection, query, item_id, sale_price)
+    except Exception:
+        logger.exception("Продажа: ошибка при продаже %s id=%s", item_type, item_id)
+        return False, 0
 
-    except Exception as e:
-        # Выводим подробную ошибку в консоль для отладки
-        print(f"[CRITICAL ERROR] Произошла непредвиденная ошибка при продаже: {e}")
+    if not sold:
+        logger.warning("Продажа: %s id=%s не найден или уже продан", item_type, item_id)
         return False, 0
+
+    # Конвертируем sale_price в Decimal для корректного вычисления прибыли
+    profit = Decimal(str(sale_price)) - sold['purchase_price']
+    logger.info("Продажа: %s id=%s (%s) продан за %s, прибыль %s", item_type, item_id, sold['name'], sale_price, profit)
+    return True, profit
@@ -0,0 +1,370 @@
+# Массовый импорт телефонов и товаров из CSV/XLSX-файла, отправленного администратором.
+# Названия справочников сопоставляются с id по reference_cache за один проход по файлу,
+# строки проверяются в памяти, а корректные загружаются через COPY во временную таблицу
+# и переносятся в phones/products одним INSERT ... SELECT в той же транзакции, что и сводка.
+import csv
+import io
+import os
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from metrics import metrics
+from queries import registry
+from reference_cache import reference_cache
+from summary import add_stock
+
+# Лимит Bot API на скачивание файлов ботом
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+IMPORT_MAX_ROWS = 10000
+IMPORT_EXTENSIONS = ('.csv', '.xlsx')
+# Максимум NUMERIC(10, 2)
+MAX_PRICE = Decimal('99999999.99')
+
+# Названия колонок (в нижнем регистре) -> поле; допускаются английские и русские заголовки
+COLUMN_ALIASES = {
+    'brand': 'brand', 'бренд': 'brand',
+    'model': 'model', 'модель': 'model',
+    'storage': 'storage', 'память': 'storage', 'объем памяти': 'storage',
+    'color': 'color', 'colour': 'color', 'цвет': 'color',
+    'market': 'market', 'рынок': 'market',
+    'condition': 'condition', 'состояние': 'condition',
+    'purchase_price': 'purchase_price', 'закупочная цена': 'purchase_price', 'цена закупки': 'purchase_price',
+    'sale_price': 'sale_price', 'цена продажи': 'sale_price',
+    'battery_health': 'battery_health', 'battery': 'battery_health', 'батарея': 'battery_health',
+    'repaired': 'repaired', 'восстанавливался': 'repaired',
+    'full_kit': 'full_kit', 'полная комплектация': 'full_kit', 'комплект': 'full_kit',
+    'imei': 'imei',
+    'serial_number': 'serial_number', 'serial': 'serial_number', 'серийный номер': 'serial_number',
+    'name': 'name', 'название': 'name',
+    'category': 'category', 'категория': 'category',
+    'quantity': 'quantity', 'количество': 'quantity',
+}
+
+PHONE_REQUIRED = ('brand', 'model', 'storage', 'color', 'market', 'condition', 'purchase_price')
+PRODUCT_REQUIRED = ('name', 'category', 'purchase_price')
+
+# t/f - так булевы значения выгружает /export (COPY ... CSV)
+TRUE_VALUES = {'1', 't', 'true', 'yes', 'y', 'да', 'д', '+'}
+FALSE_VALUES = {'0', 'f', 'false', 'no', 'n', 'нет', 'н', '-'}
+
+PHONE_STAGING_COLUMNS = (
+    'row_number', 'name', 'purchase_price', 'sale_price', 'model_id', 'color_id', 'storage_capacity_id',
+    'market_id', 'condition_id', 'battery_health', 'repaired', 'full_kit', 'imei', 'serial_number',
+)
+PRODUCT_STAGING_COLUMNS = ('row_number', 'name', 'purchase_price', 'sale_price', 'quantity', 'category_id')
+
+# Временные таблицы создаются на время транзакции импорта, поэтому запросы к ним не подготавливаются заранее
+PHONES_STAGING_QUERY = registry.register('import_phones_staging', """
+    CREATE TEMP TABLE import_phones (
+        row_number INTEGER,
+        name VARCHAR(255),
+        purchase_price NUMERIC(10, 2),
+        sale_price NUMERIC(10, 2),
+        model_id INTEGER,
+        color_id INTEGER,
+        storage_capacity_id INTEGER,
+        market_id INTEGER,
+        condition_id INTEGER,
+        battery_health INTEGER,
+        repaired BOOLEAN,
+        full_kit BOOLEAN,
+        imei VARCHAR(17),
+        serial_number VARCHAR(50)
+    ) ON COMMIT DROP;
+""", prepare=False)
+
+# Строки с IMEI/серийным номером, который уже есть в базе (проверка по уникальным индексам)
+PHONES_DUPLICATES_QUERY = registry.register('import_phones_duplicates', """
+    DELETE FROM import_phones s
+    WHERE EXISTS (SELECT 1 FROM phones p WHERE p.imei = s.imei)
+       OR EXISTS (SELECT 1 FROM phones p WHERE p.serial_number = s.serial_number)
+    RETURNING s.row_number, s.imei, s.serial_number;
+""", prepare=False)
+
+PHONES_INSERT_QUERY = registry.register('import_phones_insert', """
+    WITH inserted AS (
+        INSERT INTO phones (name, purchase_price, sale_price, model_id, color_id, storage_capacity_id, market_id,
+                            condition_id, battery_health, repaired, full_kit, imei, serial_number)
+        SELECT name, purchase_price, sale_price, model_id, color_id, storage_capacity_id, market_id,
+               condition_id, battery_health, repaired, full_kit, imei, serial_number
+        FROM import_phones
+        ORDER BY row_number
+        RETURNING purchase_price
+    )
+    SELECT COUNT(*) AS count, COALESCE(SUM(purchase_price), 0) AS investment FROM inserted;
+""", prepare=False)
+
+PRODUCTS_STAGING_QUERY = registry.register('import_products_staging', """
+    CREATE TEMP TABLE import_products (
+        row_number INTEGER,
+        name VARCHAR(255),
+        purchase_price NUMERIC(10, 2),
+        sale_price NUMERIC(10, 2),
+        quantity INTEGER,
+        category_id INTEGER
+    ) ON COMMIT DROP;
+""", prepare=False)
+
+PRODUCTS_INSERT_QUERY = registry.register('import_products_insert', """
+    WITH inserted AS (
+        INSERT INTO products (name, purchase_price, sale_price, quantity, category_id)
+        SELECT name, purchase_price, sale_price, quantity, category_id
+        FROM import_products
+        ORDER BY row_number
+        RETURNING purchase_price, quantity
+    )
+    SELECT COUNT(*) AS count, COALESCE(SUM(purchase_price * quantity), 0) AS investment FROM inserted;
+""", prepare=False)
+
+
+class ImportFileError(ValueError):
+    """Файл не может быть импортирован целиком (формат, заголовок, размер)"""
+
+
+class ImportResult:
+    def __init__(self, kind, total):
+        self.kind = kind
+        self.total = total
+        self.imported = 0
+        # [(номер строки в файле, описание ошибки), ...]
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.total / self.seconds if self.seconds else 0.0
+
+
+def read_rows(filename, content):
+    """Читает таблицу из CSV или XLSX. Возвращает (поля заголовка, [(номер строки, значения), ...])"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        table = _read_xlsx(content)
+    elif extension == '.csv':
+        table = _read_csv(content)
+    else:
+        raise ImportFileError("Поддерживаются файлы .csv и .xlsx")
+
+    try:
+        header = next(table)
+    except StopIteration:
+        raise ImportFileError("Файл пуст")
+    fields = [COLUMN_ALIASES.get(str(cell or '').strip().lower()) for cell in header]
+
+    rows = []
+    # Номера строк как в табличном редакторе: заголовок - строка 1
+    for row_number, values in enumerate(table, start=2):
+        values = ['' if value is None else str(value).strip() for value in values]
+        if not any(values):
+            continue
+        if len(rows) == IMPORT_MAX_ROWS:
+            raise ImportFileError(f"В файле больше {IMPORT_MAX_ROWS} строк, разделите его на части")
+        rows.append((row_number, values))
+    return fields, rows
+
+
+def _read_csv(content):
+    text = content.decode('utf-8-sig')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text), dialect)
+
+
+def _read_xlsx(content):
+    try:
+        # Нужна только для импорта Excel-файлов
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("Импорт .xlsx недоступен: не установлен пакет openpyxl. Отправьте файл в формате CSV")
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    return workbook.active.iter_rows(values_only=True)
+
+
+def detect_kind(fields):
+    """phones или products по набору колонок"""
+    if 'model' in fields or 'imei' in fields:
+        return 'phones'
+    if 'name' in fields and 'category' in fields:
+        return 'products'
+    raise ImportFileError(
+        "Не удалось определить тип файла: для телефонов нужны колонки brand, model, storage, color, "
+        "market, condition, purchase_price; для товаров - name, category, purchase_price"
+    )
+
+
+def parse_price(value, field):
+    try:
+        price = Decimal(value.replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"{field}: неверное число '{value}'")
+    # Decimal принимает 'NaN' и 'Infinity', сравнение с ними падает с InvalidOperation
+    if not price.is_finite():
+        raise ValueError(f"{field}: неверное число '{value}'")
+    if price < 0 or price > MAX_PRICE:
+        raise ValueError(f"{field}: недопустимое значение {value}")
+    return price.quantize(Decimal('0.01'))
+
+
+def parse_bool(value, field, default):
+    if not value:
+        return default
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"{field}: ожидается да/нет, получено '{value}'")
+
+
+def parse_int(value, field, minimum, maximum):
+    try:
+        number = int(float(value.replace(',', '.')))
+    except (ValueError, OverflowError):
+        raise ValueError(f"{field}: неверное целое число '{value}'")
+    if not minimum <= number <= maximum:
+        raise ValueError(f"{field}: значение должно быть от {minimum} до {maximum}")
+    return number
+
+
+def parse_storage_gb(value):
+    """'128', '128 ГБ', '1TB' -> объем в ГБ"""
+    match = re.match(r'\s*(\d+)\s*(тб|tb)?', value.lower())
+    if not match:
+        raise ValueError(f"storage: неверный объем памяти '{value}'")
+    return int(match.group(1)) * (1024 if match.group(2) else 1)
+
+
+def build_lookups():
+    """Словари 'название в нижнем регистре' -> id по справочникам из reference_cache"""
+    def by_name(table):
+        return {row['name'].lower(): row['id'] for row in reference_cache.list(table)}
+
+    markets = by_name('markets')
+    for market in reference_cache.list('markets'):
+        if market['country_code']:
+            markets.setdefault(market['country_code'].lower(), market['id'])
+    return {
+        'brand': by_name('brands'),
+        'model': {(row['brand_id'], row['name'].lower()): row['id'] for row in reference_cache.list('models')},
+        'storage': {row['capacity_gb']: row['id'] for row in reference_cache.list('storage_capacities')},
+        'color': by_name('colors'),
+        'market': markets,
+        'condition': by_name('conditions'),
+        'category': by_name('categories'),
+    }
+
+
+def _lookup(lookups, field, key, value):
+    item_id = lookups[field].get(key)
+    if item_id is None:
+        raise ValueError(f"{field}: значение '{value}' не найдено в справочнике")
+    return item_id
+
+
+def parse_phone_row(row_number, row, lookups, seen):
+    """Запись для import_phones; seen - IMEI и серийные номера предыдущих строк файла"""
+    brand_id = _lookup(lookups, 'brand', row['brand'].lower(), row['brand'])
+    model_id = _lookup(lookups, 'model', (brand_id, row['model'].lower()), row['model'])
+    storage_id = _lookup(lookups, 'storage', parse_storage_gb(row['storage']), row['storage'])
+    color_id = _lookup(lookups, 'color', row['color'].lower(), row['color'])
+    market_id = _lookup(lookups, 'market', row['market'].lower(), row['market'])
+    condition_id = _lookup(lookups, 'condition', row['condition'].lower(), row['condition'])
+    purchase_price = parse_price(row['purchase_price'], 'purchase_price')
+    sale_price = parse_price(row['sale_price'], 'sale_price') if row.get('sale_price') else None
+
+    # Как в мастере: для б/у телефона батарея указывается, для нового - 100%, без ремонта и с комплектом
+    is_used = row['condition'].lower() == 'б/у'
+    battery_health = row.get('battery_health')
+    battery_health = parse_int(battery_health, 'battery_health', 0, 100) if battery_health else (None if is_used else 100)
+    repaired = parse_bool(row.get('repaired'), 'repaired', False)
+    full_kit = parse_bool(row.get('full_kit'), 'full_kit', True)
+
+    name = row.get('name') or 'Телефон'
+    if len(name) > 255:
+        raise ValueError("name: длиннее 255 символов")
+    imei = row.get('imei') or None
+    serial_number = row.get('serial_number') or None
+    if imei and len(imei) > 17:
+        raise ValueError("imei: длиннее 17 символов")
+    if serial_number and len(serial_number) > 50:
+        raise ValueError("serial_number: длиннее 50 символов")
+    for field, value in (('imei', imei), ('serial_number', serial_number)):
+        if value is None:
+            continue
+        if (field, value) in seen:
+            raise ValueError(f"{field}: {value} повторяется в строке {seen[field, value]}")
+        seen[field, value] = row_number
+
+    return (row_number, name, purchase_price, sale_price, model_id, color_id, storage_id,
+            market_id, condition_id, battery_health, repaired, full_kit, imei, serial_number)
+
+
+def parse_product_row(row_number, row, lookups, seen):
+    """Запись для import_products"""
+    name = row['name']
+    if len(name) > 255:
+        raise ValueError("name: длиннее 255 символов")
+    category_id = _lookup(lookups, 'category', row['category'].lower(), row['category'])
+    purchase_price = parse_price(row['purchase_price'], 'purchase_price')
+    sale_price = parse_price(row['sale_price'], 'sale_price') if row.get('sale_price') else None
+    quantity = parse_int(row['quantity'], 'quantity', 1, 1000000) if row.get('quantity') else 1
+    return (row_number, name, purchase_price, sale_price, quantity, category_id)
+
+
+IMPORT_KINDS = {
+    'phones': (PHONE_REQUIRED, parse_phone_row, PHONES_STAGING_QUERY, 'import_phones', PHONE_STAGING_COLUMNS,
+               PHONES_INSERT_QUERY),
+    'products': (PRODUCT_REQUIRED, parse_product_row, PRODUCTS_STAGING_QUERY, 'import_products',
+                 PRODUCT_STAGING_COLUMNS, PRODUCTS_INSERT_QUERY),
+}
+
+
+async def import_file(db_pool, filename, content):
+    """
+    Импортирует телефоны или товары из файла. Строки с ошибками пропускаются
+    и возвращаются в ImportResult.errors, остальные добавляются одной транзакцией.
+    """
+    started = time.perf_counter()
+    fields, rows = read_rows(filename, content)
+    kind = detect_kind(fields)
+    required, parse_row, staging_query, staging_table, staging_columns, insert_query = IMPORT_KINDS[kind]
+    missing = [field for field in required if field not in fields]
+    if missing:
+        raise ImportFileError(f"Нет обязательных колонок: {', '.join(missing)}")
+
+    result = ImportResult(kind, len(rows))
+    lookups = build_lookups()
+    seen = {}
+    records = []
+    for row_number, values in rows:
+        row = {field: value for field, value in zip(fields, values) if field}
+        empty = [field for field in required if not row.get(field)]
+        if empty:
+            result.errors.append((row_number, f"не заполнены: {', '.join(empty)}"))
+            continue
+        try:
+            records.append(parse_row(row_number, row, lookups, seen))
+        except ValueError as e:
+            result.errors.append((row_number, str(e)))
+
+    if records:
+        async with db_pool.acquire() as connection:
+            async with connection.transaction():
+                await registry.execute(connection, staging_query)
+                await connection.copy_records_to_table(staging_table, records=records, columns=staging_columns)
+                if kind == 'phones':
+                    for duplicate in await registry.fetch(connection, PHONES_DUPLICATES_QUERY):
+                        value = duplicate['imei'] or duplicate['serial_number']
+                        result.errors.append((duplicate['row_number'], f"телефон {value} уже есть в базе"))
+                inserted = await registry.fetchrow(connection, insert_query)
+                # Сводка обновляется в той же транзакции, что и добавление
+                await add_stock(connection, inserted['investment'], 1)
+        result.imported = inserted['count']
+
+    result.errors.sort()
+    result.seconds = time.perf_counter() - started
+    metrics.increment(f'import.{kind}.rows', result.imported)
+    metrics.observe('import.rows_per_second', result.rows_per_second)
+    return result
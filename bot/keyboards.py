@@ -1,5 +1,54 @@
+import inspect
+from functools import wraps
 from aiogram import types
+from reference_cache import reference_cache
+from callbacks import BrandCallback, CategoryCallback, ColorCallback, ConditionCallback, EditItemCallback, \
+    MarketCallback, ModelCallback, SalesReportCallback, SellItemCallback, StorageCallback, get_nav_callback_factory
 
+# Кэш готовых клавиатур: {имя функции: {аргументы: (версии справочников, клавиатура)}}
+_keyboard_cache = {}
+
+def _copy_keyboard(markup):
+    """
+    Копия клавиатуры со своими списками рядов и кнопками, чтобы изменения у вызывающего
+    не попадали в кэш. Кнопки копируются поверхностно: их поля - строки и callback_data.
+    """
+    field = 'inline_keyboard' if isinstance(markup, types.InlineKeyboardMarkup) else 'keyboard'
+    rows = [[button.model_copy() for button in row] for row in getattr(markup, field)]
+    return markup.model_copy(update={field: rows})
+
+def cached_keyboard(*tables):
+    """
+    Кэширует построенную клавиатуру по (функция, аргументы, версии справочников).
+    tables: справочные таблицы, от которых зависит клавиатура. При изменении
+    любой из них (новая версия в reference_cache) клавиатура строится заново.
+    Аргументы приводятся к параметрам функции, поэтому f(x), f(x=x) и вызов
+    со значением по умолчанию попадают в одну запись.
+    Вызовы с явно переданными списками (нехэшируемые аргументы) не кэшируются.
+    Каждый вызов получает копию клавиатуры из кэша.
+    """
+    def decorator(func):
+        entries = _keyboard_cache.setdefault(func.__name__, {})
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.items())
+            try:
+                entry = entries.get(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            versions = tuple(reference_cache.versions[table] for table in tables)
+            if entry is None or entry[0] != versions:
+                entry = entries[key] = (versions, func(*args, **kwargs))
+            return _copy_keyboard(entry[1])
+        return wrapper
+    return decorator
+
+@cached_keyboard()
 def get_main_keyboard():
     """
     Создает и возвращает основную reply-клавиатуру.
@@ -17,6 +66,7 @@ def get_main_keyboard():
         resize_keyboard=True
     )
 
+@cached_keyboard()
 def get_admin_keyboard():
     """
     Создает и возвращает inline-клавиатуру для администраторов.
@@ -38,6 +88,7 @@ def get_admin_keyboard():
         ]
     )
 
+@cached_keyboard()
 def get_sale_price_keyboard():
     """
     Создает inline-клавиатуру с кнопкой "Пропустить".
@@ -53,53 +104,64 @@ def get_sale_price_keyboard():
         ]
     )
 
-def get_conditions_keyboard(conditions):
+@cached_keyboard('conditions')
+def get_conditions_keyboard(conditions=None):
     """
-    Создает inline-клавиатуру из списка состояний.
+    Создает inline-клавиатуру из списка состояний (по умолчанию - из кэша справочников).
     """
+    if conditions is None:
+        conditions = reference_cache.list('conditions')
     buttons = [
-        types.InlineKeyboardButton(text=cond['name'], callback_data=f"condition_{cond['id']}")
+        types.InlineKeyboardButton(text=cond['name'], callback_data=ConditionCallback(id=cond['id']).pack())
         for cond in conditions
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=1, inline_keyboard=[buttons])
     return keyboard
 
-def get_categories_keyboard(categories):
+@cached_keyboard('categories')
+def get_categories_keyboard(categories=None):
     """
-    Создает inline-клавиатуру из списка категорий.
+    Создает inline-клавиатуру из списка категорий (по умолчанию - из кэша справочников).
     """
+    if categories is None:
+        categories = reference_cache.list('categories')
     buttons = [
-        types.InlineKeyboardButton(text=cat['name'], callback_data=f"category_{cat['id']}")
+        types.InlineKeyboardButton(text=cat['name'], callback_data=CategoryCallback(id=cat['id']).pack())
         for cat in categories
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=1, inline_keyboard=[buttons])
     return keyboard
 
-def get_yes_no_keyboard(callback_prefix):
+@cached_keyboard()
+def get_yes_no_keyboard(callback_factory):
     """
     Создает inline-клавиатуру с кнопками "Да" и "Нет".
+    callback_factory: класс CallbackData с полем value (RepairedCallback, FullKitCallback).
     """
     return types.InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 types.InlineKeyboardButton(
                     text="Да",
-                    callback_data=f"{callback_prefix}_yes"
+                    callback_data=callback_factory(value=True).pack()
                 ),
                 types.InlineKeyboardButton(
                     text="Нет",
-                    callback_data=f"{callback_prefix}_no"
+                    callback_data=callback_factory(value=False).pack()
                 )
             ]
         ]
     )
 
-def get_brands_keyboard(brands):
+@cached_keyboard('brands')
+def get_brands_keyboard(brands=None):
     """
-    Создает inline-клавиатуру из списка брендов.
+    Создает inline-клавиатуру из списка брендов (по умолчанию - из кэша справочников).
     """
+    if brands is None:
+        brands = reference_cache.list('brands')
     buttons = [
-        types.InlineKeyboardButton(text=brand['name'], callback_data=f"brand_{brand['id']}")
+        types.InlineKeyboardButton(text=brand['name'], callback_data=BrandCallback(id=brand['id']).pack())
         for brand in brands
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=2, inline_keyboard=[buttons[i:i+2] for i in range(0, len(buttons), 2)])
@@ -110,45 +172,55 @@ def get_models_keyboard(models):
     Создает inline-клавиатуру из списка моделей для выбранного бренда.
     """
     buttons = [
-        types.InlineKeyboardButton(text=model['name'], callback_data=f"model_{model['id']}")
+        types.InlineKeyboardButton(text=model['name'], callback_data=ModelCallback(id=model['id']).pack())
         for model in models
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=1, inline_keyboard=[[button] for button in buttons])
     return keyboard
 
-def get_colors_keyboard_from_db(colors):
+@cached_keyboard('colors')
+def get_colors_keyboard_from_db(colors=None):
     """
-    Создает inline-клавиатуру из списка цветов из базы данных.
+    Создает inline-клавиатуру из списка цветов из базы данных (по умолчанию - из кэша справочников).
     """
+    if colors is None:
+        colors = reference_cache.list('colors')
     buttons = [
-        types.InlineKeyboardButton(text=color['name'], callback_data=f"color_{color['id']}")
+        types.InlineKeyboardButton(text=color['name'], callback_data=ColorCallback(id=color['id']).pack())
         for color in colors
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=3, inline_keyboard=[buttons[i:i+3] for i in range(0, len(buttons), 3)])
     return keyboard
 
-def get_storage_keyboard(storage_capacities):
+@cached_keyboard('storage_capacities')
+def get_storage_keyboard(storage_capacities=None):
     """
-    Создает inline-клавиатуру из списка объемов памяти.
+    Создает inline-клавиатуру из списка объемов памяти (по умолчанию - из кэша справочников).
     """
+    if storage_capacities is None:
+        storage_capacities = reference_cache.list('storage_capacities')
     buttons = [
-        types.InlineKeyboardButton(text=f"{storage['capacity_gb']} ГБ", callback_data=f"storage_{storage['id']}")
+        types.InlineKeyboardButton(text=f"{storage['capacity_gb']} ГБ", callback_data=StorageCallback(id=storage['id']).pack())
         for storage in storage_capacities
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=3, inline_keyboard=[buttons[i:i+3] for i in range(0, len(buttons), 3)])
     return keyboard
 
-def get_markets_keyboard(markets):
+@cached_keyboard('markets')
+def get_markets_keyboard(markets=None):
     """
-    Создает inline-клавиатуру из списка рынков.
+    Создает inline-клавиатуру из списка рынков (по умолчанию - из кэша справочников).
     """
+    if markets is None:
+        markets = reference_cache.list('markets')
     buttons = [
-        types.InlineKeyboardButton(text=market['name'], callback_data=f"market_{market['id']}")
+        types.InlineKeyboardButton(text=market['name'], callback_data=MarketCallback(id=market['id']).pack())
         for market in markets
     ]
     keyboard = types.InlineKeyboardMarkup(row_width=2, inline_keyboard=[buttons[i:i+2] for i in range(0, len(buttons), 2)])
     return keyboard
 
+@cached_keyboard()
 def get_skip_keyboard(callback_data):
     """
     Создает inline-клавиатуру с кнопкой "Пропустить".
@@ -164,6 +236,7 @@ def get_skip_keyboard(callback_data):
         ]
     )
 
+@cached_keyboard()
 def get_menu_keyboard():
     """
     Создает главную inline-клавиатуру меню.
@@ -193,15 +266,34 @@ def get_menu_keyboard():
         ]
     )
 
-def get_item_navigation_keyboard(item_type, current_index, total_count, item_id=None, is_admin=False):
+def get_nav_callback_data(item_type, target_index, direction, cursor_id=None):
+    """
+    Формирует callback_data для кнопки навигации.
+    Курсор - ID текущего товара: "nav_phones:6:next:120" означает
+    "показать телефон с индексом 6, следующий после ID 120".
+    Без курсора передается только индекс, и страница ищется по смещению.
+    """
+    if cursor_id is None:
+        direction = None
+    factory = get_nav_callback_factory(item_type)
+    return factory(index=target_index, direction=direction, cursor=cursor_id).pack()
+
+def get_item_navigation_keyboard(item_type, current_index, total_count, item_id=None, is_admin=False,
+                                 has_prev=None, has_next=None):
     """
     Создает клавиатуру для навигации по товарам/телефонам.
     item_type: 'products' или 'phones'
     current_index: текущий индекс товара (0-based)
     total_count: общее количество товаров
-    item_id: ID товара для действий (опционально)
+    item_id: ID товара для действий (опционально), используется как курсор навигации
     is_admin: True если пользователь администратор
+    has_prev/has_next: есть ли соседние товары (по умолчанию вычисляются из индекса)
     """
+    if has_prev is None:
+        has_prev = current_index > 0
+    if has_next is None:
+        has_next = current_index < total_count - 1
+    
     keyboard = []
     
     # Первая строка: Назад в меню
@@ -228,11 +320,11 @@ def get_item_navigation_keyboard(item_type, current_index, total_count, item_id=
         keyboard.append([
             types.InlineKeyboardButton(
                 text="✏️ Изменить товар",
-                callback_data=f"edit_item:{item_type}:{item_id}"
+                callback_data=EditItemCallback(item_type=item_type, item_id=item_id).pack()
             ),
             types.InlineKeyboardButton(
                 text="💰 Продать товар",
-                callback_data=f"sell_item:{item_type}:{item_id}"
+                callback_data=SellItemCallback(item_type=item_type, item_id=item_id).pack()
             )
         ])
     
@@ -241,20 +333,20 @@ def get_item_navigation_keyboard(item_type, current_index, total_count, item_id=
         nav_buttons = []
         
         # Кнопка "предыдущий" (показываем только если не первый)
-        if current_index > 0:
+        if has_prev:
             nav_buttons.append(
                 types.InlineKeyboardButton(
                     text="◀️ Предыдущий",
-                    callback_data=f"nav_{item_type}:{current_index - 1}"
+                    callback_data=get_nav_callback_data(item_type, current_index - 1, 'prev', item_id)
                 )
             )
         
         # Кнопка "следующий" (показываем только если не последний)
-        if current_index < total_count - 1:
+        if has_next:
             nav_buttons.append(
                 types.InlineKeyboardButton(
                     text="Следующий ▶️",
-                    callback_data=f"nav_{item_type}:{current_index + 1}"
+                    callback_data=get_nav_callback_data(item_type, current_index + 1, 'next', item_id)
                 )
             )
         
@@ -263,6 +355,7 @@ def get_item_navigation_keyboard(item_type, current_index, total_count, item_id=
     
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+@cached_keyboard()
 def get_back_to_menu_keyboard():
     """
     Создает простую клавиатуру с кнопкой возврата в меню.
@@ -278,6 +371,29 @@ def get_back_to_menu_keyboard():
         ]
     )
 
+@cached_keyboard()
+def get_sales_report_keyboard():
+    """
+    Кнопки отчета о продажах по дням/неделям/месяцам и возврата в меню
+    (под отчетом по прибыли и под самим отчетом о продажах).
+    """
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                types.InlineKeyboardButton(text="📅 По дням", callback_data=SalesReportCallback(period='day').pack()),
+                types.InlineKeyboardButton(text="📅 По неделям", callback_data=SalesReportCallback(period='week').pack()),
+                types.InlineKeyboardButton(text="📅 По месяцам", callback_data=SalesReportCallback(period='month').pack()),
+            ],
+            [
+                types.InlineKeyboardButton(
+                    text="🔙 Назад в меню",
+                    callback_data="back_to_menu"
+                )
+            ]
+        ]
+    )
+
+@cached_keyboard()
 def get_success_menu_keyboard(item_type):
     """
     Создает клавиатуру после успешного создания товара/телефона.
@@ -303,6 +419,7 @@ def get_success_menu_keyboard(item_type):
         ]
     )
 
+@cached_keyboard()
 def get_products_submenu_keyboard(is_admin=False):
     """
     Создает подменю для товаров.
@@ -341,6 +458,7 @@ def get_products_submenu_keyboard(is_admin=False):
     
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+@cached_keyboard()
 def get_phones_submenu_keyboard(is_admin=False):
     """
     Создает подменю для телефонов.
@@ -377,4 +495,21 @@ def get_phones_submenu_keyboard(is_admin=False):
         )
     ])
     
-    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def get_list_page_keyboard(callback_factory, is_first_page, next_after_id=None):
+    """
+    Кнопки страниц /products и /categories: в начало списка и следующая страница.
+    next_after_id: id последней строки страницы, если за ней есть еще строки.
+    """
+    buttons = []
+    if not is_first_page:
+        buttons.append(types.InlineKeyboardButton(
+            text="⏮ В начало", callback_data=callback_factory(after_id=0).pack()
+        ))
+    if next_after_id is not None:
+        buttons.append(types.InlineKeyboardButton(
+            text="Далее ▶️", callback_data=callback_factory(after_id=next_after_id).pack()
+        ))
+    return types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
@@ -1,8 +1,23 @@
 import os
 import asyncio
-import asyncpg
+import logging
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from handlers import register_handlers
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from handlers import register_handlers, stats_cache
+from middlewares import AdminMiddleware, ConcurrencyLimitMiddleware, DatabaseSessionMiddleware, \
+    DatabaseSessionReleaseMiddleware, DatabaseStatsMiddleware, FSMBatchMiddleware
+from admins import admins
+from migrate import migrate, pending_migrations
+from outbound import OutboundRateLimiter
+from pool import InstrumentedPool, create_pool_with_retry
+from queries import registry
+from reference_cache import reference_cache
+from storage import create_fsm_storage
+
+# Уровень логирования (DEBUG, INFO, WARNING, ERROR); WARNING отключает информационные сообщения
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 # Получаем данные для подключения из переменных окружения
 DB_HOST = os.environ.get("DB_HOST")
@@ -11,13 +26,74 @@ DB_USER = os.environ.get("DB_USER")
 DB_PASS = os.environ.get("DB_PASS")
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
-# Получаем строку с ID администраторов и преобразуем её в список целых чисел
-ADMIN_IDS_STR = os.environ.get("ADMIN_IDS")
-ADMIN_IDS = [int(x) for x in ADMIN_IDS_STR.split(',')]
+# Настройки пула подключений к БД
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+# Через сколько секунд простоя соединение закрывается (0 - никогда)
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.environ.get("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+# Таймаут выполнения одного запроса в секундах (пусто - без ограничения)
+DB_COMMAND_TIMEOUT = float(os.environ["DB_COMMAND_TIMEOUT"]) if os.environ.get("DB_COMMAND_TIMEOUT") else None
+# Повторные попытки подключения при старте: количество и начальная задержка (удваивается)
+DB_CONNECT_RETRIES = int(os.environ.get("DB_CONNECT_RETRIES", "5"))
+DB_CONNECT_RETRY_DELAY = float(os.environ.get("DB_CONNECT_RETRY_DELAY", "1"))
+# Ожидание соединения дольше этого порога (мс) считается насыщением пула
+DB_POOL_SATURATION_WAIT_MS = float(os.environ.get("DB_POOL_SATURATION_WAIT_MS", "100"))
+# Применять миграции схемы (bot/migrations) при запуске; при false их запускают вручную: python migrate.py
+DB_MIGRATE_ON_START = os.environ.get("DB_MIGRATE_ON_START", "true").lower() in ("1", "true", "yes")
+
+# Получаем строку с ID администраторов и преобразуем её в множество целых чисел
+ADMIN_IDS_STR = os.environ.get("ADMIN_IDS", "")
+ADMIN_IDS = frozenset(int(x) for x in ADMIN_IDS_STR.split(',') if x.strip())
+# Дополнительно читать администраторов из таблицы admins и период её обновления (в секундах)
+ADMINS_FROM_DB = os.environ.get("ADMINS_FROM_DB", "false").lower() in ("1", "true", "yes")
+ADMINS_REFRESH_TTL = int(os.environ.get("ADMINS_REFRESH_TTL", "60"))
+
+# Период фонового обновления кэша справочников (в секундах)
+REFERENCE_CACHE_TTL = int(os.environ.get("REFERENCE_CACHE_TTL", "300"))
+
+# Время жизни кэша статистики магазина (в секундах)
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", "5"))
+
+# Хранилище состояний FSM: memory (по умолчанию), postgres или redis
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+
+# Настройки webhook-сервера
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+# Публичный адрес (например, https://bot.example.com). Если не задан, webhook в Telegram
+# не регистрируется - удобно для локальной проверки отправкой JSON апдейтов POST-запросом
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None
+# Максимум одновременно обрабатываемых апдейтов (и соединений со стороны Telegram)
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.environ.get("WEBHOOK_MAX_CONCURRENT_UPDATES", "40"))
+
+# Лимиты исходящих сообщений: всего бота (в секунду), личного чата (в секунду), группы (в минуту),
+# сколько сообщений в чат можно отправить подряд, и число повторов после ответа 429 с retry_after
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.environ.get("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_RETRY_ATTEMPTS = int(os.environ.get("TELEGRAM_RETRY_ATTEMPTS", "3"))
 
-# Инициализация бота и диспетчера
+# Инициализация бота. Диспетчер создается после пула подключений,
+# так как хранилище FSM может использовать БД
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+# Соединение апдейта с БД возвращается в пул перед запросом к Telegram, в том числе до ожидания в очереди
+bot.session.middleware(DatabaseSessionReleaseMiddleware())
+# Все исходящие сообщения проходят через корзины токенов чата и бота
+bot.session.middleware(OutboundRateLimiter(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    group_rate=TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+    chat_burst=TELEGRAM_CHAT_BURST,
+    retry_attempts=TELEGRAM_RETRY_ATTEMPTS
+))
+dp = None
 
 # Переменная для хранения пула подключений к БД
 db_pool = None
@@ -26,27 +102,138 @@ db_pool = None
 async def create_db_pool():
     global db_pool
     try:
-        db_pool = await asyncpg.create_pool(
+        if DB_MIGRATE_ON_START:
+            # Схема обновляется до создания пула, чтобы запросы подготавливались уже на новой схеме
+            applied = await migrate(
+                DB_CONNECT_RETRIES, DB_CONNECT_RETRY_DELAY,
+                user=DB_USER, password=DB_PASS, database=DB_NAME, host=DB_HOST
+            )
+            print(f"Миграции БД применены: {', '.join(applied)}" if applied else "Схема БД актуальна.")
+        pool = await create_pool_with_retry(
+            DB_CONNECT_RETRIES,
+            DB_CONNECT_RETRY_DELAY,
             user=DB_USER,
             password=DB_PASS,
             database=DB_NAME,
             host=DB_HOST,
-            min_size=1,
-            max_size=10
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            # Горячие запросы подготавливаются на каждом новом соединении пула
+            # и остаются в кэше операторов, пока живо соединение
+            init=registry.prepare_connection,
+            max_cached_statement_lifetime=0
         )
-        print("Пул подключений к базе данных успешно создан.")
+        if not DB_MIGRATE_ON_START:
+            # Без актуальной схемы запросы бота (сводка, продажи) падали бы уже во время работы
+            async with pool.acquire() as connection:
+                pending = await pending_migrations(connection)
+            if pending:
+                raise RuntimeError(
+                    f"схема БД устарела, не применены миграции: {', '.join(pending)}. "
+                    f"Запустите python migrate.py или включите DB_MIGRATE_ON_START"
+                )
+        # Пул с метриками ожидания соединения и предупреждениями о насыщении
+        db_pool = InstrumentedPool(pool, saturation_wait_ms=DB_POOL_SATURATION_WAIT_MS)
+        print(f"Пул подключений к базе данных успешно создан ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} соединений).")
     except Exception as e:
         print(f"Ошибка при создании пула подключений: {e}")
         exit(1)
 
 
+def create_dispatcher():
+    global dp
+    storage = create_fsm_storage(FSM_STORAGE, db_pool=db_pool, redis_url=REDIS_URL)
+    # FSMContextMiddleware диспетчера регистрируется ниже вручную (disable_fsm=True),
+    # чтобы чтение состояния шло через соединение апдейта
+    if hasattr(storage, 'create_isolation'):
+        # Блокировки событий в Redis нужны при нескольких экземплярах бота
+        dp = Dispatcher(storage=storage, events_isolation=storage.create_isolation(), disable_fsm=True)
+    else:
+        dp = Dispatcher(storage=storage, disable_fsm=True)
+    # Счетчики запросов к БД за апдейт; регистрируется первым, чтобы учесть и обращения FSM к хранилищу
+    dp.update.outer_middleware(DatabaseStatsMiddleware())
+    # Соединение с БД на апдейт берется из пула только при первом запросе;
+    # через него работает и хранилище FSM postgres
+    dp.update.outer_middleware(DatabaseSessionMiddleware(db_pool))
+    dp.update.outer_middleware(dp.fsm)
+    # Данные FSM читаются и записываются в хранилище один раз за апдейт
+    dp.update.outer_middleware(FSMBatchMiddleware())
+    # Признак администратора вычисляется один раз за апдейт
+    dp.update.outer_middleware(AdminMiddleware())
+    print(f"Хранилище FSM: {FSM_STORAGE}")
+
+
+async def run_polling():
+    # Если ранее был установлен webhook, Telegram не отдаст апдейты через getUpdates
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
+
+async def run_webhook():
+    """
+    Запускает aiohttp-сервер, принимающий апдейты от Telegram.
+    Локальная проверка: curl -X POST -H 'Content-Type: application/json'
+    -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' -d @update.json http://localhost:8080/webhook
+    """
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(WEBHOOK_MAX_CONCURRENT_UPDATES))
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONCURRENT_UPDATES,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        print(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    print(f"Webhook-сервер запущен на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main():
     await create_db_pool()
 
-    # Регистрируем все обработчики, передавая db_pool
-    register_handlers(dp, ADMIN_IDS, db_pool)
+    # Загружаем справочники в память и запускаем их периодическое обновление
+    reference_cache.ttl = REFERENCE_CACHE_TTL
+    await reference_cache.load(db_pool)
+    refresh_task = asyncio.create_task(reference_cache.refresh_periodically(db_pool))
 
-    await dp.start_polling(bot)
+    stats_cache.ttl = STATS_CACHE_TTL
+
+    admins.configure(ADMIN_IDS, ADMINS_REFRESH_TTL)
+    admins_task = None
+    if ADMINS_FROM_DB:
+        await admins.load(db_pool)
+        admins_task = asyncio.create_task(admins.refresh_periodically(db_pool))
+
+    create_dispatcher()
+
+    # Регистрируем все обработчики
+    register_handlers(dp)
+
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        refresh_task.cancel()
+        if admins_task:
+            admins_task.cancel()
 
 
 if __name__ == '__main__':
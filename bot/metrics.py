@@ -0,0 +1,63 @@
+import time
+from collections import defaultdict, deque
+
+
+class Metrics:
+    """
+    Простые метрики процесса: счетчики, текущие значения и распределения
+    (по последним наблюдениям) для расчета перцентилей.
+    """
+
+    def __init__(self, window=1000):
+        self.started_at = time.time()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = defaultdict(lambda: deque(maxlen=window))
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        self.histograms[name].append(value)
+
+    def summary(self, name):
+        """Возвращает count/p50/p95/p99/max по последним наблюдениям метрики"""
+        values = sorted(self.histograms.get(name, ()))
+        if not values:
+            return None
+        return {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+        }
+
+    def format_text(self):
+        """Текстовое представление всех метрик для команды /metrics"""
+        lines = [f"Аптайм: {time.time() - self.started_at:.0f} с"]
+        for name in sorted(self.counters):
+            lines.append(f"{name}: {self.counters[name]}")
+        for name in sorted(self.gauges):
+            lines.append(f"{name}: {self.gauges[name]}")
+        for name in sorted(self.histograms):
+            stats = self.summary(name)
+            if stats:
+                lines.append(
+                    f"{name}: n={stats['count']} p50={stats['p50']:.3g} p95={stats['p95']:.3g} "
+                    f"p99={stats['p99']:.3g} max={stats['max']:.3g}"
+                )
+        return "\n".join(lines)
+
+
+def percentile(sorted_values, percent):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+# Единственный экземпляр метрик на процесс
+metrics = Metrics()
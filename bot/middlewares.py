@@ -0,0 +1,160 @@
+import asyncio
+import copy
+from collections import Counter
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.context import FSMContext
+from admins import admins
+from metrics import metrics
+from pool import DatabaseSession, current_db_session, update_db_stats
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Ограничивает количество одновременно обрабатываемых апдейтов.
+    Используется в режиме webhook, где каждый входящий апдейт обрабатывается в отдельной задаче.
+    """
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self.semaphore:
+            return await handler(event, data)
+
+
+class BatchedFSMContext(FSMContext):
+    """
+    FSMContext, который загружает данные из хранилища один раз за апдейт,
+    изменяет их локально и записывает обратно одним вызовом в flush().
+    Состояние (set_state/get_state) по-прежнему читается и пишется сразу.
+    """
+
+    def __init__(self, storage, key):
+        super().__init__(storage, key)
+        self._data = None
+        self._dirty = False
+        self.storage_calls = 0
+
+    async def _load(self):
+        if self._data is None:
+            self.storage_calls += 1
+            self._data = await self.storage.get_data(key=self.key)
+        return self._data
+
+    async def get_data(self):
+        # Копия, чтобы изменения вложенных списков не попадали в хранилище без update_data
+        return copy.deepcopy(await self._load())
+
+    async def get_value(self, key, default=None):
+        return copy.deepcopy((await self._load()).get(key, default))
+
+    async def set_data(self, data):
+        self._data = copy.deepcopy(dict(data))
+        self._dirty = True
+
+    async def update_data(self, data=None, **kwargs):
+        if data:
+            kwargs.update(data)
+        current = await self._load()
+        current.update(copy.deepcopy(kwargs))
+        self._dirty = True
+        return copy.deepcopy(current)
+
+    async def set_state(self, state=None):
+        self.storage_calls += 1
+        await super().set_state(state)
+
+    async def get_state(self):
+        self.storage_calls += 1
+        return await super().get_state()
+
+    async def flush(self):
+        """Записывает накопленные изменения данных в хранилище"""
+        if self._dirty:
+            self.storage_calls += 1
+            await self.storage.set_data(key=self.key, data=self._data)
+            self._dirty = False
+
+
+class FSMBatchMiddleware(BaseMiddleware):
+    """
+    Подменяет FSMContext апдейта на BatchedFSMContext и сбрасывает данные в хранилище
+    один раз после обработчика. Регистрируется после FSMContextMiddleware диспетчера.
+    """
+
+    async def __call__(self, handler, event, data):
+        state = data.get('state')
+        if state is None:
+            return await handler(event, data)
+
+        context = BatchedFSMContext(state.storage, state.key)
+        data['state'] = context
+        try:
+            return await handler(event, data)
+        finally:
+            await context.flush()
+            # +1 - чтение raw_state в FSMContextMiddleware
+            storage_calls = context.storage_calls + 1
+            metrics.increment('fsm.storage_calls', storage_calls)
+            metrics.observe('fsm.storage_calls_per_update', storage_calls)
+
+
+class DatabaseStatsMiddleware(BaseMiddleware):
+    """
+    Считает запросы к БД и захваты соединений из пула за время обработки апдейта
+    (db.queries_per_update, db.acquires_per_update).
+    """
+
+    async def __call__(self, handler, event, data):
+        stats = Counter()
+        token = update_db_stats.set(stats)
+        try:
+            return await handler(event, data)
+        finally:
+            update_db_stats.reset(token)
+            metrics.observe('db.queries_per_update', stats['queries'])
+            metrics.observe('db.acquires_per_update', stats['acquires'])
+
+
+class DatabaseSessionMiddleware(BaseMiddleware):
+    """
+    Передает обработчикам в параметре db_pool соединение апдейта (DatabaseSession):
+    оно берется из пула лениво и освобождается после обработчика или перед запросом к Telegram.
+    """
+
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+    async def __call__(self, handler, event, data):
+        session = DatabaseSession(self.db_pool)
+        data['db_pool'] = session
+        token = current_db_session.set(session)
+        try:
+            return await handler(event, data)
+        finally:
+            current_db_session.reset(token)
+            await session.release()
+
+
+class DatabaseSessionReleaseMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии Bot: перед запросом к Telegram возвращает в пул соединение
+    текущего апдейта, если оно не используется, чтобы сеть и очередь отправки
+    (OutboundRateLimiter) не держали соединение. Следующий запрос к БД возьмет его снова.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        session = current_db_session.get()
+        if session is not None:
+            await session.release_idle()
+        return await make_request(bot, method)
+
+
+class AdminMiddleware(BaseMiddleware):
+    """Один раз за апдейт определяет, является ли пользователь администратором (параметр is_admin)"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        data['is_admin'] = user is not None and admins.is_admin(user.id)
+        return await handler(event, data)
@@ -0,0 +1,174 @@
+# Версионные миграции схемы БД из каталога migrations/ (файлы NNNN_описание.sql).
+# Примененные версии хранятся в таблице schema_migrations; при запуске бота (main.py)
+# применяются недостающие по возрастанию версии. Рекомендательная блокировка не дает
+# нескольким экземплярам бота применять миграции одновременно.
+#
+# Обычный файл выполняется целиком в одной транзакции вместе с записью версии.
+# Файл, начинающийся со строки "-- migrate: no-transaction", выполняется по одной команде
+# вне транзакции - так можно строить индексы CREATE INDEX CONCURRENTLY. Команды в нем
+# разделяются ';' в конце строки; внутри $$-блоков (DO, функции) файл не делится.
+# Если построение индекса CONCURRENTLY падает, оставшийся невалидный индекс удаляется.
+#
+# Ручной запуск: python migrate.py (подключение по DB_HOST, DB_NAME, DB_USER, DB_PASS)
+import asyncio
+import logging
+import os
+import re
+import asyncpg
+from pool import connect_with_retry
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+CONCURRENT_INDEX_RE = re.compile(
+    r'^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE
+)
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+# Ключ рекомендательной блокировки, общий для всех экземпляров бота
+MIGRATIONS_LOCK_KEY = 7_301_845_219
+MIGRATIONS_LOCK_POLL_INTERVAL = 1
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+RECORD_MIGRATION = "INSERT INTO schema_migrations (version, name) VALUES ($1, $2);"
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Список (версия, имя файла, текст) по возрастанию версии"""
+    migrations = {}
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Повторяющаяся версия миграции {version}: {filename} и {migrations[version][0]}")
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            migrations[version] = (filename, f.read())
+    return [(version, *migrations[version]) for version in sorted(migrations)]
+
+
+def split_statements(sql):
+    """
+    Делит текст миграции на команды по ';' в конце строки вне $$-блоков;
+    комментарии между командами пропускаются
+    """
+    statements, current = [], []
+    in_dollar_quote = False
+    for line in sql.splitlines():
+        if not current and (not line.strip() or line.lstrip().startswith('--')):
+            continue
+        current.append(line)
+        if line.count('$$') % 2:
+            in_dollar_quote = not in_dollar_quote
+        if not in_dollar_quote and line.rstrip().endswith(';'):
+            statements.append('\n'.join(current))
+            current = []
+    if current:
+        statements.append('\n'.join(current))
+    return statements
+
+
+async def apply_migration(connection, version, filename, sql):
+    if sql.startswith(NO_TRANSACTION_MARKER):
+        # Команда, упавшая на середине, не откатывает предыдущие: такие файлы должны
+        # выдерживать повторный запуск (IF EXISTS / IF NOT EXISTS)
+        for statement in split_statements(sql):
+            try:
+                await connection.execute(statement)
+            except asyncpg.PostgresError:
+                await drop_invalid_index(connection, statement)
+                raise
+        await connection.execute(RECORD_MIGRATION, version, filename)
+    else:
+        async with connection.transaction():
+            await connection.execute(sql)
+            await connection.execute(RECORD_MIGRATION, version, filename)
+
+
+async def drop_invalid_index(connection, statement):
+    """
+    После ошибки CREATE INDEX CONCURRENTLY индекс остается в базе невалидным: он не используется
+    запросами, но замедляет запись (а уникальный еще и проверяется). Такой индекс удаляется.
+    """
+    match = CONCURRENT_INDEX_RE.match(statement)
+    if not match:
+        return
+    logger.warning("Индекс %s не построен, невалидный индекс удаляется", match.group(1))
+    await connection.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{match.group(1)}";')
+
+
+async def acquire_migrations_lock(connection):
+    """
+    Ждет блокировку опросом pg_try_advisory_lock, а не ожиданием в pg_advisory_lock:
+    ожидающий запрос держит транзакцию, которой дожидается CREATE INDEX CONCURRENTLY
+    другого экземпляра, и PostgreSQL прерывает обоих как взаимоблокировку.
+    """
+    logged = False
+    while not await connection.fetchval("SELECT pg_try_advisory_lock($1);", MIGRATIONS_LOCK_KEY):
+        if not logged:
+            logger.info("Миграции применяет другой экземпляр бота, ожидание")
+            logged = True
+        await asyncio.sleep(MIGRATIONS_LOCK_POLL_INTERVAL)
+
+
+async def apply_migrations(connection, directory=MIGRATIONS_DIR):
+    """
+    Применяет недостающие миграции на соединении connection.
+    Возвращает имена файлов примененных миграций.
+    """
+    migrations = load_migrations(directory)
+    applied = []
+    await acquire_migrations_lock(connection)
+    try:
+        await connection.execute(CREATE_MIGRATIONS_TABLE)
+        # Читается после получения блокировки: другой экземпляр мог только что применить миграции
+        done = {row['version'] for row in await connection.fetch("SELECT version FROM schema_migrations;")}
+        for version, filename, sql in migrations:
+            if version in done:
+                continue
+            logger.info("Применяется миграция %s", filename)
+            await apply_migration(connection, version, filename, sql)
+            applied.append(filename)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1);", MIGRATIONS_LOCK_KEY)
+    return applied
+
+
+async def pending_migrations(connection, directory=MIGRATIONS_DIR):
+    """Имена файлов миграций, еще не примененных к базе (для запуска с DB_MIGRATE_ON_START=false)"""
+    done = set()
+    if await connection.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL;"):
+        done = {row['version'] for row in await connection.fetch("SELECT version FROM schema_migrations;")}
+    return [filename for version, filename, _ in load_migrations(directory) if version not in done]
+
+
+async def migrate(retries=1, retry_delay=1, **connect_kwargs):
+    """
+    Применяет миграции на отдельном соединении без command_timeout пула:
+    построение индексов на больших таблицах может идти дольше обычного запроса.
+    """
+    connection = await connect_with_retry(lambda: asyncpg.connect(**connect_kwargs), retries, retry_delay)
+    try:
+        return await apply_migrations(connection)
+    finally:
+        await connection.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    applied = asyncio.run(migrate(
+        user=os.environ.get("DB_USER"),
+        password=os.environ.get("DB_PASS"),
+        database=os.environ.get("DB_NAME"),
+        host=os.environ.get("DB_HOST"),
+    ))
+    print(f"Применено миграций: {len(applied)}")
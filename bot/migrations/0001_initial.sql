@@ -1,3 +1,6 @@
+-- Базовая схема (бывший init.sql). Все команды идемпотентны, поэтому на базах,
+-- созданных из init.sql, миграция проходит без изменений и только отмечается примененной
+
 -- Создание таблиц категорий и условий (уже существующие)
 CREATE TABLE IF NOT EXISTS categories (
     id SERIAL PRIMARY KEY,
@@ -102,6 +105,93 @@ CREATE TABLE IF NOT EXISTS transactions (
     description TEXT
 );
 
+-- Сводные показатели для отчета по прибыли.
+-- Единственная строка (id = 1) обновляется ботом в тех же транзакциях,
+-- что и добавление/продажа товаров, поэтому отчет читается одним запросом по ключу
+CREATE TABLE IF NOT EXISTS shop_summary (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    products_sold_count INTEGER NOT NULL DEFAULT 0,
+    products_profit NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    products_investment NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    products_revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    phones_sold_count INTEGER NOT NULL DEFAULT 0,
+    phones_profit NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    phones_investment NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    phones_revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    stock_investment NUMERIC(14, 2) NOT NULL DEFAULT 0, -- закупочная стоимость непроданных товаров
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- На существующей базе строка сразу заполняется по текущим товарам и телефонам
+-- (тот же расчет, что и summary.SUMMARY_REBUILD_QUERY), а не нулями
+INSERT INTO shop_summary (id, products_sold_count, products_profit, products_investment, products_revenue,
+                          phones_sold_count, phones_profit, phones_investment, phones_revenue, stock_investment)
+SELECT 1,
+       pr.count, pr.profit, pr.investment, pr.revenue,
+       ph.count, ph.profit, ph.investment, ph.revenue,
+       (SELECT COALESCE(SUM(purchase_price * quantity), 0) FROM products WHERE is_sold = FALSE) +
+       (SELECT COALESCE(SUM(purchase_price), 0) FROM phones WHERE is_sold = FALSE)
+FROM (
+    SELECT COUNT(*) AS count,
+           COALESCE(SUM((sale_price - purchase_price) * quantity), 0) AS profit,
+           COALESCE(SUM(purchase_price * quantity), 0) AS investment,
+           COALESCE(SUM(sale_price * quantity), 0) AS revenue
+    FROM products
+    WHERE is_sold = TRUE AND sale_price IS NOT NULL
+) AS pr, (
+    SELECT COUNT(*) AS count,
+           COALESCE(SUM(sale_price - purchase_price), 0) AS profit,
+           COALESCE(SUM(purchase_price), 0) AS investment,
+           COALESCE(SUM(sale_price), 0) AS revenue
+    FROM phones
+    WHERE is_sold = TRUE AND sale_price IS NOT NULL
+) AS ph
+ON CONFLICT (id) DO NOTHING;
+
+-- Хранилище состояний FSM (используется при FSM_STORAGE=postgres)
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key VARCHAR(255) PRIMARY KEY,
+    state VARCHAR(255),
+    data JSONB,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дополнительные администраторы (используется при ADMINS_FROM_DB=true, вместе с ADMIN_IDS)
+CREATE TABLE IF NOT EXISTS admins (
+    user_id BIGINT PRIMARY KEY,
+    note VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Поиск телефонов и товаров (/find и inline-режим) по триграммным GIN-индексам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Текст для поиска по телефону: бренд, модель, цвет, память, название, IMEI и серийный номер
+-- в нижнем регистре. Заполняется триггером при добавлении телефона и изменении этих полей
+ALTER TABLE phones ADD COLUMN IF NOT EXISTS search_text TEXT;
+
+CREATE OR REPLACE FUNCTION phones_search_text_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_text := lower(concat_ws(' ',
+        (SELECT b.name || ' ' || m.name FROM models m JOIN brands b ON m.brand_id = b.id WHERE m.id = NEW.model_id),
+        (SELECT name FROM colors WHERE id = NEW.color_id),
+        (SELECT capacity_gb || ' гб' FROM storage_capacities WHERE id = NEW.storage_capacity_id),
+        NEW.name,
+        NEW.imei,
+        NEW.serial_number
+    ));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS phones_search_text_trigger ON phones;
+CREATE TRIGGER phones_search_text_trigger
+    BEFORE INSERT OR UPDATE OF name, model_id, color_id, storage_capacity_id, imei, serial_number ON phones
+    FOR EACH ROW EXECUTE FUNCTION phones_search_text_update();
+
+-- Заполнение для телефонов, добавленных до появления триггера
+UPDATE phones SET name = name WHERE search_text IS NULL;
+
 -- Вставка базовых данных
 
 -- Категории
@@ -199,7 +289,6 @@ CREATE INDEX IF NOT EXISTS idx_phones_color_id ON phones(color_id);
 CREATE INDEX IF NOT EXISTS idx_phones_storage_id ON phones(storage_capacity_id);
 CREATE INDEX IF NOT EXISTS idx_phones_market_id ON phones(market_id);
 CREATE INDEX IF NOT EXISTS idx_phones_condition_id ON phones(condition_id);
-CREATE INDEX IF NOT EXISTS idx_phones_is_sold ON phones(is_sold);
 CREATE INDEX IF NOT EXISTS idx_models_brand_id ON models(brand_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_phone_id ON transactions(phone_id);
-CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions(timestamp);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions(timestamp);
@@ -0,0 +1,61 @@
+-- migrate: no-transaction
+-- Индексы под запросы бота, строятся без блокировки записи (CONCURRENTLY).
+-- Перед каждым CREATE удаляется индекс, оставшийся невалидным после прерванной попытки:
+-- миграция отмечается примененной только после успеха всех команд и при повторе строит их заново.
+
+-- Поиск телефонов и товаров (/find и inline-режим)
+DROP INDEX CONCURRENTLY IF EXISTS phones_search_text_trgm_idx;
+CREATE INDEX CONCURRENTLY phones_search_text_trgm_idx ON phones USING gin (search_text gin_trgm_ops);
+DROP INDEX CONCURRENTLY IF EXISTS products_name_trgm_idx;
+CREATE INDEX CONCURRENTLY products_name_trgm_idx ON products USING gin (lower(name) gin_trgm_ops);
+
+-- Уникальность IMEI и серийного номера. Индексы используются проверкой дублей
+-- при приеме телефона и командой /imei.
+-- До их появления повторы не проверялись: если они есть, миграция останавливается
+-- со списком повторов (первые 20), их нужно исправить вручную и перезапустить бота
+DO $$
+DECLARE
+    duplicates TEXT;
+BEGIN
+    SELECT string_agg(format('%s %s (id телефонов: %s)', kind, value, ids), '; ')
+    INTO duplicates
+    FROM (
+        SELECT 'IMEI' AS kind, imei AS value, string_agg(id::text, ', ' ORDER BY id) AS ids
+        FROM phones
+        WHERE imei IS NOT NULL
+        GROUP BY imei
+        HAVING COUNT(*) > 1
+        UNION ALL
+        SELECT 'серийный номер', serial_number, string_agg(id::text, ', ' ORDER BY id)
+        FROM phones
+        WHERE serial_number IS NOT NULL
+        GROUP BY serial_number
+        HAVING COUNT(*) > 1
+        LIMIT 20
+    ) d;
+    IF duplicates IS NOT NULL THEN
+        RAISE EXCEPTION 'В phones есть повторяющиеся IMEI или серийные номера: %', duplicates
+            USING HINT = 'Исправьте или удалите повторы, затем перезапустите бота (или python migrate.py)';
+    END IF;
+END
+$$;
+DROP INDEX CONCURRENTLY IF EXISTS phones_imei_key;
+CREATE UNIQUE INDEX CONCURRENTLY phones_imei_key ON phones (imei) WHERE imei IS NOT NULL;
+DROP INDEX CONCURRENTLY IF EXISTS phones_serial_number_key;
+CREATE UNIQUE INDEX CONCURRENTLY phones_serial_number_key ON phones (serial_number) WHERE serial_number IS NOT NULL;
+
+-- Постраничный просмотр непроданных (WHERE NOT is_sold [AND id < $1] ORDER BY id DESC LIMIT 2)
+-- и COUNT непроданных. Индекс по самому is_sold планировщик почти не использует.
+-- Проданные позиции - большая часть таблиц, для них достаточно обратного просмотра по первичному ключу.
+-- Проверка планов: benchmarks/index_plans.py
+DROP INDEX CONCURRENTLY IF EXISTS idx_phones_is_sold;
+DROP INDEX CONCURRENTLY IF EXISTS idx_phones_available_id;
+CREATE INDEX CONCURRENTLY idx_phones_available_id ON phones (id DESC) WHERE NOT is_sold;
+DROP INDEX CONCURRENTLY IF EXISTS idx_products_available_id;
+CREATE INDEX CONCURRENTLY idx_products_available_id ON products (id DESC) WHERE NOT is_sold;
+
+-- Внешние ключи без индексов: удаление категории/товара и выборки по ним
+DROP INDEX CONCURRENTLY IF EXISTS idx_products_category_id;
+CREATE INDEX CONCURRENTLY idx_products_category_id ON products (category_id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_transactions_product_id;
+CREATE INDEX CONCURRENTLY idx_transactions_product_id ON transactions (product_id);
@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Постраничный вывод /products по ключу (name, id): страница читается по индексу
+-- с нужного места, без сортировки всей таблицы
+DROP INDEX CONCURRENTLY IF EXISTS idx_products_name_id;
+CREATE INDEX CONCURRENTLY idx_products_name_id ON products (name, id);
@@ -0,0 +1,30 @@
+-- Продажи по дням для отчета по периодам (/sales).
+-- Строка дня обновляется запросами продажи (handlers.process_sale) в той же транзакции,
+-- поэтому отчет за год читает не больше 366 строк вместо всей истории транзакций.
+-- Выручка и себестоимость считаются так же, как в shop_summary.
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day DATE PRIMARY KEY,
+    phones_sold_count INTEGER NOT NULL DEFAULT 0,
+    phones_revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    phones_cost NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    products_sold_count INTEGER NOT NULL DEFAULT 0,
+    products_revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    products_cost NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+-- Заполнение по уже записанным продажам
+INSERT INTO daily_sales (day, phones_sold_count, phones_revenue, phones_cost,
+                         products_sold_count, products_revenue, products_cost)
+SELECT t.timestamp::date,
+       COUNT(ph.id),
+       COALESCE(SUM(t.amount) FILTER (WHERE ph.id IS NOT NULL), 0),
+       COALESCE(SUM(ph.purchase_price), 0),
+       COUNT(pr.id),
+       COALESCE(SUM(t.amount * pr.quantity), 0),
+       COALESCE(SUM(pr.purchase_price * pr.quantity), 0)
+FROM transactions t
+LEFT JOIN phones ph ON ph.id = t.phone_id
+LEFT JOIN products pr ON pr.id = t.product_id
+WHERE t.type = 'sale' AND (ph.id IS NOT NULL OR pr.id IS NOT NULL)
+GROUP BY 1
+ON CONFLICT (day) DO NOTHING;
@@ -0,0 +1,73 @@
+-- Поисковый текст телефона (phones.search_text) включает названия бренда, модели, цвета и объем памяти.
+-- Триггер из 0001_initial.sql пересчитывает его только при изменении строки phones, поэтому после
+-- переименования бренда, модели или цвета поиск (/find, inline) не находил бы телефоны по новому названию.
+-- Здесь текст пересчитывается и при изменении справочников - только для телефонов, которые на них ссылаются.
+
+-- Единое выражение поискового текста для триггера phones и пересчета
+CREATE OR REPLACE FUNCTION phones_search_text(
+    phone_name TEXT, phone_model_id INTEGER, phone_color_id INTEGER, phone_storage_id INTEGER,
+    phone_imei TEXT, phone_serial_number TEXT
+) RETURNS TEXT AS $$
+    SELECT lower(concat_ws(' ',
+        (SELECT b.name || ' ' || m.name FROM models m JOIN brands b ON m.brand_id = b.id WHERE m.id = phone_model_id),
+        (SELECT name FROM colors WHERE id = phone_color_id),
+        (SELECT capacity_gb || ' гб' FROM storage_capacities WHERE id = phone_storage_id),
+        phone_name,
+        phone_imei,
+        phone_serial_number
+    ));
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION phones_search_text_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_text := phones_search_text(
+        NEW.name, NEW.model_id, NEW.color_id, NEW.storage_capacity_id, NEW.imei, NEW.serial_number
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пересчет для телефонов, ссылающихся на измененную строку справочника
+CREATE OR REPLACE FUNCTION phones_search_text_refresh() RETURNS trigger AS $$
+BEGIN
+    UPDATE phones p
+    SET search_text = phones_search_text(p.name, p.model_id, p.color_id, p.storage_capacity_id, p.imei, p.serial_number)
+    WHERE CASE TG_TABLE_NAME
+        WHEN 'brands' THEN p.model_id IN (SELECT id FROM models WHERE brand_id = NEW.id)
+        WHEN 'models' THEN p.model_id = NEW.id
+        WHEN 'colors' THEN p.color_id = NEW.id
+        WHEN 'storage_capacities' THEN p.storage_capacity_id = NEW.id
+    END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS brands_phones_search_text_trigger ON brands;
+CREATE TRIGGER brands_phones_search_text_trigger
+    AFTER UPDATE OF name ON brands
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION phones_search_text_refresh();
+
+DROP TRIGGER IF EXISTS models_phones_search_text_trigger ON models;
+CREATE TRIGGER models_phones_search_text_trigger
+    AFTER UPDATE OF name, brand_id ON models
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.brand_id IS DISTINCT FROM NEW.brand_id)
+    EXECUTE FUNCTION phones_search_text_refresh();
+
+DROP TRIGGER IF EXISTS colors_phones_search_text_trigger ON colors;
+CREATE TRIGGER colors_phones_search_text_trigger
+    AFTER UPDATE OF name ON colors
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION phones_search_text_refresh();
+
+DROP TRIGGER IF EXISTS storage_capacities_phones_search_text_trigger ON storage_capacities;
+CREATE TRIGGER storage_capacities_phones_search_text_trigger
+    AFTER UPDATE OF capacity_gb ON storage_capacities
+    FOR EACH ROW WHEN (OLD.capacity_gb IS DISTINCT FROM NEW.capacity_gb)
+    EXECUTE FUNCTION phones_search_text_refresh();
+
+-- Текст, устаревший из-за переименований до этой миграции
+UPDATE phones p
+SET search_text = phones_search_text(p.name, p.model_id, p.color_id, p.storage_capacity_id, p.imei, p.serial_number)
+WHERE p.search_text IS DISTINCT FROM
+      phones_search_text(p.name, p.model_id, p.color_id, p.storage_capacity_id, p.imei, p.serial_number);
@@ -0,0 +1,172 @@
+# Ограничение частоты исходящих запросов к Telegram (middleware сессии Bot, подключается в main.py).
+# Лимиты Bot API: около 30 сообщений в секунду на бота, 1 в секунду в личном чате, 20 в минуту в группе.
+import asyncio
+import logging
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничиваются отправка и редактирование сообщений в чатах; остальные методы
+# (getUpdates, answerCallbackQuery, deleteMessages и т.д.) выполняются без очереди
+THROTTLED_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+# Правки одного сообщения, ожидающие очереди, объединяются: отправляется только последняя
+COALESCED_EDITS = ('EditMessageText', 'EditMessageReplyMarkup', 'EditMessageCaption')
+# При большем числе корзин чатов простаивающие (полные) удаляются
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity подряд.
+    Ожидающие обслуживаются по очереди; block() приостанавливает выдачу (ответ 429 с retry_after).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self.lock.locked()
+
+
+class PendingEdit:
+    """Правка сообщения в очереди; waiters - вызовы, объединенные с ней"""
+
+    def __init__(self, method):
+        self.method = method
+        self.waiters = []
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии Bot: все исходящие сообщения проходят через корзины токенов
+    чата и общую корзину бота, поэтому параллельная работа нескольких администраторов
+    и массовые операции не упираются в 429 Too Many Requests.
+
+    Если правка сообщения еще ждет очереди, а для него пришла новая правка того же вида,
+    отправляется только последняя; все вызовы получают её результат.
+    На ответ 429 корзина чата приостанавливается на retry_after, и запрос повторяется.
+
+    Метрики: telegram.queue_depth (ждут токенов), telegram.wait_ms (ожидание в очереди),
+    telegram.send_ms (ожидание и отправка), telegram.edits_coalesced, telegram.retry_after.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, group_rate=20 / 60, chat_burst=3, retry_attempts=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.retry_attempts = retry_attempts
+        self.chat_buckets = {}
+        # (вид правки, chat_id, message_id) -> PendingEdit
+        self.pending_edits = {}
+        self.queue_depth = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_idle()}
+            # Отрицательный chat_id - группа или канал: у них свой, более строгий лимит
+            rate = self.group_rate if isinstance(chat_id, str) or chat_id < 0 else self.chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, bucket):
+        self.queue_depth += 1
+        metrics.set_gauge('telegram.queue_depth', self.queue_depth)
+        try:
+            # Сначала корзина чата: занятый чат не удерживает общие токены, пока ждет свои
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+        finally:
+            self.queue_depth -= 1
+            metrics.set_gauge('telegram.queue_depth', self.queue_depth)
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or not name.startswith(THROTTLED_PREFIXES) or isinstance(method, SendChatAction):
+            return await make_request(bot, method)
+
+        key = (name, chat_id, method.message_id) if name in COALESCED_EDITS else None
+        pending = self.pending_edits.get(key) if key else None
+        if pending is not None:
+            pending.method = method
+            waiter = asyncio.get_running_loop().create_future()
+            pending.waiters.append(waiter)
+            metrics.increment('telegram.edits_coalesced')
+            return await waiter
+
+        pending = PendingEdit(method)
+        if key:
+            self.pending_edits[key] = pending
+        try:
+            result = await self._send(make_request, bot, chat_id, pending, key)
+        except BaseException as e:
+            for waiter in pending.waiters:
+                if waiter.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    waiter.cancel()
+                else:
+                    waiter.set_exception(e)
+            raise
+        finally:
+            if key and self.pending_edits.get(key) is pending:
+                del self.pending_edits[key]
+        for waiter in pending.waiters:
+            if not waiter.done():
+                waiter.set_result(result)
+        return result
+
+    async def _send(self, make_request, bot, chat_id, pending, key):
+        started = time.perf_counter()
+        bucket = self._chat_bucket(chat_id)
+        await self._acquire(bucket)
+        metrics.observe('telegram.wait_ms', (time.perf_counter() - started) * 1000)
+        # После начала отправки новые правки уже не объединяются с этой
+        if key:
+            del self.pending_edits[key]
+        try:
+            for attempt in range(self.retry_attempts + 1):
+                try:
+                    return await make_request(bot, pending.method)
+                except TelegramRetryAfter as e:
+                    if attempt == self.retry_attempts:
+                        raise
+                    metrics.increment('telegram.retry_after')
+                    logger.warning("Telegram: превышен лимит в чате %s, повтор через %s с", chat_id, e.retry_after)
+                    bucket.block(e.retry_after)
+                    await self._acquire(bucket)
+        finally:
+            metrics.observe('telegram.send_ms', (time.perf_counter() - started) * 1000)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+import asyncpg
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Счетчики обращений к БД в рамках текущего апдейта (заполняет DatabaseStatsMiddleware)
+update_db_stats = ContextVar('update_db_stats', default=None)
+
+
+def count_update_stat(name):
+    """Увеличивает счетчик обращений к БД текущего апдейта, если он отслеживается"""
+    stats = update_db_stats.get()
+    if stats is not None:
+        stats[name] += 1
+
+
+class InstrumentedPool:
+    """
+    Обертка над пулом asyncpg, измеряющая ожидание соединения (db.pool.acquire_wait_ms),
+    число занятых соединений (db.pool.in_use) и предупреждающая о насыщении пула.
+    Остальные атрибуты и методы (fetch, close, get_size...) передаются пулу как есть.
+    """
+
+    def __init__(self, pool, saturation_wait_ms=100, warn_interval=60):
+        self.pool = pool
+        self.saturation_wait_ms = saturation_wait_ms
+        self.warn_interval = warn_interval
+        self.in_use = 0
+        self._last_warning = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.perf_counter()
+        async with self.pool.acquire() as connection:
+            wait_ms = (time.perf_counter() - started) * 1000
+            self.in_use += 1
+            count_update_stat('acquires')
+            metrics.observe('db.pool.acquire_wait_ms', wait_ms)
+            metrics.set_gauge('db.pool.in_use', self.in_use)
+            metrics.set_gauge('db.pool.size', self.pool.get_size())
+            self._check_saturation(wait_ms)
+            try:
+                yield connection
+            finally:
+                self.in_use -= 1
+                metrics.set_gauge('db.pool.in_use', self.in_use)
+
+    def _check_saturation(self, wait_ms):
+        if self.in_use < self.pool.get_max_size() and wait_ms < self.saturation_wait_ms:
+            return
+        metrics.increment('db.pool.saturated')
+        now = time.monotonic()
+        if now - self._last_warning >= self.warn_interval:
+            self._last_warning = now
+            logger.warning(
+                "Пул БД насыщен: занято %s из %s соединений, ожидание %.1f мс",
+                self.in_use, self.pool.get_max_size(), wait_ms
+            )
+
+
+class DatabaseSession:
+    """
+    Соединение одного апдейта: берется из пула при первом обращении и возвращается
+    в пул после обработчика (DatabaseSessionMiddleware). Повторяет интерфейс пула,
+    поэтому обработчики по-прежнему пишут async with db_pool.acquire() as connection,
+    и идущие подряд такие блоки используют одно соединение.
+    Перед запросом к Telegram соединение, не занятое ни одним блоком, возвращается в пул
+    (DatabaseSessionReleaseMiddleware): ожидание сети и очереди отправки не держит соединение.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self._stack = AsyncExitStack()
+        self._lock = asyncio.Lock()
+        # Число открытых блоков acquire(), использующих соединение
+        self._users = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._lock:
+            if self.connection is None:
+                self.connection = await self._stack.enter_async_context(self.pool.acquire())
+            self._users += 1
+        try:
+            yield self.connection
+        finally:
+            self._users -= 1
+
+    async def fetch(self, *args, **kwargs):
+        async with self.acquire() as connection:
+            return await connection.fetch(*args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        async with self.acquire() as connection:
+            return await connection.fetchrow(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        async with self.acquire() as connection:
+            return await connection.fetchval(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        async with self.acquire() as connection:
+            return await connection.execute(*args, **kwargs)
+
+    async def release_idle(self):
+        """Возвращает соединение в пул, если ни один блок acquire() его сейчас не использует"""
+        if self._users == 0:
+            await self.release()
+
+    async def release(self):
+        """Возвращает соединение в пул, если оно было взято"""
+        if self.connection is None:
+            return
+        stack, self._stack = self._stack, AsyncExitStack()
+        self.connection = None
+        await stack.aclose()
+
+
+# Сессия БД апдейта, который обрабатывается в текущей задаче (устанавливает DatabaseSessionMiddleware)
+current_db_session = ContextVar('current_db_session', default=None)
+
+
+async def connect_with_retry(connect, retries, retry_delay, max_retry_delay=30):
+    """
+    Вызывает connect() (создание пула или соединения), повторяя попытки с экспоненциальной задержкой
+    (например, пока контейнер БД еще запускается). После последней неудачи пробрасывает ошибку.
+    """
+    delay = retry_delay
+    for attempt in range(1, retries + 1):
+        try:
+            return await connect()
+        except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            logger.warning(
+                "Не удалось подключиться к БД (попытка %s из %s): %s. Повтор через %.1f с",
+                attempt, retries, e, delay
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_retry_delay)
+
+
+async def create_pool_with_retry(retries, retry_delay, max_retry_delay=30, **pool_kwargs):
+    """Создает пул asyncpg с повторными попытками подключения"""
+    return await connect_with_retry(
+        lambda: asyncpg.create_pool(**pool_kwargs), retries, retry_delay, max_retry_delay
+    )
@@ -0,0 +1,108 @@
+import logging
+import time
+import asyncpg
+from metrics import metrics
+from pool import count_update_stat
+
+logger = logging.getLogger(__name__)
+
+
+class Query:
+    """Именованный SQL-запрос реестра"""
+
+    def __init__(self, name, sql, prepare=True):
+        self.name = name
+        self.sql = sql
+        # Подготавливать ли запрос заранее на каждом новом соединении
+        self.prepare = prepare
+
+
+class QueryRegistry:
+    """
+    Реестр SQL-запросов бота. Горячие запросы подготавливаются в кэше операторов
+    каждого нового соединения (хук init пула), поэтому первый запрос после
+    переподключения выполняется так же быстро, как и последующие.
+    По каждому запросу собираются количество вызовов и время выполнения (метрики sql.*).
+    """
+
+    def __init__(self):
+        self.queries = {}
+
+    def register(self, name, sql, prepare=True):
+        """Регистрирует запрос и возвращает его объект Query"""
+        if name in self.queries:
+            raise ValueError(f"Запрос {name} уже зарегистрирован")
+        query = Query(name, sql, prepare)
+        self.queries[name] = query
+        return query
+
+    async def prepare_connection(self, connection):
+        """
+        Хук init пула: подготавливает горячие запросы на новом соединении.
+        Операторы кладутся в собственный кэш asyncpg, которым пользуются
+        connection.fetch/fetchrow/execute, так что запросы выполняются без повторного Parse.
+        executemany() с пустым списком аргументов подготавливает оператор через этот кэш
+        и ничего не выполняет. connection.prepare() для этого не подходит: он кэш не заполняет,
+        а его PreparedStatement asyncpg делает недействительным при каждом возврате соединения в пул.
+        """
+        started = time.perf_counter()
+        for query in self.queries.values():
+            if not query.prepare:
+                continue
+            try:
+                await connection.executemany(query.sql, [])
+            except asyncpg.PostgresError as e:
+                # Например, в старой БД нет нужной таблицы: соединение остается рабочим,
+                # а ошибка повторится при первом реальном выполнении запроса
+                logger.warning("Не удалось подготовить запрос %s: %s", query.name, e)
+        metrics.increment('sql.connections_prepared')
+        metrics.observe('sql.prepare_connection_ms', (time.perf_counter() - started) * 1000)
+
+    async def _execute(self, db, query, method, args):
+        # db - соединение или пул
+        started = time.perf_counter()
+        count_update_stat('queries')
+        try:
+            return await getattr(db, method)(query.sql, *args)
+        finally:
+            metrics.increment(f'sql.{query.name}.calls')
+            metrics.observe(f'sql.{query.name}.ms', (time.perf_counter() - started) * 1000)
+
+    async def fetch(self, db, query, *args):
+        return await self._execute(db, query, 'fetch', args)
+
+    async def fetchrow(self, db, query, *args):
+        return await self._execute(db, query, 'fetchrow', args)
+
+    async def fetchval(self, db, query, *args):
+        return await self._execute(db, query, 'fetchval', args)
+
+    async def execute(self, db, query, *args):
+        return await self._execute(db, query, 'execute', args)
+
+    def cursor(self, connection, query, *args, prefetch=None):
+        """
+        Курсор asyncpg для построчного чтения результата (итерируется внутри транзакции).
+        Учитывается только число вызовов: время зависит от того, сколько строк прочитает вызывающий.
+        """
+        count_update_stat('queries')
+        metrics.increment(f'sql.{query.name}.calls')
+        return connection.cursor(query.sql, *args, prefetch=prefetch)
+
+    async def copy_to(self, connection, query, *args, output, format='csv', header=True):
+        """
+        Выгружает результат запроса через COPY ... TO STDOUT в output (путь, файл или корутина),
+        не собирая строки в памяти. Возвращает число выгруженных строк.
+        """
+        started = time.perf_counter()
+        count_update_stat('queries')
+        try:
+            status = await connection.copy_from_query(query.sql, *args, output=output, format=format, header=header)
+        finally:
+            metrics.increment(f'sql.{query.name}.calls')
+            metrics.observe(f'sql.{query.name}.ms', (time.perf_counter() - started) * 1000)
+        return int(status.split()[-1])
+
+
+# Единственный реестр запросов на процесс; модули регистрируют свои запросы при импорте
+registry = QueryRegistry()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from queries import registry
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """
+    Кэш справочных таблиц (бренды, модели, цвета, объемы памяти, рынки,
+    состояния, категории) в памяти процесса.
+    Загружается при старте бота, обновляется по TTL и явно - после изменения таблиц.
+    """
+
+    # Справочники читаются редко (при старте и по TTL), поэтому заранее не подготавливаются
+    QUERIES = {
+        table: registry.register(f'reference_{table}', sql, prepare=False)
+        for table, sql in (
+            ('brands', "SELECT id, name FROM brands ORDER BY name;"),
+            ('models', "SELECT id, name, brand_id FROM models ORDER BY name;"),
+            ('colors', "SELECT id, name FROM colors ORDER BY name;"),
+            ('storage_capacities', "SELECT id, capacity_gb FROM storage_capacities ORDER BY capacity_gb;"),
+            ('markets', "SELECT id, name, region, country_code FROM markets ORDER BY name;"),
+            ('conditions', "SELECT id, name FROM conditions ORDER BY id;"),
+            ('categories', "SELECT id, name FROM categories ORDER BY id;"),
+        )
+    }
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.loaded_at = 0.0
+        # Версия каждой таблицы увеличивается при изменении её содержимого
+        self.versions = {table: 0 for table in self.QUERIES}
+        self._rows = {table: [] for table in self.QUERIES}
+        self._by_id = {table: {} for table in self.QUERIES}
+        self._models_by_brand = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self, db, tables=None):
+        """
+        Загружает таблицы из БД. db - пул или соединение (нужен метод fetch).
+        tables: список таблиц для перезагрузки, по умолчанию все.
+        """
+        tables = tables or self.QUERIES.keys()
+        async with self._lock:
+            for table in tables:
+                rows = [dict(row) for row in await registry.fetch(db, self.QUERIES[table])]
+                if rows != self._rows[table]:
+                    self._set_rows(table, rows)
+            self.loaded_at = time.monotonic()
+
+    def _set_rows(self, table, rows):
+        self._rows[table] = rows
+        self._by_id[table] = {row['id']: row for row in rows}
+        self.versions[table] += 1
+        if table == 'models':
+            models_by_brand = {}
+            for row in rows:
+                models_by_brand.setdefault(row['brand_id'], []).append(row)
+            self._models_by_brand = models_by_brand
+
+    async def reload(self, db, *tables):
+        """Явная инвалидация: перечитывает указанные таблицы после их изменения"""
+        await self.load(db, tables)
+
+    async def refresh_periodically(self, db_pool):
+        """Фоновое обновление по TTL на случай изменений справочников в обход бота"""
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.load(db_pool)
+            except Exception:
+                # Остаются прежние данные, следующая попытка - через TTL
+                logger.exception("Ошибка при обновлении кэша справочников")
+
+    def list(self, table):
+        """Возвращает упорядоченный список строк таблицы"""
+        return self._rows[table]
+
+    def get(self, table, item_id):
+        """Возвращает строку таблицы по id или None"""
+        return self._by_id[table].get(item_id)
+
+    def models_for_brand(self, brand_id):
+        """Возвращает модели бренда, упорядоченные по названию"""
+        return self._models_by_brand.get(brand_id, [])
+
+    def find_category(self, name):
+        """Ищет категорию по названию без учета регистра"""
+        name = name.lower()
+        for category in self._rows['categories']:
+            if category['name'].lower() == name:
+                return category
+        return None
+
+
+# Единственный экземпляр кэша на процесс
+reference_cache = ReferenceCache()
@@ -0,0 +1,112 @@
+# Отчет о продажах по дням, неделям и месяцам (/sales) по таблице daily_sales.
+# Таблица обновляется инкрементально в запросах продажи (handlers.SALE_*_QUERY),
+# здесь - чтение с группировкой date_trunc и полный пересчет по истории транзакций.
+from datetime import date, timedelta
+from exporter import parse_export_date
+from queries import registry
+
+# Период -> (заголовок, формат даты в отчете)
+SALES_PERIODS = {
+    'day': ("по дням", '%d.%m.%Y'),
+    'week': ("по неделям", 'с %d.%m.%Y'),
+    'month': ("по месяцам", '%m.%Y'),
+}
+SALES_PERIOD_ALIASES = {'день': 'day', 'неделя': 'week', 'месяц': 'month'}
+# Число интервалов в отчете без указанных дат
+SALES_DEFAULT_BUCKETS = 12
+# Больше строк не помещается в одно сообщение
+SALES_REPORT_MAX_ROWS = 62
+
+SALES_REPORT_QUERY = registry.register('sales_report', """
+    SELECT date_trunc($1, day::timestamp)::date AS period,
+           SUM(phones_sold_count + products_sold_count) AS sold_count,
+           SUM(phones_revenue + products_revenue) AS revenue,
+           SUM(phones_cost + products_cost) AS cost
+    FROM daily_sales
+    WHERE day >= $2 AND day < $3
+    GROUP BY 1
+    ORDER BY 1;
+""")
+
+DAILY_SALES_CLEAR_QUERY = registry.register('daily_sales_clear', "DELETE FROM daily_sales;", prepare=False)
+
+# Тот же расчет, что и в миграции 0004_daily_sales.sql
+DAILY_SALES_REBUILD_QUERY = registry.register('daily_sales_rebuild', """
+    INSERT INTO daily_sales (day, phones_sold_count, phones_revenue, phones_cost,
+                             products_sold_count, products_revenue, products_cost)
+    SELECT t.timestamp::date,
+           COUNT(ph.id),
+           COALESCE(SUM(t.amount) FILTER (WHERE ph.id IS NOT NULL), 0),
+           COALESCE(SUM(ph.purchase_price), 0),
+           COUNT(pr.id),
+           COALESCE(SUM(t.amount * pr.quantity), 0),
+           COALESCE(SUM(pr.purchase_price * pr.quantity), 0)
+    FROM transactions t
+    LEFT JOIN phones ph ON ph.id = t.phone_id
+    LEFT JOIN products pr ON pr.id = t.product_id
+    WHERE t.type = 'sale' AND (ph.id IS NOT NULL OR pr.id IS NOT NULL)
+    GROUP BY 1;
+""", prepare=False)
+
+
+def default_range(period, today=None):
+    """Последние SALES_DEFAULT_BUCKETS интервалов, включая текущий: (с, по) с исключающей верхней границей"""
+    today = today or date.today()
+    if period == 'day':
+        start = today - timedelta(days=SALES_DEFAULT_BUCKETS - 1)
+    elif period == 'week':
+        start = today - timedelta(days=today.weekday(), weeks=SALES_DEFAULT_BUCKETS - 1)
+    else:
+        months = today.year * 12 + today.month - 1 - (SALES_DEFAULT_BUCKETS - 1)
+        start = date(months // 12, months % 12 + 1, 1)
+    return start, today + timedelta(days=1)
+
+
+def parse_sales_args(args):
+    """'month 01.01.2026 31.12.2026' -> ('month', date(2026, 1, 1), date(2027, 1, 1))"""
+    parts = (args or '').split()
+    period = parts.pop(0).lower() if parts else 'day'
+    period = SALES_PERIOD_ALIASES.get(period, period)
+    if period not in SALES_PERIODS or len(parts) > 2:
+        raise ValueError("Использование: /sales day|week|month [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]")
+    if not parts:
+        return (period, *default_range(period))
+    date_from = parse_export_date(parts[0])
+    date_to = parse_export_date(parts[1]) + timedelta(days=1) if len(parts) > 1 else date.today() + timedelta(days=1)
+    if date_from >= date_to:
+        raise ValueError("Дата начала периода позже даты окончания")
+    return period, date_from, date_to
+
+
+async def get_sales_report(connection, period, date_from, date_to):
+    return await registry.fetch(connection, SALES_REPORT_QUERY, period, date_from, date_to)
+
+
+async def rebuild_daily_sales(connection):
+    """Пересчитывает daily_sales по транзакциям продаж. Возвращает число дней с продажами"""
+    async with connection.transaction():
+        await registry.execute(connection, DAILY_SALES_CLEAR_QUERY)
+        status = await registry.execute(connection, DAILY_SALES_REBUILD_QUERY)
+    return int(status.split()[-1])
+
+
+def format_sales_report(rows, period, date_from, date_to):
+    title, date_format = SALES_PERIODS[period]
+    last_day = date_to - timedelta(days=1)
+    text = f"📈 **Продажи {title}** ({date_from:%d.%m.%Y} - {last_day:%d.%m.%Y})\n\n"
+    if not rows:
+        return text + "Продаж за период нет."
+    if len(rows) > SALES_REPORT_MAX_ROWS:
+        return text + f"Слишком много интервалов ({len(rows)}), выберите период короче или крупнее."
+
+    for row in rows:
+        margin = row['revenue'] - row['cost']
+        text += (f"▪️ {row['period'].strftime(date_format)}: {row['sold_count']} шт., "
+                 f"выручка {row['revenue']:.2f}, маржа {margin:.2f}\n")
+
+    revenue = sum(row['revenue'] for row in rows)
+    margin = revenue - sum(row['cost'] for row in rows)
+    margin_percent = margin / revenue * 100 if revenue > 0 else 0
+    text += (f"\n💵 **Итого**: {sum(row['sold_count'] for row in rows)} шт., выручка {revenue:.2f} руб., "
+             f"маржа {margin:.2f} руб. ({margin_percent:.1f}%)")
+    return text
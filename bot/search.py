@@ -0,0 +1,81 @@
+# Поиск телефонов и товаров для /find и inline-режима.
+# Опирается на триграммные GIN-индексы pg_trgm (migrations/0002_query_indexes.sql): по phones.search_text,
+# который триггер собирает из бренда, модели, цвета, памяти, IMEI и серийного номера
+# (и пересчитывает при переименовании справочников, 0005_phones_search_text_refs.sql),
+# и по lower(products.name). Совпадение подстроки (LIKE) ставится выше похожих слов (<%).
+from queries import registry
+
+PHONES_SEARCH_QUERY = registry.register('phones_search', """
+    SELECT p.id, p.name, p.purchase_price, p.sale_price, p.is_sold, p.imei, p.serial_number,
+           b.name AS brand_name, m.name AS model_name, c.name AS color_name, s.capacity_gb
+    FROM phones p
+    LEFT JOIN models m ON p.model_id = m.id
+    LEFT JOIN brands b ON m.brand_id = b.id
+    LEFT JOIN colors c ON p.color_id = c.id
+    LEFT JOIN storage_capacities s ON p.storage_capacity_id = s.id
+    WHERE p.search_text LIKE $2 OR $1 <% p.search_text
+    ORDER BY p.search_text LIKE $2 DESC, p.is_sold, word_similarity($1, p.search_text) DESC, p.id DESC
+    LIMIT $3;
+""")
+
+PRODUCTS_SEARCH_QUERY = registry.register('products_search', """
+    SELECT p.id, p.name, p.purchase_price, p.sale_price, p.quantity, p.is_sold,
+           c.name AS category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE lower(p.name) LIKE $2 OR $1 <% lower(p.name)
+    ORDER BY lower(p.name) LIKE $2 DESC, p.is_sold, word_similarity($1, lower(p.name)) DESC, p.id DESC
+    LIMIT $3;
+""")
+
+# Более короткие запросы не дают триграмм и не используют индекс
+SEARCH_MIN_QUERY_LENGTH = 2
+
+
+def build_search_params(text):
+    """
+    Нормализует поисковую строку.
+    Возвращает (текст для сравнения по сходству, шаблон LIKE со словами в том же порядке).
+    """
+    words = text.lower().split()
+    escaped = [word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for word in words]
+    return ' '.join(words), '%' + '%'.join(escaped) + '%'
+
+
+async def search_phones(connection, text, limit):
+    query_text, pattern = build_search_params(text)
+    return await registry.fetch(connection, PHONES_SEARCH_QUERY, query_text, pattern, limit)
+
+
+async def search_products(connection, text, limit):
+    query_text, pattern = build_search_params(text)
+    return await registry.fetch(connection, PRODUCTS_SEARCH_QUERY, query_text, pattern, limit)
+
+
+def format_phone_title(phone):
+    """Краткое название телефона: бренд, модель, память, цвет"""
+    title = f"{phone['brand_name']} {phone['model_name']}" if phone['brand_name'] and phone['model_name'] \
+        else phone['name']
+    if phone['capacity_gb']:
+        title += f" {phone['capacity_gb']} ГБ"
+    if phone['color_name']:
+        title += f" {phone['color_name']}"
+    return title
+
+
+def format_phone_details(phone):
+    """Строка с ID, ценой, статусом и идентификаторами телефона"""
+    status = "продан" if phone['is_sold'] else "в наличии"
+    details = f"ID {phone['id']} • {phone['purchase_price']:.2f} руб. • {status}"
+    if phone['imei']:
+        details += f" • IMEI {phone['imei']}"
+    if phone['serial_number']:
+        details += f" • S/N {phone['serial_number']}"
+    return details
+
+
+def format_product_details(product):
+    """Строка с ID, категорией, ценой и статусом товара"""
+    status = "продан" if product['is_sold'] else f"в наличии {product['quantity']} шт."
+    category = product['category_name'] or "без категории"
+    return f"ID {product['id']} • {category} • {product['purchase_price']:.2f} руб. • {status}"
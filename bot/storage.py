@@ -0,0 +1,94 @@
+import json
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from pool import current_db_session
+from queries import registry
+
+FSM_SET_STATE_QUERY = registry.register('fsm_set_state', """
+    INSERT INTO fsm_storage (key, state) VALUES ($1, $2)
+    ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP;
+""")
+
+FSM_GET_STATE_QUERY = registry.register('fsm_get_state', "SELECT state FROM fsm_storage WHERE key = $1;")
+
+FSM_SET_DATA_QUERY = registry.register('fsm_set_data', """
+    INSERT INTO fsm_storage (key, data) VALUES ($1, $2::jsonb)
+    ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP;
+""")
+
+FSM_GET_DATA_QUERY = registry.register('fsm_get_data', "SELECT data FROM fsm_storage WHERE key = $1;")
+
+
+def compact_json_dumps(data):
+    """Компактная сериализация данных FSM: без пробелов и без экранирования кириллицы"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage существующей БД.
+    Переживает перезапуск бота и позволяет запускать несколько его экземпляров.
+    Во время обработки апдейта запросы идут через его соединение (DatabaseSession),
+    поэтому FSM не занимает второе соединение пула; вне апдейта - через пул.
+    """
+
+    def __init__(self, db_pool, key_builder=None):
+        self.db_pool = db_pool
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    def _db(self):
+        return current_db_session.get() or self.db_pool
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        async with self._db().acquire() as connection:
+            await registry.execute(connection, FSM_SET_STATE_QUERY, self.key_builder.build(key), state)
+
+    async def get_state(self, key):
+        async with self._db().acquire() as connection:
+            return await registry.fetchval(connection, FSM_GET_STATE_QUERY, self.key_builder.build(key))
+
+    async def set_data(self, key, data):
+        data = compact_json_dumps(data) if data else None
+        async with self._db().acquire() as connection:
+            await registry.execute(connection, FSM_SET_DATA_QUERY, self.key_builder.build(key), data)
+
+    async def get_data(self, key):
+        async with self._db().acquire() as connection:
+            data = await registry.fetchval(connection, FSM_GET_DATA_QUERY, self.key_builder.build(key))
+        return json.loads(data) if data else {}
+
+    async def close(self):
+        # Пулом подключений управляет main.py
+        pass
+
+
+def create_fsm_storage(kind, db_pool=None, redis_url=None):
+    """
+    Создает хранилище FSM по названию:
+    memory - в памяти процесса (по умолчанию), postgres - таблица fsm_storage,
+    redis - Redis по адресу redis_url.
+    """
+    if kind == 'memory':
+        return MemoryStorage()
+
+    if kind == 'postgres':
+        return PostgresStorage(db_pool)
+
+    if kind == 'redis':
+        # Зависимость нужна только для этого режима
+        from redis.asyncio import Redis
+        return create_redis_storage(Redis.from_url(redis_url))
+
+    raise ValueError(f"Неизвестное хранилище FSM '{kind}': используйте memory, postgres или redis")
+
+
+def create_redis_storage(redis):
+    """
+    RedisStorage с ключами и сериализацией бота поверх клиента redis.asyncio.Redis.
+    Тесты передают сюда fakeredis, чтобы проверять хранилище без сервера Redis.
+    """
+    from aiogram.fsm.storage.redis import RedisStorage
+    key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+    return RedisStorage(redis, key_builder=key_builder, json_dumps=compact_json_dumps)
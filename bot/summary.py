@@ -0,0 +1,94 @@
+# Инкрементально поддерживаемая сводка для отчета по прибыли (таблица shop_summary).
+# Функции изменения принимают соединение и должны вызываться внутри той же транзакции,
+# что и изменение товаров/телефонов. Продажи учитываются прямо в запросе продажи
+# (handlers.process_sale), чтобы продажа оставалась одним запросом.
+from queries import registry
+
+SUMMARY_SELECT_QUERY = registry.register('summary_select', "SELECT * FROM shop_summary WHERE id = 1;")
+
+SUMMARY_LOCK_QUERY = registry.register(
+    'summary_lock', "SELECT * FROM shop_summary WHERE id = 1 FOR UPDATE;", prepare=False
+)
+
+SUMMARY_ADD_STOCK_QUERY = registry.register('summary_add_stock', """
+    UPDATE shop_summary
+    SET stock_investment = stock_investment + $1::numeric * $2::integer,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = 1;
+""")
+
+# Полный пересчет сводки по таблицам products и phones
+SUMMARY_REBUILD_QUERY = registry.register('summary_rebuild', """
+    INSERT INTO shop_summary (id, products_sold_count, products_profit, products_investment, products_revenue,
+                              phones_sold_count, phones_profit, phones_investment, phones_revenue,
+                              stock_investment, updated_at)
+    SELECT 1,
+           pr.count, pr.profit, pr.investment, pr.revenue,
+           ph.count, ph.profit, ph.investment, ph.revenue,
+           (SELECT COALESCE(SUM(purchase_price * quantity), 0) FROM products WHERE is_sold = FALSE) +
+           (SELECT COALESCE(SUM(purchase_price), 0) FROM phones WHERE is_sold = FALSE),
+           CURRENT_TIMESTAMP
+    FROM (
+        SELECT COUNT(*) AS count,
+               COALESCE(SUM((sale_price - purchase_price) * quantity), 0) AS profit,
+               COALESCE(SUM(purchase_price * quantity), 0) AS investment,
+               COALESCE(SUM(sale_price * quantity), 0) AS revenue
+        FROM products
+        WHERE is_sold = TRUE AND sale_price IS NOT NULL
+    ) AS pr, (
+        SELECT COUNT(*) AS count,
+               COALESCE(SUM(sale_price - purchase_price), 0) AS profit,
+               COALESCE(SUM(purchase_price), 0) AS investment,
+               COALESCE(SUM(sale_price), 0) AS revenue
+        FROM phones
+        WHERE is_sold = TRUE AND sale_price IS NOT NULL
+    ) AS ph
+    ON CONFLICT (id) DO UPDATE SET
+        products_sold_count = EXCLUDED.products_sold_count,
+        products_profit = EXCLUDED.products_profit,
+        products_investment = EXCLUDED.products_investment,
+        products_revenue = EXCLUDED.products_revenue,
+        phones_sold_count = EXCLUDED.phones_sold_count,
+        phones_profit = EXCLUDED.phones_profit,
+        phones_investment = EXCLUDED.phones_investment,
+        phones_revenue = EXCLUDED.phones_revenue,
+        stock_investment = EXCLUDED.stock_investment,
+        updated_at = EXCLUDED.updated_at
+    RETURNING *;
+""", prepare=False)
+
+# Поля сводки, сравниваемые при проверке пересчетом
+SUMMARY_FIELDS = (
+    'products_sold_count', 'products_profit', 'products_investment', 'products_revenue',
+    'phones_sold_count', 'phones_profit', 'phones_investment', 'phones_revenue',
+    'stock_investment',
+)
+
+
+async def add_stock(connection, purchase_price, quantity=1):
+    """Учитывает поступление товара/телефона в текущих инвестициях"""
+    await registry.execute(connection, SUMMARY_ADD_STOCK_QUERY, purchase_price, quantity)
+
+
+async def get_summary(connection):
+    """Возвращает строку сводки; если её ещё нет (старая БД), строит её пересчетом"""
+    summary = await registry.fetchrow(connection, SUMMARY_SELECT_QUERY)
+    if summary is None:
+        summary = await registry.fetchrow(connection, SUMMARY_REBUILD_QUERY)
+    return summary
+
+
+async def rebuild_summary(connection):
+    """
+    Пересчитывает сводку с нуля.
+    Возвращает (before, after, mismatched): значения до и после пересчета
+    и список полей, в которых инкрементальная сводка расходилась с пересчетом.
+    """
+    async with connection.transaction():
+        before = await registry.fetchrow(connection, SUMMARY_LOCK_QUERY)
+        after = await registry.fetchrow(connection, SUMMARY_REBUILD_QUERY)
+
+    if before is None:
+        return None, after, list(SUMMARY_FIELDS)
+    mismatched = [field for field in SUMMARY_FIELDS if before[field] != after[field]]
+    return before, after, mismatched
@@ -0,0 +1,5 @@
+# Модули бота импортируются без пакета (from handlers import ...), как при запуске из каталога bot
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
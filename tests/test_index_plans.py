@@ -0,0 +1,45 @@
+# Планы запросов бота должны использовать индексы из миграций (benchmarks/index_plans.py).
+# Нужна PostgreSQL со схемой бота: TEST_DATABASE_URL или DB_HOST, DB_NAME, DB_USER, DB_PASS.
+# Без доступной БД тест пропускается; тестовые данные откатываются.
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import asyncpg  # noqa: E402
+import index_plans  # noqa: E402
+from migrate import pending_migrations  # noqa: E402
+
+
+async def connect():
+    dsn = os.environ.get('TEST_DATABASE_URL')
+    if dsn:
+        return await asyncpg.connect(dsn)
+    if not os.environ.get('DB_NAME'):
+        pytest.skip("БД не настроена: задайте TEST_DATABASE_URL или DB_HOST, DB_NAME, DB_USER, DB_PASS")
+    return await asyncpg.connect(
+        host=os.environ.get('DB_HOST'), database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'), password=os.environ.get('DB_PASS'),
+    )
+
+
+def test_queries_use_expected_indexes():
+    async def scenario():
+        try:
+            connection = await connect()
+        except (OSError, asyncpg.PostgresError) as e:
+            pytest.skip(f"БД недоступна: {e}")
+        try:
+            pending = await pending_migrations(connection)
+            if pending:
+                pytest.skip(f"Схема БД устарела, не применены миграции: {', '.join(pending)}")
+            return await index_plans.run_checks(connection, verbose=False)
+        finally:
+            await connection.close()
+
+    failures = asyncio.run(scenario())
+    assert not failures, '\n\n'.join(
+        f"{mode} {name}: нет индекса {index}\n{plan}" for mode, name, index, plan in failures
+    )
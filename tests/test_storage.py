@@ -0,0 +1,42 @@
+# Хранилище FSM в Redis проверяется на fakeredis, без сервера Redis
+import asyncio
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from storage import create_redis_storage
+
+fakeredis = pytest.importorskip('fakeredis')
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=200)
+
+
+def test_redis_storage_round_trip():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        storage = create_redis_storage(redis)
+        await storage.set_state(KEY, 'PhoneCreation:waiting_for_imei')
+        await storage.set_data(KEY, {'name': 'iPhone 13', 'purchase_price': '45000.00'})
+
+        assert await storage.get_state(KEY) == 'PhoneCreation:waiting_for_imei'
+        assert await storage.get_data(KEY) == {'name': 'iPhone 13', 'purchase_price': '45000.00'}
+        # Данные сериализуются compact_json_dumps: без пробелов, кириллица не экранируется
+        await storage.set_data(KEY, {'category_name': 'Чехлы'})
+        assert await redis.get('fsm:1:100:200:default:data') == '{"category_name":"Чехлы"}'.encode()
+
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_redis_storage_keeps_users_apart():
+    async def scenario():
+        storage = create_redis_storage(fakeredis.aioredis.FakeRedis())
+        other = StorageKey(bot_id=1, chat_id=100, user_id=201)
+        await storage.set_data(KEY, {'step': 1})
+        assert await storage.get_data(other) == {}
+        await storage.close()
+
+    asyncio.run(scenario())